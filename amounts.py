@@ -0,0 +1,125 @@
+"""French amount-to-words conversion.
+
+Words for 0-999 are precomputed at import; larger numbers are composed from
+that table and full results are kept in a bounded LRU cache, since quantities
+times a fixed unit price repeat heavily across a batch.
+"""
+from functools import lru_cache
+
+# Full results kept in the LRU cache
+WORDS_CACHE_SIZE = 8192
+
+CURRENCY = ('dinar', 'dinars')
+SUBUNIT = ('centime', 'centimes')
+
+_UNITS = ["", "un", "deux", "trois", "quatre", "cinq", "six", "sept", "huit", "neuf",
+          "dix", "onze", "douze", "treize", "quatorze", "quinze", "seize", "dix-sept", "dix-huit", "dix-neuf"]
+_TENS = ["", "", "vingt", "trente", "quarante", "cinquante", "soixante"]
+
+
+def _below_hundred(num):
+    """Words for 1-99, following the traditional spelling (soixante-dix, quatre-vingt-dix)."""
+    if num < 20:
+        return _UNITS[num]
+    if num < 70:
+        tens, unit = divmod(num, 10)
+        if unit == 0:
+            return _TENS[tens]
+        if unit == 1:
+            return _TENS[tens] + " et un"
+        return _TENS[tens] + "-" + _UNITS[unit]
+    if num < 80:
+        # 70-79 are built on soixante + 10-19
+        return "soixante et onze" if num == 71 else "soixante-" + _UNITS[num - 60]
+    if num == 80:
+        return "quatre-vingts"
+    # 81-99 are built on quatre-vingt + 1-19, without "et"
+    return "quatre-vingt-" + _UNITS[num - 80]
+
+
+def _below_thousand(num):
+    """Words for 1-999."""
+    hundreds, rest = divmod(num, 100)
+    if hundreds == 0:
+        return _below_hundred(rest)
+    if hundreds == 1:
+        words = "cent"
+    else:
+        words = _UNITS[hundreds] + " cent"
+        if rest == 0:
+            words += "s"
+    if rest:
+        words += " " + _below_hundred(rest)
+    return words
+
+
+# Precomputed words for 0-999, and the invariable form used before "mille"
+# (deux cents, but deux cent mille; quatre-vingts, but quatre-vingt mille)
+BELOW_THOUSAND = ["zéro"] + [_below_thousand(num) for num in range(1, 1000)]
+BEFORE_MILLE = [words[:-1] if words.endswith(("cents", "vingts")) else words for words in BELOW_THOUSAND]
+
+
+@lru_cache(maxsize=WORDS_CACHE_SIZE)
+def _integer_words(n):
+    """Words for a non-negative integer."""
+    if n < 1000:
+        return BELOW_THOUSAND[n]
+
+    parts = []
+    milliards, rest = divmod(n, 1000000000)
+    millions, rest = divmod(rest, 1000000)
+    thousands, units = divmod(rest, 1000)
+    if milliards:
+        parts.append("un milliard" if milliards == 1 else _integer_words(milliards) + " milliards")
+    if millions:
+        parts.append("un million" if millions == 1 else BELOW_THOUSAND[millions] + " millions")
+    if thousands:
+        parts.append("mille" if thousands == 1 else BEFORE_MILLE[thousands] + " mille")
+    if units:
+        parts.append(BELOW_THOUSAND[units])
+    return " ".join(parts)
+
+
+def number_to_french_words(n):
+    """Convert an integer to French words."""
+    n = int(n)
+    if n < 0:
+        return "moins " + _integer_words(-n)
+    return _integer_words(n)
+
+
+def amount_to_french_words(amount, currency=CURRENCY, subunit=SUBUNIT):
+    """
+    Convert an amount to French words with its currency, e.g.
+    "mille deux cents dinars et cinquante centimes".
+
+    currency and subunit are (singular, plural) pairs; centimes are rounded
+    to two decimals and left out when zero.
+    """
+    cents = int(round(abs(amount) * 100))
+    units, centimes = divmod(cents, 100)
+
+    words = _integer_words(units)
+    if units >= 1000000 and units % 1000000 == 0:
+        # Round millions and milliards are nouns: "deux millions de dinars"
+        words += " de"
+    words += " " + (currency[0] if units <= 1 else currency[1])
+    if centimes:
+        words += " et " + _integer_words(centimes) + " " + (subunit[0] if centimes == 1 else subunit[1])
+    if amount < 0 and cents:
+        words = "moins " + words
+    return words
+
+
+def numbers_to_french_words(values):
+    """Convert a sequence of integers to French words, converting each distinct value once."""
+    values = [int(value) for value in values]
+    words = {value: number_to_french_words(value) for value in set(values)}
+    return [words[value] for value in values]
+
+
+def amounts_to_french_words(amounts, currency=CURRENCY, subunit=SUBUNIT):
+    """Convert a sequence of amounts to French words, converting each distinct amount once."""
+    amounts = [round(float(amount), 2) for amount in amounts]
+    words = {amount: amount_to_french_words(amount, currency, subunit) for amount in set(amounts)}
+    return [words[amount] for amount in amounts]
@@ -1,17 +1,22 @@
+import io
 import os
-import pandas as pd
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
+import json
+import time
 import datetime
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, jsonify
-from werkzeug.utils import secure_filename
+import threading
+from flask import Flask, Response, render_template, request, send_file, flash, redirect, url_for, jsonify, g
 import tempfile
 import logging
+import sqlalchemy
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
+from werkzeug.wsgi import ClosingIterator
+from workbook_reader import SUPPORTED_EXTENSIONS
+from metrics import GenerationStats, REQUEST_SECONDS, server_timing, observe_send, render_prometheus
+from warmup import DEFAULT_STEPS, Warmup
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; DEBUG also logs a sample of the extracted rows
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 class Base(DeclarativeBase):
     pass
@@ -33,563 +38,618 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 db.init_app(app)
 
 # Configuration
-UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv', 'ods', 'xlsm', 'xlsb'}
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+ALLOWED_EXTENSIONS = set(SUPPORTED_EXTENSIONS)
+# Max upload size; generation streams the workbook in chunks, so memory does not
+# grow with it and the limit can be raised for national-scale exports
+MAX_CONTENT_LENGTH = int(os.environ.get("MAX_UPLOAD_MB", 16)) * 1024 * 1024
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Uploads and streamed PDFs stay in memory up to these sizes, then spill to
+# anonymous private temp files removed when closed
+app.config['UPLOAD_SPOOL_MAX_BYTES'] = int(os.environ.get("UPLOAD_SPOOL_MAX_BYTES", 4 * 1024 * 1024))
+app.config['PDF_SPOOL_MAX_BYTES'] = int(os.environ.get("PDF_SPOOL_MAX_BYTES", 8 * 1024 * 1024))
+
+# Background generation jobs
+app.config['JOBS_FOLDER'] = os.environ.get("JOBS_FOLDER", os.path.join(tempfile.gettempdir(), "invoiceflow_jobs"))
+app.config['JOB_WORKERS'] = int(os.environ.get("JOB_WORKERS", 2))
+app.config['JOB_RETENTION_HOURS'] = int(os.environ.get("JOB_RETENTION_HOURS", 24))
+# Queued or running jobs without a heartbeat (every 30s) for this long belong to
+# a process that died: they are failed and identical uploads no longer join them
+app.config['JOB_STALE_SECONDS'] = int(os.environ.get("JOB_STALE_SECONDS", 180))
+
+# Cache of generated PDFs keyed by upload content and parameters (0 MB disables it)
+app.config['RESULT_CACHE_FOLDER'] = os.environ.get("RESULT_CACHE_FOLDER", os.path.join(tempfile.gettempdir(), "invoiceflow_cache"))
+app.config['RESULT_CACHE_MAX_MB'] = int(os.environ.get("RESULT_CACHE_MAX_MB", 512))
+app.config['RESULT_CACHE_MAX_AGE_HOURS'] = int(os.environ.get("RESULT_CACHE_MAX_AGE_HOURS", 24 * 7))
+
+# Multi-core PDF rendering: RENDER_WORKERS=0 uses every CPU, 1 keeps rendering serial
+app.config['RENDER_WORKERS'] = int(os.environ.get("RENDER_WORKERS", 0)) or os.cpu_count() or 1
+# 0 keeps generation.PARALLEL_RENDER_MIN_ROWS
+app.config['PARALLEL_RENDER_MIN_ROWS'] = int(os.environ.get("PARALLEL_RENDER_MIN_ROWS", 0))
+
+# Draw the static invoice skeleton once per document as a reusable PDF form
+app.config['RENDER_TEMPLATE'] = os.environ.get("RENDER_TEMPLATE", "1") == "1"
+
+# Record every generated invoice in the Invoice/InvoiceBatch ledger
+app.config['INVOICE_LEDGER'] = os.environ.get("INVOICE_LEDGER", "1") == "1"
+
+# Cold start: pandas, ReportLab and the fonts are loaded on first use; with
+# STARTUP_WARMUP they are loaded by a background thread once the worker is up.
+# INIT_DB_ON_START creates missing tables from that thread too, set it to 0
+# when `flask --app app init-db` is run as a deployment step instead
+app.config['STARTUP_WARMUP'] = os.environ.get("STARTUP_WARMUP", "1") == "1"
+app.config['INIT_DB_ON_START'] = os.environ.get("INIT_DB_ON_START", "1") == "1"
+
+# Pages kept for incremental regeneration of revised workbooks (0 MB disables it)
+app.config['INCREMENTAL_FOLDER'] = os.environ.get("INCREMENTAL_FOLDER", os.path.join(tempfile.gettempdir(), "invoiceflow_pages"))
+app.config['INCREMENTAL_MAX_MB'] = int(os.environ.get("INCREMENTAL_MAX_MB", 1024))
+app.config['INCREMENTAL_MAX_AGE_HOURS'] = int(os.environ.get("INCREMENTAL_MAX_AGE_HOURS", 24 * 31))
+
+# Seconds a worker serves its cached company profiles before checking for changes made elsewhere
+app.config['SETTINGS_CACHE_SECONDS'] = float(os.environ.get("SETTINGS_CACHE_SECONDS", 5))
+
+# Seconds a request waits for the tables to be created at startup
+SCHEMA_WAIT_SECONDS = 30
+
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension."""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def number_to_french_words(n):
-    """Convert a number to French words."""
-    if n == 0:
-        return "zéro"
-    
-    units = ["", "un", "deux", "trois", "quatre", "cinq", "six", "sept", "huit", "neuf"]
-    teens = ["dix", "onze", "douze", "treize", "quatorze", "quinze", "seize", "dix-sept", "dix-huit", "dix-neuf"]
-    tens = ["", "", "vingt", "trente", "quarante", "cinquante", "soixante", "soixante", "quatre-vingt", "quatre-vingt"]
-    
-    def convert_hundreds(num):
-        result = ""
-        if num >= 100:
-            if num // 100 == 1:
-                result += "cent"
-            else:
-                result += units[num // 100] + " cent"
-            if num % 100 == 0 and num // 100 > 1:
-                result += "s"
-            num %= 100
-            if num > 0:
-                result += " "
-        
-        if num >= 20:
-            if num < 70:
-                result += tens[num // 10]
-                if num % 10 > 0:
-                    if num // 10 == 2 and num % 10 == 1:
-                        result += " et un"
-                    else:
-                        result += "-" + units[num % 10]
-            elif num < 80:
-                result += "soixante"
-                if num % 10 > 0:
-                    if num % 10 < 10:
-                        result += "-" + units[num % 10]
-                    else:
-                        result += "-" + teens[num % 10]
-            else:
-                if num < 90:
-                    result += "quatre-vingt"
-                    if num % 10 > 0:
-                        result += "-" + units[num % 10]
-                    elif num == 80:
-                        result += "s"
-                else:
-                    result += "quatre-vingt"
-                    if num % 10 < 10:
-                        result += "-" + units[num % 10]
-                    else:
-                        result += "-" + teens[num % 10]
-        elif num >= 10:
-            result += teens[num - 10]
-        elif num > 0:
-            result += units[num]
-        
-        return result
-    
-    if n < 1000:
-        return convert_hundreds(n)
-    elif n < 1000000:
-        thousands = n // 1000
-        remainder = n % 1000
-        result = ""
-        if thousands == 1:
-            result = "mille"
-        else:
-            result = convert_hundreds(thousands) + " mille"
-        if remainder > 0:
-            result += " " + convert_hundreds(remainder)
-        return result
-    else:
-        millions = n // 1000000
-        remainder = n % 1000000
-        result = ""
-        if millions == 1:
-            result = "un million"
-        else:
-            result = convert_hundreds(millions) + " millions"
-        if remainder > 0:
-            if remainder >= 1000:
-                result += " " + number_to_french_words(remainder)
-            else:
-                result += " " + convert_hundreds(remainder)
-        return result
-
-def find_column(df_columns, possible_names):
-    """Find a column name from a list of possible variations."""
-    df_columns_lower = [col.lower().strip() for col in df_columns]
-    for possible in possible_names:
-        for i, col_lower in enumerate(df_columns_lower):
-            if possible.lower() in col_lower or col_lower in possible.lower():
-                return df_columns[i]
-    return None
+def generer_factures_pdf(fichier_excel, render_workers=None, **options):
+    """
+    Generate PDF invoices with the application's render settings.
 
-def safe_text_for_pdf(value, max_length=None):
-    """Safely convert value to string for PDF display, handling NaN and special characters."""
-    if pd.isna(value) or value is None:
-        return ""
+    See generation.generer_factures_pdf for the options; render_workers
+    overrides the RENDER_WORKERS setting.
+    """
+    import generation
     
-    try:
-        # Convert to string and replace problematic characters
-        text = str(value).strip()
-        # Replace common problematic characters
-        text = text.replace('é', 'e').replace('è', 'e').replace('ê', 'e').replace('ë', 'e')
-        text = text.replace('à', 'a').replace('â', 'a').replace('ä', 'a')
-        text = text.replace('ù', 'u').replace('û', 'u').replace('ü', 'u')
-        text = text.replace('ô', 'o').replace('ö', 'o')
-        text = text.replace('î', 'i').replace('ï', 'i')
-        text = text.replace('ç', 'c')
-        text = text.replace('É', 'E').replace('È', 'E').replace('Ê', 'E').replace('Ë', 'E')
-        text = text.replace('À', 'A').replace('Â', 'A').replace('Ä', 'A')
-        text = text.replace('Ù', 'U').replace('Û', 'U').replace('Ü', 'U')
-        text = text.replace('Ô', 'O').replace('Ö', 'O')
-        text = text.replace('Î', 'I').replace('Ï', 'I')
-        text = text.replace('Ç', 'C')
-        
-        if max_length and len(text) > max_length:
-            text = text[:max_length] + "..."
-            
-        return text
-    except Exception as e:
-        app.logger.warning(f"Error converting text for PDF: {e}")
-        return str(value)[:max_length] if max_length else str(value)
+    return generation.generer_factures_pdf(
+        fichier_excel,
+        render_workers=render_workers if render_workers is not None else app.config['RENDER_WORKERS'],
+        parallel_min_rows=app.config['PARALLEL_RENDER_MIN_ROWS'] or generation.PARALLEL_RENDER_MIN_ROWS,
+        use_template=app.config['RENDER_TEMPLATE'],
+        **options
+    )
 
-def generer_factures_pdf(fichier_excel, factures_par_page=1, fixed_invoice_number="FAC-001", invoice_date=None, company_name="", address="", rc_name="", nif="", item_name="", client_profession="", month_year="", rib="", unit_price=0.0):
-    """
-    Generate PDF invoices from Excel data with fixed invoice number.
-    Returns the path to the generated PDF file.
-    """
-    try:
-        # Read file based on extension with proper encoding handling
-        file_ext = fichier_excel.lower().split('.')[-1]
-        if file_ext == 'csv':
-            # Try different encodings and separators for CSV files
-            encodings_to_try = ['utf-8', 'latin-1', 'windows-1252', 'iso-8859-1']
-            separators_to_try = [',', ';', '\t']
-            df = None
-            last_error = None
-            
-            for encoding in encodings_to_try:
-                for separator in separators_to_try:
-                    try:
-                        df = pd.read_csv(fichier_excel, encoding=encoding, sep=separator)
-                        app.logger.info(f"Successfully read CSV file with encoding: {encoding} and separator: '{separator}'")
-                        # Check if we have enough columns
-                        if len(df.columns) > 50:  # Should have many columns for BF to exist
-                            break
-                    except UnicodeDecodeError as e:
-                        last_error = e
-                        app.logger.debug(f"Failed to read with encoding {encoding}, sep '{separator}': {e}")
-                        continue
-                    except Exception as e:
-                        last_error = e
-                        app.logger.debug(f"Error reading with encoding {encoding}, sep '{separator}': {e}")
-                        continue
-                if df is not None and len(df.columns) > 50:
-                    break
-            
-            if df is None:
-                raise ValueError(f"Impossible de lire le fichier CSV. Erreur d'encodage: {last_error}")
-        else:
-            # For Excel files, pandas handles encoding automatically
-            df = pd.read_excel(fichier_excel)
-        
-        # Check if dataframe is empty
-        if df.empty:
-            raise ValueError("Le fichier est vide ou ne contient pas de données valides.")
-        
-        # Read data from columns H, J, M, BF starting from row 3 until the last row
-        # Row 3 means index 2 (0-based)
-        start_row_index = 2
-        
-        # Check if we have at least 3 rows (index 0, 1, 2)
-        if len(df) <= start_row_index:
-            raise ValueError(f"Le fichier n'a que {len(df)} lignes. Au moins 3 lignes sont requises.")
-        
-        try:
-            # Column indices (Excel columns start from A=0, B=1, etc.)
-            name_col_index = 7   # Column H
-            address_col_index = 9  # Column J
-            breeder_card_col_index = 12  # Column M
-            quantity_col_index = 57  # Column BF - BF = B(1)*26 + F(5) = 57 in 0-based
-            
-            # Validate that we have enough columns
-            if len(df.columns) <= max(name_col_index, address_col_index, breeder_card_col_index, quantity_col_index):
-                raise ValueError(f"Le fichier n'a que {len(df.columns)} colonnes. Les colonnes H(8), J(10), M(13), BF(58) sont requises.")
-            
-            # Extract data from all rows starting from row 3
-            clients_data = []
-            
-            for row_idx in range(start_row_index, len(df)):
-                row = df.iloc[row_idx]
-                
-                client_name = safe_text_for_pdf(row.iloc[name_col_index])
-                client_address = safe_text_for_pdf(row.iloc[address_col_index])
-                breeder_card = safe_text_for_pdf(row.iloc[breeder_card_col_index])
-                quantity = row.iloc[quantity_col_index]
-                
-                # Convert quantity to numeric, default to 1 if invalid
-                try:
-                    quantity = float(quantity) if pd.notna(quantity) else 1.0
-                except (ValueError, TypeError):
-                    quantity = 1.0
-                
-                # Skip rows with empty names
-                if not client_name or client_name.strip() == "":
+def ledger_recorder(parameters, filename='', job_id=None):
+    """Return a ledger.LedgerRecorder for a new generation, or None when the ledger is disabled."""
+    if not app.config['INVOICE_LEDGER']:
+        return None
+    from ledger import LedgerRecorder
+    
+    return LedgerRecorder(db.engine, parameters, filename, job_id)
+
+def invoice_sequence(parameters):
+    """Return the numbering.InvoiceSequence of a sequentially numbered generation, None otherwise."""
+    if parameters.get('numbering') != 'sequential':
+        return None
+    from numbering import sequence_for
+    
+    return sequence_for(db.engine, parameters)
+
+def page_store(parameters):
+    """Return the incremental.PageStore of an incremental generation, None otherwise or when disabled."""
+    if not parameters.get('incremental') or app.config['INCREMENTAL_MAX_MB'] <= 0:
+        return None
+    from incremental import PageStore
+    
+    return PageStore(
+        app.config['INCREMENTAL_FOLDER'],
+        app.config['INCREMENTAL_MAX_MB'] * 1024 * 1024,
+        app.config['INCREMENTAL_MAX_AGE_HOURS'] * 3600
+    )
+
+def add_missing_columns():
+    """Add the model columns missing from tables created by an earlier version, nullable."""
+    inspector = sqlalchemy.inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
                     continue
-                    
-                clients_data.append({
-                    'nom': client_name,
-                    'adresse': client_address,
-                    'carte_eleveur': breeder_card,
-                    'quantite': quantity
-                })
-                
-                app.logger.info(f"Ligne {row_idx + 1}: Nom='{client_name}', Adresse='{client_address}', Carte='{breeder_card}', Quantité={quantity}")
-            
-            if not clients_data:
-                raise ValueError("Aucune donnée valide trouvée à partir de la ligne 3.")
-            
-            # Create a new dataframe with all the extracted data
-            df = pd.DataFrame(clients_data)
-            
-            # Update column references for PDF generation
-            name_col = 'nom'
-            address_col = 'adresse'
-            breeder_card_col = 'carte_eleveur'
-            quantity_col = 'quantite'
-            
-            app.logger.info(f"Total de {len(df)} clients trouvés pour générer les factures.")
-            
-        except Exception as e:
-            raise ValueError(f"Erreur lors de l'extraction des données des colonnes H, J, M, BF: {e}")
-        
-        # Use provided date or today's date
-        if invoice_date:
-            today = datetime.datetime.strptime(invoice_date, '%Y-%m-%d').strftime('%d/%m/%Y')
-        else:
-            today = datetime.date.today().strftime("%d/%m/%Y")
-        
-        # Use the fixed invoice number for ALL invoices
-        invoice_display = fixed_invoice_number
-        
-        # Create temporary PDF file
-        pdf_path = os.path.join(tempfile.gettempdir(), f"factures_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
-        
-        c = canvas.Canvas(pdf_path, pagesize=A4)
-        largeur, hauteur = A4
-        
-        factures_par_ligne = 2 if factures_par_page == 4 else 1
-        factures_par_col = factures_par_page // factures_par_ligne
-        largeur_facture = largeur / factures_par_ligne
-        hauteur_facture = hauteur / factures_par_col
-
-        for i, row in df.iterrows():
-            pos_x = (i % factures_par_ligne) * largeur_facture
-            pos_y = hauteur - ((i // factures_par_ligne) % factures_par_col + 1) * hauteur_facture
-
-            # Adjust font sizes and spacing based on number of invoices per page
-            if factures_par_page == 4:
-                header_font_size = 7
-                normal_font_size = 6
-                title_font_size = 8
-                line_spacing = 8
-                section_spacing = 15
-                table_height = 40
-                margin = 5
-            else:
-                header_font_size = 10
-                normal_font_size = 9
-                title_font_size = 12
-                line_spacing = 15
-                section_spacing = 35
-                table_height = 60
-                margin = 10
-
-            # Draw invoice frame
-            c.rect(pos_x+margin, pos_y+margin, largeur_facture-2*margin, hauteur_facture-2*margin)
-            
-            # Client header with name and address
-            y_pos = pos_y + hauteur_facture - 20
-            c.setFont("Helvetica", header_font_size)
-            if factures_par_page == 4:
-                # Shorter text for compact layout
-                c.drawString(pos_x+margin+5, y_pos, f"NOM: {safe_text_for_pdf(row[name_col], 15).upper()}")
-                y_pos -= line_spacing
-                c.drawString(pos_x+margin+5, y_pos, f"ADRESSE: {safe_text_for_pdf(row[address_col], 20)}")
-                y_pos -= line_spacing
-                c.drawString(pos_x+margin+5, y_pos, f"CARTE: {safe_text_for_pdf(row[breeder_card_col], 15)}")
-            else:
-                c.drawString(pos_x+20, y_pos, f"NOM ET PRENOM: {safe_text_for_pdf(row[name_col]).upper()}")
-                y_pos -= line_spacing
-                c.drawString(pos_x+20, y_pos, f"ADRESSE: {safe_text_for_pdf(row[address_col])}")
-                y_pos -= line_spacing
-                c.drawString(pos_x+20, y_pos, f"CARTE ELEVEUR: {safe_text_for_pdf(row[breeder_card_col])}")
-                y_pos -= line_spacing
-                c.drawString(pos_x+20, y_pos, f"PROFESSION: {safe_text_for_pdf(client_profession)}")
-            
-            # Invoice number and month (centered)
-            y_pos -= section_spacing
-            c.setFont("Helvetica-Bold", title_font_size)
-            invoice_text = f"FACTURE N°:"
-            text_width = c.stringWidth(invoice_text, "Helvetica-Bold", title_font_size)
-            c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos, invoice_text)
-            y_pos -= line_spacing
-            text_width = c.stringWidth(invoice_display, "Helvetica-Bold", title_font_size)
-            c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos, invoice_display)
-            y_pos -= line_spacing
-            c.setFont("Helvetica", normal_font_size)
-            month_text = f"MOIS : {month_year}"
-            text_width = c.stringWidth(month_text, "Helvetica", normal_font_size)
-            c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos, month_text)
-            
-            # Company details section
-            y_pos -= section_spacing
-            c.setFont("Helvetica-Bold", normal_font_size)
-            c.drawString(pos_x+margin+5, y_pos, f"DOIT : {company_name}")
-            y_pos -= line_spacing
-            c.setFont("Helvetica", normal_font_size-1)
-            if factures_par_page == 4:
-                # Split long address for compact layout
-                c.drawString(pos_x+margin+5, y_pos, f"ADRESSE: {address[:25]}")
-                y_pos -= line_spacing-2
-                c.drawString(pos_x+margin+5, y_pos, f"RC:{rc_name[:12]} NIF:{nif[:12]}")
-                y_pos -= line_spacing-2
-                c.drawString(pos_x+margin+5, y_pos, f"RIB:{rib[:15]}")
-            else:
-                c.drawString(pos_x+20, y_pos, f"ADRESSE: {address}")
-                y_pos -= 12
-                c.drawString(pos_x+20, y_pos, f" RC:{rc_name}    NIF: {nif}            RIB : {rib}")
-            
-            # Table with borders
-            y_pos -= section_spacing
-            table_start_y = y_pos
-            
-            # Adjust table columns positions based on layout
-            if factures_par_page == 4:
-                col1_x = pos_x + margin + 5   # Désignation
-                col2_x = pos_x + largeur_facture * 0.5  # Quantité/LITRE
-                col3_x = pos_x + largeur_facture * 0.7  # P.U
-                col4_x = pos_x + largeur_facture * 0.85  # Total
-                table_end_x = pos_x + largeur_facture - margin - 5
-            else:
-                col1_x = pos_x + 20   # Désignation
-                col2_x = pos_x + 200  # Quantité/LITRE
-                col3_x = pos_x + 280  # P.U
-                col4_x = pos_x + 350  # Total
-                table_end_x = pos_x + largeur_facture - 30
-            
-            # Draw table borders
-            c.rect(col1_x, y_pos - table_height, table_end_x - col1_x, table_height)
-            # Vertical lines
-            c.line(col2_x, y_pos, col2_x, y_pos - table_height)
-            c.line(col3_x, y_pos, col3_x, y_pos - table_height)
-            c.line(col4_x, y_pos, col4_x, y_pos - table_height)
-            # Horizontal line for header
-            header_line_y = y_pos - (table_height * 0.4)
-            c.line(col1_x, header_line_y, table_end_x, header_line_y)
-            
-            # Table header
-            c.setFont("Helvetica-Bold", normal_font_size-1)
-            if factures_par_page == 4:
-                c.drawString(col1_x + 2, y_pos - 8, "Désign.")
-                c.drawString(col2_x + 2, y_pos - 8, "Qté")
-                c.drawString(col3_x + 2, y_pos - 8, "P.U")
-                c.drawString(col4_x + 2, y_pos - 8, "Total")
-            else:
-                c.drawString(col2_x + 5, y_pos - 10, "Quantité/LITR")
-                c.drawString(pos_x + 25, y_pos - 22, "Désignation")
-                c.drawString(col2_x + 25, y_pos - 22, "E")
-                c.drawString(col3_x + 10, y_pos - 22, "P.U")
-                c.drawString(col4_x + 15, y_pos - 22, "Total")
-            
-            # Table content
-            if factures_par_page == 4:
-                y_pos -= table_height * 0.6
-            else:
-                y_pos -= 40
-            c.setFont("Helvetica", normal_font_size-1)
-            quantity = float(row[quantity_col])
-            total = quantity * unit_price
-            
-            if factures_par_page == 4:
-                # Compact layout for table content
-                c.drawString(col1_x + 2, y_pos, item_name[:8] + "..." if len(item_name) > 8 else item_name)
-                c.drawString(col2_x + 2, y_pos, str(int(quantity)))
-                c.drawString(col3_x + 2, y_pos, f"{unit_price:.0f}")
-                c.drawString(col4_x + 2, y_pos, f"{total:,.0f}")
-            else:
-                c.drawString(col1_x + 5, y_pos, item_name)
-                c.drawString(col2_x + 15, y_pos, str(int(quantity)))
-                c.drawString(col3_x + 10, y_pos, f"{unit_price:.2f}")
-                c.drawString(col4_x + 10, y_pos, f"{total:,.2f}")
-            
-            # Amount section
-            y_pos -= section_spacing
-            c.setFont("Helvetica-Bold", normal_font_size)
-            if factures_par_page == 4:
-                c.drawString(col1_x, y_pos, f"Montant: {total:,.0f}")
-            else:
-                c.drawString(col3_x, y_pos, f"Montant                        {total:,.2f}")
-            
-            # Amount in French words
-            y_pos -= line_spacing
-            c.setFont("Helvetica", normal_font_size-2)
-            amount_words = number_to_french_words(int(total))
-            if factures_par_page == 4:
-                # Truncate text for compact layout
-                words_text = f"Arrêté: {amount_words[:30]}... dinars"
-                c.drawString(pos_x + margin + 5, y_pos, words_text)
-            else:
-                c.drawString(pos_x + 20, y_pos, f"Arrêté la présente facture à la somme de : {amount_words} dinars")
-
-            if (i+1) % factures_par_page == 0:
-                c.showPage()
-
-        c.save()
-        return pdf_path
-        
-    except Exception as e:
-        app.logger.error(f"Erreur lors de la génération du PDF: {str(e)}")
-        raise
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                default = ''
+                if column.server_default is not None:
+                    quoted = str(column.server_default.arg).replace("'", "''")
+                    default = f" DEFAULT '{quoted}'"
+                connection.execute(sqlalchemy.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+                app.logger.info(f"Colonne {table.name}.{column.name} ajoutée")
+    # Indexes of the new columns
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def init_database():
+    """Create the missing tables and columns; needs an application context."""
+    # Import models to ensure tables are created
+    import models
+    from numbering import create_sequence_table
+    
+    db.create_all()
+    add_missing_columns()
+    create_sequence_table(db.engine)
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create the database tables."""
+    # The startup warm-up may be creating them too
+    schema_ready.wait(SCHEMA_WAIT_SECONDS)
+    init_database()
+    print("Tables créées.")
+
+schema_ready = threading.Event()
+
+def create_schema():
+    try:
+        with app.app_context():
+            init_database()
+    finally:
+        schema_ready.set()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # /health answers at once, to report the warm-up while the tables are created
+    if not app.config['INIT_DB_ON_START'] or request.endpoint == 'health':
+        return None
+    if not schema_ready.is_set():
+        schema_ready.wait(SCHEMA_WAIT_SECONDS)
+    if warmup.failed_step == 'schema':
+        return jsonify({'error': f"Base de données indisponible: {warmup.error}"}), 503
+    return None
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+def timed_send(response, timings=None):
+    """Attach a Server-Timing header to a PDF response and record the send phase once the body is sent."""
+    if timings:
+        response.headers['Server-Timing'] = server_timing(timings)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if isinstance(file_wrapper, type) and isinstance(response.response, file_wrapper):
+        # Wrapping the body would disable the server's sendfile() path, leave it untimed
+        return response
+    # send_file responses are passed through as is, so call_on_close would never fire
+    sending_since = time.perf_counter()
+    response.response = ClosingIterator(response.response, lambda: observe_send(time.perf_counter() - sending_since))
+    return response
 
 @app.route('/')
 def index():
-    """Main page with file upload form."""
+    """Main page with file upload form, filled in from the chosen (by default the first) profile."""
     today = datetime.date.today().strftime('%Y-%m-%d')
     
-    # Import models here to avoid circular imports
-    from models import CompanySettings
+    # Import profiles here to avoid circular imports
+    from profiles import list_profiles, get_profile
     
-    # Get saved company settings
-    settings = CompanySettings.query.first()
+    # Saved profiles come from the per-process cache
+    profiles = list_profiles()
+    # ?profile=new shows an empty form
+    profile_id = request.args.get('profile', type=int)
+    if profile_id is not None:
+        settings = get_profile(profile_id)
+    else:
+        settings = profiles[0] if profiles and request.args.get('profile') != 'new' else None
     
-    return render_template('index.html', today=today, settings=settings)
+    return render_template('index.html', today=today, settings=settings, profiles=profiles)
 
 @app.route('/save_settings', methods=['POST'])
 def save_settings():
-    """Save company settings to database."""
-    from models import CompanySettings
+    """Save the company settings of the form to the selected profile, or to a new one."""
+    from profiles import save_profile
     
     try:
-        # Get existing settings or create new
-        settings = CompanySettings.query.first()
-        if not settings:
-            settings = CompanySettings()
-        
-        # Update settings from form
-        settings.company_name = request.form.get('company_name', '')
-        settings.address = request.form.get('address', '')
-        settings.rc_name = request.form.get('rc_name', '')
-        settings.nif = request.form.get('nif', '')
-        settings.item_name = request.form.get('item_name', '')
-        settings.client_profession = request.form.get('client_profession', '')
-        settings.rib = request.form.get('rib', '')
-        settings.unit_price = float(request.form.get('unit_price', 0))
-        
-        db.session.add(settings)
-        db.session.commit()
+        values = {
+            'name': request.form.get('profile_name', '').strip(),
+            'company_name': request.form.get('company_name', ''),
+            'address': request.form.get('address', ''),
+            'rc_name': request.form.get('rc_name', ''),
+            'nif': request.form.get('nif', ''),
+            'item_name': request.form.get('item_name', ''),
+            'client_profession': request.form.get('client_profession', ''),
+            'rib': request.form.get('rib', ''),
+            'unit_price': float(request.form.get('unit_price', 0)),
+        }
+        # "Enregistrer comme nouveau profil" leaves the selected profile untouched
+        profile_id = None if request.form.get('new_profile') else request.form.get('profile_id', type=int)
+        profile = save_profile(values, profile_id)
         
         flash('Paramètres sauvegardés avec succès!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('index', profile=profile['id']))
         
     except Exception as e:
         app.logger.error(f"Erreur lors de la sauvegarde: {str(e)}")
         flash(f'Erreur lors de la sauvegarde: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+@app.route('/profiles')
+def company_profiles():
+    """List the saved company profiles."""
+    from profiles import list_profiles
+    
+    return jsonify({'profiles': list_profiles()})
+
+def wants_json():
+    """Check whether the client asked for a JSON response (AJAX form submission)."""
+    return request.accept_mimetypes.best == 'application/json'
+
+def generation_error(message, status=400):
+    """Report a generation error as JSON or as a flashed message, depending on the client."""
+    if wants_json():
+        return jsonify({'error': message}), status
+    flash(message, 'error')
+    return redirect(url_for('index'))
+
+def uploaded_workbook():
+    """Return (file, None) for an acceptable workbook upload, or (None, error message)."""
+    # Check if file was uploaded
+    if 'file' not in request.files:
+        return None, 'Aucun fichier sélectionné'
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, 'Aucun fichier sélectionné'
+    
+    if not file or not file.filename or not allowed_file(file.filename):
+        return None, 'Type de fichier non autorisé. Veuillez utiliser un fichier Excel (.xlsx ou .xls)'
+    
+    return file, None
+
+def form_parameters():
+    """
+    Read the batch parameters of the generation form.
+
+    With a profile_id the company fields default to that saved profile, so
+    they need not be sent; fields present in the form still take precedence.
+    Raises ValueError for an unknown profile or invalid options.
+    """
+    import generation
+    
+    company = {'company_name': '', 'address': '', 'rc_name': '', 'nif': '', 'item_name': '', 'client_profession': '', 'rib': '', 'unit_price': 0.0}
+    profile_id = request.form.get('profile_id', type=int)
+    if profile_id is not None:
+        from profiles import PROFILE_FIELDS, get_profile
+        
+        profile = get_profile(profile_id)
+        if profile is None:
+            raise ValueError("Profil introuvable.")
+        company = {field: profile[field] for field in PROFILE_FIELDS}
+    for field in company:
+        if field in request.form:
+            company[field] = request.form[field]
+    
+    parameters = {
+        'factures_par_page': int(request.form.get('factures_par_page', 1)),
+        'fixed_invoice_number': request.form.get('fixed_invoice_number', 'FAC-001'),  # Fixed invoice number
+        'invoice_date': request.form.get('invoice_date'),
+        'month_year': request.form.get('month_year', ''),
+        # Company information
+        **company,
+        'unit_price': float(company['unit_price'] or 0),
+        # "fixed" prints fixed_invoice_number on every invoice, "sequential" uses it as a prefix
+        'numbering': request.form.get('numbering', 'fixed'),
+        # Redraw only the pages whose invoices changed since the last generation of the batch
+        'incremental': request.form.get('incremental') == '1',
+        # "fast", "compact" (smallest file) or "archive" (compact plus document metadata)
+        'output_profile': request.form.get('output_profile', 'compact'),
+    }
+    # Option errors are the user's, report them before anything is queued
+    generation.build_render_options(**parameters)
+    return parameters
+
+@app.route('/validate', methods=['POST'])
+def validate_upload():
+    """Dry-run the uploaded workbook: report row counts, totals and layout errors without rendering."""
+    file, upload_error = uploaded_workbook()
+    if upload_error:
+        return jsonify({'error': upload_error}), 400
+    
+    try:
+        unit_price = float(request.form.get('unit_price') or 0)
+    except ValueError:
+        return jsonify({'error': 'Prix unitaire invalide'}), 400
+    
+    import generation
+    
+    report = generation.validate_workbook(file.stream, file.filename.rsplit('.', 1)[1], unit_price)
+    report['filename'] = file.filename
+    return jsonify(report)
+
+@app.route('/preview', methods=['POST'])
+def preview_invoices():
+    """Render the first page of the invoices in the chosen layout, shown inline."""
+    import generation
+    
+    file, upload_error = uploaded_workbook()
+    if upload_error:
+        return generation_error(upload_error)
+    
+    pdf_buffer = io.BytesIO()
+    try:
+        generation.generer_apercu_pdf(
+            file.stream,
+            pdf_buffer,
+            file_ext=file.filename.rsplit('.', 1)[1],
+            use_template=app.config['RENDER_TEMPLATE'],
+            **form_parameters()
+        )
+    except ValueError as e:
+        return generation_error(str(e))
+    except Exception as e:
+        app.logger.error(f"Erreur lors de l'aperçu: {str(e)}")
+        return generation_error(f"Erreur lors de l'aperçu des factures: {str(e)}", 500)
+    
+    pdf_buffer.seek(0)
+    return send_file(pdf_buffer, mimetype='application/pdf', download_name='apercu.pdf')
+
 @app.route('/generate', methods=['POST'])
 def generate_invoices():
-    """Generate PDF invoices from uploaded Excel file."""
+    """Queue PDF invoice generation for the uploaded Excel file and return the job ID."""
+    from jobs import submit_job
+
     try:
-        # Check if file was uploaded
-        if 'file' not in request.files:
-            flash('Aucun fichier sélectionné', 'error')
-            return redirect(url_for('index'))
-        
-        file = request.files['file']
-        if file.filename == '':
-            flash('Aucun fichier sélectionné', 'error')
-            return redirect(url_for('index'))
-        
-        if not file or not file.filename or not allowed_file(file.filename):
-            flash('Type de fichier non autorisé. Veuillez utiliser un fichier Excel (.xlsx ou .xls)', 'error')
-            return redirect(url_for('index'))
+        file, upload_error = uploaded_workbook()
+        if upload_error:
+            return generation_error(upload_error)
         
-        # Save uploaded file temporarily
-        filename = secure_filename(file.filename)
-        temp_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_file_path)
+        try:
+            parameters = form_parameters()
+        except ValueError as e:
+            return generation_error(str(e))
         
-        # Get form parameters
-        factures_par_page = int(request.form.get('factures_par_page', 1))
-        fixed_invoice_number = request.form.get('fixed_invoice_number', 'FAC-001')  # Fixed invoice number
-        invoice_date = request.form.get('invoice_date')
-        month_year = request.form.get('month_year', '')
+        # One PDF per client, zipped and streamed back as the invoices are rendered
+        if request.values.get('output') == 'zip':
+            return stream_zip_invoices(file, parameters)
         
-        # Company information
-        company_name = request.form.get('company_name', '')
-        address = request.form.get('address', '')
-        rc_name = request.form.get('rc_name', '')
-        nif = request.form.get('nif', '')
-        item_name = request.form.get('item_name', '')
-        client_profession = request.form.get('client_profession', '')
-        rib = request.form.get('rib', '')
-        unit_price = float(request.form.get('unit_price', 0))
+        # Synchronous mode: parse the upload from the request and stream the PDF back
+        if request.values.get('stream') == '1' or request.accept_mimetypes.best == 'application/pdf':
+            return stream_invoices(file, parameters)
         
-        # Generate PDF
-        pdf_path = generer_factures_pdf(
-            fichier_excel=temp_file_path,
-            factures_par_page=factures_par_page,
-            fixed_invoice_number=fixed_invoice_number,  # Use fixed invoice number
-            invoice_date=invoice_date,
-            company_name=company_name,
-            address=address,
-            rc_name=rc_name,
-            nif=nif,
-            item_name=item_name,
-            client_profession=client_profession,
-            month_year=month_year,
-            rib=rib,
-            unit_price=unit_price
-        )
+        job, cached = submit_job(file, parameters)
         
-        # Clean up temporary Excel file
-        os.remove(temp_file_path)
+        # Identical request already rendered: hand out the existing PDF right away
+        if cached and not wants_json():
+            return job_download(job.id)
         
-        # Return PDF file
-        return send_file(
-            pdf_path,
-            as_attachment=True,
-            download_name=f'factures_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf',
-            mimetype='application/pdf'
-        )
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'cached': cached,
+            'status_url': url_for('job_status', job_id=job.id),
+            'download_url': url_for('job_download', job_id=job.id),
+        }), 200 if job.status == 'done' else 202
         
     except Exception as e:
         app.logger.error(f"Erreur lors de la génération: {str(e)}")
-        flash(f'Erreur lors de la génération des factures: {str(e)}', 'error')
-        return redirect(url_for('index'))
+        return generation_error(f'Erreur lors de la génération des factures: {str(e)}', 500)
 
-# Initialize database tables
-with app.app_context():
-    # Import models to ensure tables are created
-    import models
-    db.create_all()
+def stream_invoices(file, parameters):
+    """Render the upload straight from the request stream into a spooled buffer and stream it back."""
+    from jobs import get_result_cache, generation_cache_key
+    
+    download_name = f'factures_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+    # Sequentially numbered invoices differ on every run and are never cached
+    cached_path = None
+    if parameters.get('numbering') != 'sequential':
+        cached_path = get_result_cache().get(generation_cache_key(file, parameters))
+    if cached_path is not None:
+        return send_file(cached_path, as_attachment=True, download_name=download_name, mimetype='application/pdf')
+    
+    stats = GenerationStats()
+    pdf_buffer = tempfile.SpooledTemporaryFile(max_size=app.config['PDF_SPOOL_MAX_BYTES'])
+    try:
+        generer_factures_pdf(
+            fichier_excel=file.stream,
+            file_ext=file.filename.rsplit('.', 1)[1],
+            output_path=pdf_buffer,
+            stats=stats,
+            recorder=ledger_recorder(parameters, file.filename),
+            sequence=invoice_sequence(parameters),
+            page_store=page_store(parameters),
+            **parameters
+        )
+        pdf_buffer.seek(0)
+    except Exception:
+        pdf_buffer.close()
+        raise
+    
+    response = send_file(pdf_buffer, as_attachment=True, download_name=download_name, mimetype='application/pdf')
+    response.call_on_close(pdf_buffer.close)
+    if parameters.get('incremental'):
+        response.headers['X-Invoices-Reused'] = str(stats.reused_rows)
+        response.headers['X-Invoices-Rendered'] = str(stats.rows - stats.reused_rows)
+    return timed_send(response, stats.timings)
+
+def stream_zip_invoices(file, parameters):
+    """Stream one PDF per client as a ZIP archive, each entry sent as soon as it is rendered."""
+    import generation
+    
+    stats = GenerationStats()
+    chunks = generation.generer_factures_zip(
+        file.stream,
+        file_ext=file.filename.rsplit('.', 1)[1],
+        stats=stats,
+        render_workers=app.config['RENDER_WORKERS'],
+        parallel_min_rows=app.config['PARALLEL_RENDER_MIN_ROWS'] or generation.PARALLEL_RENDER_MIN_ROWS,
+        use_template=app.config['RENDER_TEMPLATE'],
+        recorder=ledger_recorder(parameters, file.filename),
+        sequence=invoice_sequence(parameters),
+        **parameters
+    )
+    
+    download_name = f'factures_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+    response = Response(chunks, mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    # Only parsing and extraction are done when the headers are sent
+    return timed_send(response, stats.timings)
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Report result cache counters for this worker process."""
+    from jobs import get_result_cache
+    
+    return jsonify(get_result_cache().stats())
+
+@app.route('/metrics')
+def metrics():
+    """Expose generation histograms and cache counters of this worker process to Prometheus."""
+    from jobs import get_result_cache
+    
+    cache = get_result_cache().stats()
+    cache_lines = []
+    for name, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('entries', 'gauge'), ('bytes', 'gauge')):
+        metric = f"invoiceflow_result_cache_{name}" + ('_total' if kind == 'counter' else '')
+        cache_lines.extend([f"# TYPE {metric} {kind}", f"{metric} {cache[name]}"])
+    
+    return render_prometheus(cache_lines), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/invoices')
+def search_invoices():
+    """Search the recorded invoices by breeder card, client name prefix, month, invoice number or batch, page by page."""
+    from ledger import search_invoices as search
+    
+    invoices, next_after = search(
+        card=request.args.get('card'),
+        client=request.args.get('client'),
+        month=request.args.get('month'),
+        number=request.args.get('number'),
+        batch_id=request.args.get('batch', type=int),
+        after=request.args.get('after', type=int),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    payload = {'invoices': [invoice.to_dict() for invoice in invoices], 'next_after': next_after}
+    if next_after is not None:
+        payload['next_url'] = url_for('search_invoices', **dict(request.args.items(), after=next_after))
+    return jsonify(payload)
+
+@app.route('/invoices/batches/<int:batch_id>')
+def invoice_batch(batch_id):
+    """Report a recorded batch of invoices and its totals."""
+    from models import InvoiceBatch
+    
+    batch = db.session.get(InvoiceBatch, batch_id)
+    if batch is None:
+        return jsonify({'error': 'Lot introuvable'}), 404
+    return jsonify(batch.to_dict())
+
+@app.route('/mappings')
+def column_mappings():
+    """List the stored column mappings, one per workbook header seen, most recent first."""
+    from column_mapping import describe_mapping, get_mapping_store
+    
+    return jsonify({'mappings': [describe_mapping(mapping) for mapping in get_mapping_store().mappings()]})
+
+@app.route('/mappings/<signature>', methods=['GET', 'PUT', 'DELETE'])
+def column_mapping(signature):
+    """
+    Review, override or forget the column mapping of a workbook header.
+
+    PUT takes a JSON object of fields (nom, adresse, carte_eleveur, quantite)
+    to column letters or header texts, e.g. {"quantite": "BG"}; other fields
+    keep their column. DELETE forgets the mapping, the next workbook with
+    that header is detected again.
+    """
+    from column_mapping import describe_mapping, get_mapping_store, override_columns
+    
+    store = get_mapping_store()
+    mapping = store.get(signature)
+    if mapping is None:
+        return jsonify({'error': 'Correspondance introuvable'}), 404
+    
+    if request.method == 'DELETE':
+        store.delete(signature)
+        return jsonify({'deleted': signature})
+    if request.method == 'PUT':
+        values = request.get_json(silent=True)
+        if not isinstance(values, dict) or not values:
+            return jsonify({'error': 'Corps JSON attendu, par exemple {"quantite": "BF"}'}), 400
+        try:
+            mapping = override_columns(mapping, values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        app.logger.info(f"Correspondance {signature[:12]} modifiée: {values}")
+    return jsonify(describe_mapping(mapping))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status and progress of a generation job."""
+    from models import GenerationJob
+    
+    job = db.session.get(GenerationJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Tâche introuvable'}), 404
+    
+    payload = job.to_dict()
+    if job.status == 'done':
+        payload['download_url'] = url_for('job_download', job_id=job.id)
+    return jsonify(payload)
+
+@app.route('/jobs/<job_id>/download')
+def job_download(job_id):
+    """Serve the PDF produced by a finished generation job."""
+    from models import GenerationJob
+    
+    job = db.session.get(GenerationJob, job_id)
+    if job is None:
+        return jsonify({'error': 'Tâche introuvable'}), 404
+    if job.status != 'done' or not job.result_path:
+        return jsonify({'error': "Les factures ne sont pas encore prêtes", 'status': job.status}), 409
+    if not os.path.exists(job.result_path):
+        return jsonify({'error': "Le fichier PDF a expiré, veuillez relancer la génération", 'status': job.status}), 410
+    
+    response = send_file(
+        job.result_path,
+        as_attachment=True,
+        download_name=f'factures_{job.created_at.strftime("%Y%m%d_%H%M%S")}.pdf',
+        mimetype='application/pdf'
+    )
+    # Cached jobs were never rendered here and carry no timings
+    job_metrics = json.loads(job.metrics) if job.metrics else {}
+    return timed_send(response, job_metrics.get('timings'))
+
+@app.route('/health')
+def health():
+    """Liveness and warm-up state of this worker process; ready once the warm-up has succeeded, 503 if it failed."""
+    failed = warmup.state == 'failed'
+    return jsonify({
+        'status': 'error' if failed else 'ok',
+        'ready': warmup.state == 'done',
+        'schema_ready': schema_ready.is_set() and warmup.failed_step != 'schema',
+        'warmup': warmup.to_dict(),
+    }), 503 if failed else 200
+
+def fail_abandoned_jobs():
+    """Fail the jobs left queued or running by a process that stopped, see jobs.fail_stale_jobs."""
+    from jobs import fail_stale_jobs
+    
+    with app.app_context():
+        fail_stale_jobs()
+
+# Create the tables and load the rendering stack in the background, after the
+# module is imported and the worker can accept connections
+warmup = Warmup(
+    ((('schema', create_schema),) if app.config['INIT_DB_ON_START'] else ())
+    + (('jobs', fail_abandoned_jobs),)
+    + (DEFAULT_STEPS if app.config['STARTUP_WARMUP'] else ())
+)
+if not app.config['INIT_DB_ON_START']:
+    schema_ready.set()
+warmup.start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,52 @@
+"""ZIP archives streamed entry by entry.
+
+zipfile writes to any object with write() and tell(); without seek() it
+switches to data descriptors and never goes back to patch headers, so the
+archive can be sent while it is being built. Only the entry being written
+and the central directory records (one small object per entry) are held
+in memory.
+"""
+import time
+import zipfile
+
+
+class _StreamSink:
+    """Write-only file object collecting the bytes zipfile writes until they are drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    """
+    Yield the bytes of a ZIP archive of the (name, data) pairs of entries as each entry is added.
+
+    PDFs are already compressed, so entries are stored by default.
+    """
+    sink = _StreamSink()
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for name, data in entries:
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = compression
+            info.external_attr = 0o644 << 16
+            archive.writestr(info, data)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,307 @@
+"""Headless batch generation of invoices from a directory of workbooks.
+
+Every workbook is rendered to its own PDF in a process pool, without starting
+the Flask application. Company settings come from the saved CompanySettings
+row of the database or from a TOML/JSON file, and a manifest.json with the
+outcome, row counts and timings of each file is written next to the PDFs.
+A failed workbook is recorded in the manifest and does not stop the batch.
+With --sequential every workbook takes its block of invoice numbers from the
+same database sequence as the web application, and with --incremental a
+revised workbook only redraws the pages whose invoices changed, reusing the
+pages rendered by the web application or an earlier run (INCREMENTAL_FOLDER).
+Like the web application, every invoice is recorded in the ledger of the
+database when it has the ledger tables, unless INVOICE_LEDGER=0.
+
+    python batch.py exports/2024-01/ --settings cooperative.toml --output-dir factures/
+    python batch.py "exports/*.xlsx" --settings-db --month-year "Janvier 2024"
+"""
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import datetime
+import tomllib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from generation import build_render_options, generer_factures_pdf
+from rendering import FACTURES_PAR_PAGE, OUTPUT_PROFILES
+from metrics import GenerationStats
+from workbook_reader import SUPPORTED_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# CompanySettings fields, then the per-generation options a settings file may also set
+COMPANY_FIELDS = ('company_name', 'address', 'rc_name', 'nif', 'item_name', 'client_profession', 'rib', 'unit_price')
+GENERATION_FIELDS = ('factures_par_page', 'fixed_invoice_number', 'invoice_date', 'month_year', 'numbering', 'incremental', 'output_profile')
+
+MANIFEST_NAME = 'manifest.json'
+
+# Flask-SQLAlchemy keeps the default relative SQLite database in the instance folder
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'invoices.db')}"
+
+# Same page store as the web application, so either can reuse the other's pages
+INCREMENTAL_FOLDER = os.environ.get('INCREMENTAL_FOLDER', os.path.join(tempfile.gettempdir(), 'invoiceflow_pages'))
+INCREMENTAL_MAX_MB = int(os.environ.get('INCREMENTAL_MAX_MB', 1024))
+INCREMENTAL_MAX_AGE_HOURS = int(os.environ.get('INCREMENTAL_MAX_AGE_HOURS', 24 * 31))
+
+# Same switch as the web application
+INVOICE_LEDGER = os.environ.get('INVOICE_LEDGER', '1') == '1'
+
+
+def find_workbooks(inputs):
+    """Expand directories and glob patterns into a sorted list of workbook paths."""
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            candidates = glob.glob(pattern) or [pattern]
+        for path in candidates:
+            extension = path.rsplit('.', 1)[-1].lower()
+            if os.path.isfile(path) and extension in SUPPORTED_EXTENSIONS:
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def load_settings_file(path):
+    """Read company settings and generation options from a TOML or JSON file."""
+    if path.lower().endswith('.toml'):
+        with open(path, 'rb') as f:
+            settings = tomllib.load(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            settings = json.load(f)
+    unknown = set(settings) - set(COMPANY_FIELDS) - set(GENERATION_FIELDS)
+    if unknown:
+        raise ValueError(f"Paramètres inconnus dans {path}: {', '.join(sorted(unknown))}")
+    return settings
+
+
+def load_settings_db(database_url, profile=None):
+    """Read a saved CompanySettings profile, by name or the first one, with plain SQLAlchemy, without the Flask app."""
+    from sqlalchemy import create_engine, MetaData, Table, select
+
+    engine = create_engine(database_url)
+    try:
+        table = Table('company_settings', MetaData(), autoload_with=engine)
+        query = select(table).order_by(table.c.id).limit(1)
+        if profile is not None:
+            query = query.where(table.c.name == profile)
+        with engine.connect() as connection:
+            row = connection.execute(query).mappings().first()
+    finally:
+        engine.dispose()
+    if row is None and profile is not None:
+        raise ValueError(f"Aucun profil « {profile} » n'est enregistré dans la base de données.")
+    if row is None:
+        raise ValueError("Aucun paramètre d'entreprise n'est enregistré dans la base de données.")
+    return {field: row[field] for field in COMPANY_FIELDS if row[field] is not None}
+
+
+def ledger_available(database_url):
+    """Check that the database has the ledger tables, created by the web application or `flask --app app init-db`."""
+    from sqlalchemy import create_engine, inspect
+    from ledger import BATCH_TABLE, INVOICE_TABLE
+
+    try:
+        engine = create_engine(database_url)
+        try:
+            inspector = inspect(engine)
+            return inspector.has_table(INVOICE_TABLE) and inspector.has_table(BATCH_TABLE)
+        finally:
+            engine.dispose()
+    except Exception as e:
+        logger.warning(f"Base de données inaccessible ({e})")
+        return False
+
+
+def output_names(workbooks):
+    """Map each workbook to a PDF file name, keeping names unique when two workbooks share a stem."""
+    names = {}
+    used = set()
+    for path in workbooks:
+        stem, extension = os.path.splitext(os.path.basename(path))
+        name = f"{stem}.pdf"
+        if name in used:
+            name = f"{stem}_{extension.lstrip('.')}.pdf"
+        counter = 2
+        while name in used:
+            name = f"{stem}_{counter}.pdf"
+            counter += 1
+        used.add(name)
+        names[path] = name
+    return names
+
+
+def process_workbook(source, output_path, parameters, database_url=None, ledger=False):
+    """Render one workbook in a pool process and return its manifest entry; ledger records its invoices."""
+    stats = GenerationStats()
+    started = time.perf_counter()
+    entry = {'source': source, 'output': output_path}
+    engine = None
+    try:
+        if parameters.get('numbering') == 'sequential' or ledger:
+            from sqlalchemy import create_engine
+
+            engine = create_engine(database_url)
+        sequence = None
+        if parameters.get('numbering') == 'sequential':
+            from numbering import sequence_for
+
+            sequence = sequence_for(engine, parameters)
+        recorder = None
+        if ledger:
+            from ledger import LedgerRecorder
+
+            recorder = LedgerRecorder(engine, parameters, os.path.basename(source))
+            entry['ledger_batch'] = recorder.batch_id
+        page_store = None
+        if parameters.get('incremental') and INCREMENTAL_MAX_MB > 0:
+            from incremental import PageStore
+
+            page_store = PageStore(INCREMENTAL_FOLDER, INCREMENTAL_MAX_MB * 1024 * 1024, INCREMENTAL_MAX_AGE_HOURS * 3600)
+        generer_factures_pdf(source, output_path=output_path, stats=stats, recorder=recorder, sequence=sequence, page_store=page_store, **parameters)
+        entry['status'] = 'done'
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = str(e)
+        # Do not leave a truncated PDF behind
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        entry['output'] = None
+    finally:
+        if engine is not None:
+            engine.dispose()
+    entry['seconds'] = round(time.perf_counter() - started, 6)
+    entry.update(stats.to_dict())
+    return entry
+
+
+def run_batch(workbooks, output_dir, parameters, workers, database_url=None, ledger=False):
+    """Render every workbook across a process pool and return the manifest entries in input order."""
+    os.makedirs(output_dir, exist_ok=True)
+    names = output_names(workbooks)
+    entries = {}
+
+    # Spawned workers only import the Flask-free generation modules
+    mp_context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=configure_logging) as pool:
+        futures = {
+            pool.submit(process_workbook, path, os.path.join(output_dir, names[path]), parameters, database_url, ledger): path
+            for path in workbooks
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                entry = future.result()
+            except Exception as e:
+                # The worker process itself died (out of memory, crash)
+                entry = {'source': path, 'output': None, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+            entries[path] = entry
+            if entry['status'] == 'done':
+                logger.info(f"{os.path.basename(path)}: {entry['rows']} factures en {entry['seconds']:.2f}s")
+            else:
+                logger.error(f"{os.path.basename(path)}: échec - {entry['error']}")
+    return [entries[path] for path in workbooks]
+
+
+def configure_logging():
+    """Log to stderr at LOG_LEVEL, in the main process and in every pool process."""
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format='%(levelname)s %(message)s')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Génère une facture PDF par classeur, sans passer par l'application web.")
+    parser.add_argument('inputs', nargs='+', help='dossiers, fichiers ou motifs glob des classeurs')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--settings', help="fichier TOML ou JSON des paramètres d'entreprise")
+    source.add_argument('--settings-db', action='store_true', help="paramètres enregistrés dans la base (DATABASE_URL)")
+    parser.add_argument('--profile', help="nom du profil d'entreprise à utiliser avec --settings-db (par défaut le premier)")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+    parser.add_argument('--output-dir', default='factures', help='dossier des PDF et du manifeste')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processus en parallèle')
+    parser.add_argument('--factures-par-page', type=int, choices=FACTURES_PAR_PAGE)
+    parser.add_argument('--invoice-number', dest='fixed_invoice_number')
+    parser.add_argument('--invoice-date', help='AAAA-MM-JJ, par défaut aujourd\'hui')
+    parser.add_argument('--month-year')
+    parser.add_argument('--sequential', dest='numbering', action='store_const', const='sequential',
+                        help="numéros séquentiels par entreprise et par année, réservés dans la base (DATABASE_URL)")
+    parser.add_argument('--incremental', action='store_const', const=True,
+                        help="ne redessiner que les pages dont une facture a changé depuis la génération précédente")
+    parser.add_argument('--output-profile', choices=OUTPUT_PROFILES,
+                        help="fast (rendu le plus rapide), compact (fichier le plus petit, par défaut) ou archive (compact avec les métadonnées du document)")
+    parser.add_argument('--no-template', action='store_true', help='redessiner le gabarit de chaque facture')
+    return parser
+
+
+def main(argv=None):
+    configure_logging()
+    args = build_parser().parse_args(argv)
+
+    workbooks = find_workbooks(args.inputs)
+    if not workbooks:
+        logger.error("Aucun classeur trouvé.")
+        return 2
+
+    if args.settings:
+        parameters = load_settings_file(args.settings)
+        settings_source = os.path.abspath(args.settings)
+    else:
+        parameters = load_settings_db(args.database_url, args.profile)
+        settings_source = f"database:{args.profile}" if args.profile else 'database'
+    for field in GENERATION_FIELDS:
+        value = getattr(args, field)
+        if value is not None:
+            parameters[field] = value
+    if args.no_template:
+        parameters['use_template'] = False
+    # Fail once here rather than once per workbook
+    build_render_options(**parameters)
+    if parameters.get('numbering') == 'sequential':
+        from sqlalchemy import create_engine
+        from numbering import create_sequence_table
+
+        engine = create_engine(args.database_url)
+        try:
+            create_sequence_table(engine)
+        finally:
+            engine.dispose()
+
+    ledger = INVOICE_LEDGER and ledger_available(args.database_url)
+    if INVOICE_LEDGER and not ledger:
+        logger.warning("Les tables du registre des factures sont absentes (flask --app app init-db), les factures ne seront pas enregistrées")
+
+    workers = max(1, min(args.workers, len(workbooks)))
+    logger.info(f"{len(workbooks)} classeurs à traiter sur {workers} processus")
+    started_at = datetime.datetime.now()
+    started = time.perf_counter()
+    entries = run_batch(workbooks, args.output_dir, parameters, workers, args.database_url, ledger)
+
+    failed = sum(1 for entry in entries if entry['status'] != 'done')
+    manifest = {
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - started, 3),
+        'settings_source': settings_source,
+        'parameters': parameters,
+        'workers': workers,
+        'ledger': ledger,
+        'succeeded': len(entries) - failed,
+        'failed': failed,
+        'rows': sum(entry.get('rows', 0) for entry in entries if entry['status'] == 'done'),
+        'files': entries,
+    }
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False, default=str)
+
+    logger.info(f"{manifest['succeeded']} PDF générés, {failed} échecs, manifeste: {manifest_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
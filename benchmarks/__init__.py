@@ -0,0 +1,8 @@
+"""Reproducible benchmarks of the invoice generation pipeline.
+
+workbooks.py generates synthetic breeder workbooks in the layout the readers
+expect; run.py times reading, extraction, rendering and end-to-end /generate
+on them and writes the results to JSON:
+
+    python -m benchmarks.run --sizes 1000 10000 --output bench.json
+"""
@@ -0,0 +1,419 @@
+"""Load-test the web application under concurrent uploads and write a JSON report.
+
+For every gunicorn configuration (--workers x --threads) the application is
+started locally with gunicorn against a throwaway SQLite database, its tables
+created with `flask init-db` beforehand. For every invoices-per-page layout and
+client concurrency, client threads then send a weighted mix of requests for
+--duration seconds:
+
+- generate: POST /generate?stream=1 with a synthetic workbook, reading the whole PDF
+- save: POST /save_settings of the first company profile
+- index: GET /
+
+The report gives, per configuration, layout and concurrency, the throughput,
+the p50/p90/p99/max latency and error rate of each kind of request, and the
+peak resident memory of every gunicorn worker, alone and with its render
+processes. --baseline compares the run with an earlier report and exits with
+status 1 when throughput, p99 latency or error rate regressed beyond --tolerance.
+
+    python -m benchmarks.loadtest --workers 1 2 --threads 1 4 --concurrency 4 --duration 20
+    python -m benchmarks.loadtest --mix generate=1 --layouts 4 --rows 10000 --baseline loadtest_before.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+# The benchmarks import the application modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run import RENDER_PARAMETERS, environment
+from benchmarks.workbooks import FORMATS, generate_suite
+
+OPERATIONS = ('generate', 'save', 'index')
+LAYOUTS = (1, 2, 4)
+
+# Seconds allowed for gunicorn to start and finish its warm-up, and for one request
+STARTUP_TIMEOUT = 120
+REQUEST_TIMEOUT = 600
+
+# Interval between two memory samples of the server processes
+RSS_SAMPLE_SECONDS = 0.2
+
+
+def parse_mix(entries):
+    """Turn ["generate=8", "index=1"] into {"generate": 8.0, "index": 1.0}."""
+    mix = {}
+    for entry in entries:
+        name, _, weight = entry.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def multipart_body(fields, files):
+    """Encode form fields and (name, filename, bytes) files as multipart/form-data; returns (content_type, body)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        )
+    for name, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return f'multipart/form-data; boundary={boundary}', b''.join(parts)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def request(port, method, path, body=None, headers=None):
+    """Send one request on a new connection and return (status, body)."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+    try:
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def process_rss(pid):
+    """Resident memory of a process in bytes, None once it has exited."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return 0
+
+
+def child_pids(pid):
+    """Direct children of a process, from /proc (Linux only)."""
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def tree_rss(pid):
+    """Resident memory of a process and all its descendants, in bytes."""
+    total = process_rss(pid) or 0
+    for child in child_pids(pid):
+        total += tree_rss(child)
+    return total
+
+
+class RssSampler:
+    """Record the peak resident memory of each gunicorn worker, alone and with its descendants."""
+
+    def __init__(self, master_pid):
+        self.master_pid = master_pid
+        self.workers = {}
+        self.peak_total = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            total = process_rss(self.master_pid) or 0
+            for pid in child_pids(self.master_pid):
+                own, tree = process_rss(pid) or 0, tree_rss(pid)
+                peak = self.workers.setdefault(pid, {'pid': pid, 'peak_rss_mb': 0.0, 'peak_tree_rss_mb': 0.0})
+                peak['peak_rss_mb'] = max(peak['peak_rss_mb'], round(own / 1048576, 1))
+                peak['peak_tree_rss_mb'] = max(peak['peak_tree_rss_mb'], round(tree / 1048576, 1))
+                total += tree
+            self.peak_total = max(self.peak_total, total)
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def to_dict(self):
+        return {
+            'workers': sorted(self.workers.values(), key=lambda worker: worker['pid']),
+            'peak_total_rss_mb': round(self.peak_total / 1048576, 1),
+        }
+
+
+def start_server(workdir, workers, threads, render_workers, result_cache):
+    """Create the database, start gunicorn and wait until every worker has warmed up; returns (process, port)."""
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        JOBS_FOLDER=os.path.join(workdir, 'jobs'),
+        RESULT_CACHE_FOLDER=os.path.join(workdir, 'cache'),
+        RESULT_CACHE_MAX_MB=os.environ.get('RESULT_CACHE_MAX_MB', '512') if result_cache else '0',
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'),
+        # Tables are created once here, not concurrently by every worker
+        INIT_DB_ON_START='0',
+    )
+    if render_workers is not None:
+        env['RENDER_WORKERS'] = str(render_workers)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=REPO_ROOT, env=env, check=True, capture_output=True)
+
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         '--threads', str(threads), '--timeout', str(REQUEST_TIMEOUT), '--log-level', 'warning', 'main:app'],
+        cwd=REPO_ROOT, env=env
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    ready = 0
+    # Requests land on any worker: several ready answers in a row make it likely they all are
+    while ready < workers * 2:
+        if process.poll() is not None or time.monotonic() > deadline:
+            stop_server(process)
+            raise RuntimeError(f"gunicorn did not start ({workers} workers, {threads} threads)")
+        try:
+            status, body = request(port, 'GET', '/health')
+            ready = ready + 1 if status == 200 and json.loads(body)['ready'] else 0
+        except (OSError, ValueError, http.client.HTTPException):
+            ready = 0
+        time.sleep(0.1)
+    return process, port
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def profile_form(profile_id=None):
+    """URL-encoded /save_settings form of the benchmark company, updating profile_id or creating a profile."""
+    fields = {key: str(value) for key, value in RENDER_PARAMETERS.items() if key not in ('fixed_invoice_number', 'month_year')}
+    fields['profile_name'] = 'Charge'
+    if profile_id is not None:
+        fields['profile_id'] = str(profile_id)
+    return urlencode(fields).encode('utf-8')
+
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def build_requests(workbook, layout):
+    """Return {operation: (method, path, body, headers, expected status)} for one layout."""
+    with open(workbook['path'], 'rb') as f:
+        content = f.read()
+    generate_type, generate_body = multipart_body(
+        {**{key: str(value) for key, value in RENDER_PARAMETERS.items()}, 'factures_par_page': str(layout)},
+        [('file', os.path.basename(workbook['path']), content)]
+    )
+    return {
+        'generate': ('POST', '/generate?stream=1', generate_body, {'Content-Type': generate_type, 'Accept': 'application/pdf'}, 200),
+        'save': ('POST', '/save_settings', profile_form(1), FORM_HEADERS, 302),
+        'index': ('GET', '/', None, {}, 200),
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_phase(port, requests, mix, concurrency, duration, seed):
+    """Send the request mix from concurrency threads for duration seconds; returns the per-operation outcomes and the elapsed time."""
+    outcomes = {name: {'latencies': [], 'errors': 0, 'statuses': {}} for name in mix}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    names, weights = list(mix), list(mix.values())
+
+    def client(index):
+        rng = random.Random(seed + index)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body, headers, expected = requests[name]
+            started = time.perf_counter()
+            try:
+                status, response_body = request(port, method, path, body, headers)
+                ok = status == expected and (name != 'generate' or response_body.startswith(b'%PDF'))
+            except (OSError, http.client.HTTPException) as e:
+                status, ok = type(e).__name__, False
+            elapsed = time.perf_counter() - started
+            with lock:
+                outcome = outcomes[name]
+                outcome['statuses'][str(status)] = outcome['statuses'].get(str(status), 0) + 1
+                if ok:
+                    outcome['latencies'].append(elapsed)
+                else:
+                    outcome['errors'] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes, time.perf_counter() - started
+
+
+def summarize(outcomes, elapsed):
+    operations = {}
+    for name, outcome in outcomes.items():
+        latencies = outcome['latencies']
+        count = len(latencies) + outcome['errors']
+        operations[name] = {
+            'requests': count,
+            'errors': outcome['errors'],
+            'error_rate': round(outcome['errors'] / count, 4) if count else 0.0,
+            'statuses': outcome['statuses'],
+            'throughput_rps': round(len(latencies) / elapsed, 3),
+            'latency_p50': round(percentile(latencies, 0.50), 6) if latencies else None,
+            'latency_p90': round(percentile(latencies, 0.90), 6) if latencies else None,
+            'latency_p99': round(percentile(latencies, 0.99), 6) if latencies else None,
+            'latency_max': round(max(latencies), 6) if latencies else None,
+        }
+    total = sum(operation['requests'] for operation in operations.values())
+    errors = sum(operation['errors'] for operation in operations.values())
+    return {
+        'seconds': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round((total - errors) / elapsed, 3),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'operations': operations,
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Print the changes against a baseline report and return the regressions found."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def key(entry):
+        return entry['workers'], entry['threads'], entry['concurrency'], entry['layout']
+
+    previous = {key(entry): entry for entry in baseline['results']}
+    regressions = []
+    print(f"\nComparison with {baseline_path}:")
+    for entry in results:
+        before = previous.get(key(entry))
+        if before is None:
+            continue
+        label = "{}w x {}t, {} clients, {}/page".format(*key(entry))
+        print(f"{label:<32} {before['throughput_rps']:8.2f} -> {entry['throughput_rps']:8.2f} req/s")
+        if entry['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {before['throughput_rps']} -> {entry['throughput_rps']} req/s")
+        if entry['error_rate'] > before['error_rate'] + 0.01:
+            regressions.append(f"{label}: error rate {before['error_rate']} -> {entry['error_rate']}")
+        for name, operation in entry['operations'].items():
+            p99, before_p99 = operation['latency_p99'], before['operations'].get(name, {}).get('latency_p99')
+            if p99 is not None and before_p99 and p99 > before_p99 * (1 + tolerance):
+                regressions.append(f"{label}: {name} p99 {before_p99:.3f}s -> {p99:.3f}s")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[2], help='gunicorn worker counts to try')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1], help='gunicorn threads per worker to try')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4], help='concurrent client counts to try')
+    parser.add_argument('--layouts', type=int, nargs='+', choices=LAYOUTS, default=list(LAYOUTS), help='invoices per page')
+    parser.add_argument('--mix', nargs='+', default=['generate=8', 'save=1', 'index=1'], help='operation=weight of the request mix')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load per measurement')
+    parser.add_argument('--rows', type=int, default=1000, help='client rows of the uploaded workbook')
+    parser.add_argument('--format', default='csv-utf8-comma', choices=[spec[0] for spec in FORMATS], help='uploaded workbook format')
+    parser.add_argument('--render-workers', type=int, help='RENDER_WORKERS of the server (default: its own default)')
+    parser.add_argument('--result-cache', action='store_true', help='keep the result cache on, repeated uploads are then served from it')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'invoiceflow_loadtest'), help='where workbooks and the database are kept')
+    parser.add_argument('--output', default='loadtest_results.json', help='JSON report file')
+    parser.add_argument('--baseline', help='earlier JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative throughput or p99 change counted as a regression')
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    workbook = generate_suite(args.workdir, [args.rows], [args.format], args.seed)[0]
+    results = []
+    for workers in args.workers:
+        for threads in args.threads:
+            server_dir = tempfile.mkdtemp(prefix=f'server_{workers}w{threads}t_', dir=args.workdir)
+            print(f"Starting gunicorn with {workers} workers x {threads} threads...", flush=True)
+            process, port = start_server(server_dir, workers, threads, args.render_workers, args.result_cache)
+            try:
+                # The profile the "save" requests update
+                request(port, 'POST', '/save_settings', profile_form(), FORM_HEADERS)
+                for layout in args.layouts:
+                    requests = build_requests(workbook, layout)
+                    for concurrency in args.concurrency:
+                        sampler = RssSampler(process.pid)
+                        sampler.start()
+                        outcomes, elapsed = run_phase(port, requests, mix, concurrency, args.duration, args.seed)
+                        sampler.stop()
+                        entry = {'workers': workers, 'threads': threads, 'concurrency': concurrency, 'layout': layout}
+                        entry.update(summarize(outcomes, elapsed))
+                        entry['memory'] = sampler.to_dict()
+                        results.append(entry)
+                        generate = entry['operations'].get('generate', {})
+                        print(
+                            f"{workers}w x {threads}t {concurrency:>3} clients {layout}/page: {entry['throughput_rps']:7.2f} req/s, "
+                            f"errors {entry['error_rate']:.1%}, generate p50 {generate.get('latency_p50') or 0:.3f}s "
+                            f"p99 {generate.get('latency_p99') or 0:.3f}s, peak RSS {entry['memory']['peak_total_rss_mb']} MB",
+                            flush=True
+                        )
+            finally:
+                stop_server(process)
+
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'layouts': args.layouts,
+            'mix': mix,
+            'duration': args.duration,
+            'rows': args.rows,
+            'format': args.format,
+            'render_workers': args.render_workers,
+            'result_cache': args.result_cache,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Measure contention on the invoice number sequence under concurrent batches.
+
+Several processes, standing for gunicorn workers and batch jobs, reserve
+blocks of invoice numbers from the same company and year as fast as they can.
+The run checks that the reserved blocks neither overlap nor leave gaps, and
+reports the reservations and numbers per second with the latency percentiles
+of one reservation, written to JSON.
+
+    python -m benchmarks.numbering --processes 8 --reservations 200 --block 500
+    python -m benchmarks.numbering --database-url postgresql://localhost/invoiceflow
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+# The benchmarks import the application modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.run import environment
+
+
+def reserve_blocks(database_url, company, year, reservations, block, start_event):
+    """Reserve blocks in a worker process; returns [(first, count, seconds)]."""
+    from sqlalchemy import create_engine
+    from numbering import InvoiceSequence
+
+    engine = create_engine(database_url)
+    sequence = InvoiceSequence(engine, company, year)
+    blocks = []
+    try:
+        start_event.wait()
+        for _ in range(reservations):
+            started = time.perf_counter()
+            first = sequence.reserve(block)
+            blocks.append((first, block, time.perf_counter() - started))
+    finally:
+        engine.dispose()
+    return blocks
+
+
+def check_blocks(blocks):
+    """Return the overlapping and missing numbers of a set of reserved blocks, as counts."""
+    ordered = sorted((first, count) for first, count, _ in blocks)
+    overlaps = gaps = 0
+    expected = ordered[0][0] if ordered else 1
+    for first, count in ordered:
+        if first < expected:
+            overlaps += expected - first
+        elif first > expected:
+            gaps += first - expected
+        expected = max(expected, first + count)
+    return overlaps, gaps
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help='database holding the sequence (default: a throwaway SQLite file)')
+    parser.add_argument('--processes', type=int, default=4, help='concurrent reserving processes')
+    parser.add_argument('--reservations', type=int, default=200, help='blocks reserved by each process')
+    parser.add_argument('--block', type=int, default=1000, help='numbers per block, i.e. invoices per batch')
+    parser.add_argument('--output', default='numbering_results.json', help='JSON results file')
+    args = parser.parse_args(argv)
+
+    from sqlalchemy import create_engine
+    from numbering import create_sequence_table
+
+    workdir = tempfile.mkdtemp(prefix='bench_numbering_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'numbering.db')}"
+    # A company of its own, so that repeated runs start from an empty sequence
+    company = f"bench-{os.getpid()}-{time.time_ns()}"
+    year = 2000
+    engine = create_engine(database_url)
+    create_sequence_table(engine)
+    engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    start_event = manager.Event()
+    with context.Pool(args.processes) as pool:
+        pending = [
+            pool.apply_async(reserve_blocks, (database_url, company, year, args.reservations, args.block, start_event))
+            for _ in range(args.processes)
+        ]
+        # Every process is connected before the clock starts
+        time.sleep(1.0)
+        started = time.perf_counter()
+        start_event.set()
+        blocks = [entry for result in pending for entry in result.get()]
+        elapsed = time.perf_counter() - started
+    manager.shutdown()
+
+    latencies = [seconds for _, _, seconds in blocks]
+    overlaps, gaps = check_blocks(blocks)
+    result = {
+        'database': database_url.split(':', 1)[0],
+        'processes': args.processes,
+        'reservations': len(blocks),
+        'block': args.block,
+        'seconds': round(elapsed, 6),
+        'reservations_per_second': round(len(blocks) / elapsed, 1),
+        'numbers_per_second': round(len(blocks) * args.block / elapsed, 1),
+        'latency_median': round(statistics.median(latencies), 6),
+        'latency_p95': round(percentile(latencies, 0.95), 6),
+        'latency_p99': round(percentile(latencies, 0.99), 6),
+        'latency_max': round(max(latencies), 6),
+        'overlapping_numbers': overlaps,
+        'missing_numbers': gaps,
+    }
+    print(
+        f"{result['reservations']} blocks of {args.block} by {args.processes} processes in {elapsed:.3f}s: "
+        f"{result['reservations_per_second']} reservations/s, median {result['latency_median'] * 1000:.2f}ms, "
+        f"p99 {result['latency_p99'] * 1000:.2f}ms, {overlaps} overlapping and {gaps} missing numbers",
+        flush=True
+    )
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'result': result}, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 1 if overlaps or gaps else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
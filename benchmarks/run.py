@@ -0,0 +1,231 @@
+"""Time the invoice pipeline on synthetic workbooks and write the results to JSON.
+
+Benchmarks:
+- read: pull every projected row out of workbook_reader.read_client_rows
+- extract: extraction.extract_clients on rows already read into memory
+- render: rendering.render_pdf of the extracted clients, per invoices-per-page
+  layout and PDF output profile (fast, compact, archive), with the PDF size
+- end_to_end: POST /generate?stream=1 through the Flask test client, reading the whole PDF
+
+Each measurement is repeated and reports every run plus the best and median
+times; --baseline prints the median speed-up against an earlier results file.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from importlib import metadata
+
+# The benchmarks import the application modules from the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.workbooks import DEFAULT_SIZES, FORMATS, generate_suite
+
+BENCHMARKS = ('read', 'extract', 'render', 'end_to_end')
+LAYOUTS = (1, 2, 4)
+# rendering.OUTPUT_PROFILES, not imported before the application is configured
+PROFILES = ('fast', 'compact', 'archive')
+
+# Parameters used for every rendering, close to a real monthly batch
+RENDER_PARAMETERS = {
+    'fixed_invoice_number': 'FAC-2024-001',
+    'company_name': 'Coopérative Agricole de Sétif',
+    'address': 'Zone industrielle, Sétif',
+    'rc_name': 'RC 19/00-1234567B21',
+    'nif': '000219012345678',
+    'item_name': 'Orge fourragère',
+    'client_profession': 'Éleveur',
+    'month_year': 'Janvier 2024',
+    'rib': '00799999001234567890',
+    'unit_price': 2500.0,
+}
+
+PACKAGES = ('pandas', 'reportlab', 'openpyxl', 'odfpy', 'xlrd', 'flask')
+
+
+def environment():
+    """Describe the machine and code the results were measured on."""
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'packages': versions,
+    }
+
+
+def measure(function, repeat):
+    """Run function repeat times and return (timings, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def record(results, benchmark, workbook, timings, layout=None, rows=None, profile=None, size_bytes=None):
+    median = statistics.median(timings)
+    rows = rows if rows is not None else workbook['rows']
+    entry = {
+        'benchmark': benchmark,
+        'format': workbook['format'],
+        'size': workbook['rows'],
+        'layout': layout,
+        'profile': profile,
+        'rows': rows,
+        'seconds': [round(seconds, 6) for seconds in timings],
+        'best': round(min(timings), 6),
+        'median': round(median, 6),
+        'rows_per_second': round(rows / median, 1) if median else None,
+        'bytes': size_bytes,
+    }
+    results.append(entry)
+    layout_text = f" {layout}/page" if layout else ''
+    profile_text = f" {profile}" if profile else ''
+    size_text = f"  {size_bytes:>12,} bytes" if size_bytes is not None else ''
+    print(f"{benchmark:<11} {workbook['format']:<21} {workbook['rows']:>7} rows{layout_text:<8}{profile_text:<9} median {median:8.3f}s  best {min(timings):8.3f}s{size_text}", flush=True)
+
+
+def render_options(layout, profile):
+    from app import app
+
+    return dict(RENDER_PARAMETERS, factures_par_page=layout, output_profile=profile, use_template=app.config['RENDER_TEMPLATE'])
+
+
+def run_workbook(workbook, benchmarks, layouts, profiles, repeat, client, results):
+    """Run the selected benchmarks on one workbook, appending to results."""
+    from workbook_reader import read_client_rows
+    from extraction import extract_clients
+    from rendering import render_pdf
+
+    rows_timings, rows = measure(lambda: list(read_client_rows(workbook['path'])), repeat)
+    if 'read' in benchmarks:
+        record(results, 'read', workbook, rows_timings, rows=len(rows))
+
+    extract_timings, clients = measure(lambda: extract_clients(rows), repeat)
+    if 'extract' in benchmarks:
+        record(results, 'extract', workbook, extract_timings, rows=len(rows))
+
+    if 'render' in benchmarks:
+        for layout in layouts:
+            for profile in profiles:
+                options = render_options(layout, profile)
+                with tempfile.TemporaryDirectory(prefix='bench_render_') as folder:
+                    pdf_path = os.path.join(folder, 'factures.pdf')
+                    timings, _ = measure(lambda: render_pdf(clients, pdf_path, options), repeat)
+                    size_bytes = os.path.getsize(pdf_path)
+                record(results, 'render', workbook, timings, layout=layout, rows=len(clients), profile=profile, size_bytes=size_bytes)
+
+    if 'end_to_end' in benchmarks:
+        def generate():
+            with open(workbook['path'], 'rb') as f:
+                response = client.post('/generate?stream=1', data={
+                    'file': (f, os.path.basename(workbook['path'])),
+                    'factures_par_page': str(layouts[0]),
+                    **{key: str(value) for key, value in RENDER_PARAMETERS.items()},
+                })
+            body = response.get_data()
+            response.close()
+            if response.status_code != 200 or not body.startswith(b'%PDF'):
+                raise RuntimeError(f"/generate failed for {workbook['path']}: HTTP {response.status_code}")
+            return len(body)
+
+        timings, _ = measure(generate, repeat)
+        record(results, 'end_to_end', workbook, timings, layout=layouts[0], rows=len(clients))
+
+
+def configure_app(workdir):
+    """Point the application at a throwaway database, with the result cache disabled, before it is imported."""
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ['RESULT_CACHE_MAX_MB'] = '0'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def compare(results, baseline_path):
+    """Print the median speed-up of each measurement against a baseline results file."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def key(entry):
+        return entry['benchmark'], entry['format'], entry['size'], entry['layout'], entry.get('profile')
+
+    previous = {key(entry): entry for entry in baseline['results']}
+    print(f"\nComparison with {baseline_path}:")
+    for entry in results:
+        before = previous.get(key(entry))
+        if before is None or not entry['median']:
+            continue
+        size_text = ''
+        if entry.get('bytes') and before.get('bytes'):
+            size_text = f"  {before['bytes']:>12,} -> {entry['bytes']:>12,} bytes"
+        profile_text = f" {entry['profile']}" if entry.get('profile') else ''
+        print(f"{entry['benchmark']:<11} {entry['format']:<21} {entry['size']:>7} rows{profile_text:<9}  {before['median']:8.3f}s -> {entry['median']:8.3f}s  x{before['median'] / entry['median']:.2f}{size_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='client rows per workbook')
+    parser.add_argument('--formats', nargs='+', choices=[spec[0] for spec in FORMATS], help='workbook formats (default: all)')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--layouts', type=int, nargs='+', choices=LAYOUTS, default=list(LAYOUTS), help='invoices per page')
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES), help='PDF output profiles of the render benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'invoiceflow_bench'), help='where workbooks are generated and reused')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--baseline', help='earlier JSON results file to compare with')
+    args = parser.parse_args(argv)
+
+    print(f"Generating workbooks in {args.workdir}...", flush=True)
+    workbooks = generate_suite(args.workdir, args.sizes, args.formats, args.seed)
+    configure_app(args.workdir)
+    from app import app
+    client = app.test_client()
+
+    results = []
+    for workbook in workbooks:
+        run_workbook(workbook, args.benchmarks, args.layouts, args.profiles, args.repeat, client, results)
+
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'sizes': args.sizes,
+            'formats': args.formats or [spec[0] for spec in FORMATS],
+            'layouts': args.layouts,
+            'profiles': args.profiles,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Synthetic breeder workbooks in the layout expected by workbook_reader.
+
+Row 1 holds the column headers, followed by a units row and a reference row
+(the reader skips DATA_START_INDEX rows below the header); client data starts
+at row 4 with the name in column H, the address in J, the breeder card in M and
+the quantity in BF. Names and addresses carry French accents, and some names,
+addresses and quantities are left empty or invalid like in real exports.
+"""
+import os
+import csv
+import random
+
+from workbook_reader import DATA_START_INDEX, NAME_COL_INDEX, ADDRESS_COL_INDEX, BREEDER_CARD_COL_INDEX, QUANTITY_COL_INDEX
+
+# Columns A to BH, so that BF is not the last one
+COLUMN_COUNT = 60
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Part of the file names, so that workbooks generated with an older layout are not reused
+LAYOUT_VERSION = 2
+
+FIRST_NAMES = ['Hélène', 'Ahmed', 'Zoé', 'Mohamed', 'Fatima', 'Rachid', 'Séverine', 'Karim', 'Noël', 'Yacine', 'Amélie', 'Djamel']
+LAST_NAMES = ['Dupré', 'Benali', 'Lefèvre', 'Boudiaf', 'Mérabet', 'Chérif', 'Haddad', 'Kaci', 'Benaïssa', 'Ziani']
+TOWNS = ['Sétif', 'Béjaïa', 'Médéa', 'Tébessa', 'Blida', 'Tiaret', 'Djelfa', 'Aïn Defla']
+
+# (name, extension, encoding, separator) of every generated variant
+FORMATS = (
+    ('xlsx', 'xlsx', None, None),
+    ('csv-utf8-comma', 'csv', 'utf-8', ','),
+    ('csv-cp1252-semicolon', 'csv', 'windows-1252', ';'),
+    ('csv-utf16-tab', 'csv', 'utf-16', '\t'),
+    ('ods', 'ods', None, None),
+)
+
+
+def header_rows():
+    """The header row and the DATA_START_INDEX rows, units first, that precede the client data."""
+    header = [f"Colonne {index + 1}" for index in range(COLUMN_COUNT)]
+    header[NAME_COL_INDEX] = 'Nom et prénom'
+    header[ADDRESS_COL_INDEX] = 'Adresse'
+    header[BREEDER_CARD_COL_INDEX] = 'Carte éleveur'
+    header[QUANTITY_COL_INDEX] = 'Quantité'
+    units = [None] * COLUMN_COUNT
+    units[QUANTITY_COL_INDEX] = 'qx'
+    # Never blank, so that every format keeps the row
+    references = [[f"Réf. {index + 1}"] + [None] * (COLUMN_COUNT - 1) for index in range(DATA_START_INDEX - 1)]
+    return [header, units] + references
+
+
+def client_rows(rows, seed=0):
+    """Yield rows full-width client rows; the same seed always gives the same workbook."""
+    rng = random.Random(seed)
+    for index in range(rows):
+        row = [None] * COLUMN_COUNT
+        draw = rng.random()
+        # About 5% of the rows have no name and are skipped by the extraction
+        if draw >= 0.05:
+            row[NAME_COL_INDEX] = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        if draw < 0.03 or draw >= 0.08:
+            row[ADDRESS_COL_INDEX] = f"Cité {rng.randint(1, 500)} logements, {rng.choice(TOWNS)}"
+        row[BREEDER_CARD_COL_INDEX] = f"CE-{index:07d}"
+        # Mostly whole quantities, a few decimals, blanks and invalid entries
+        if draw < 0.02:
+            row[QUANTITY_COL_INDEX] = None
+        elif draw < 0.03:
+            row[QUANTITY_COL_INDEX] = 'n/a'
+        elif draw < 0.2:
+            row[QUANTITY_COL_INDEX] = round(rng.uniform(0.5, 80), 2)
+        else:
+            row[QUANTITY_COL_INDEX] = rng.randint(1, 120)
+        # A few filler cells, like the other columns of the real exports
+        row[0] = index + 1
+        row[2] = rng.choice(TOWNS)
+        yield row
+
+
+def write_workbook(path, extension, rows, encoding=None, separator=None, seed=0):
+    """Write a synthetic workbook of rows client rows to path."""
+    if extension == 'xlsx':
+        _write_xlsx(path, rows, seed)
+    elif extension == 'csv':
+        _write_csv(path, rows, encoding or 'utf-8', separator or ',', seed)
+    elif extension == 'ods':
+        _write_ods(path, rows, seed)
+    else:
+        raise ValueError(f"Unsupported benchmark format: {extension}")
+    return path
+
+
+def _write_xlsx(path, rows, seed):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in header_rows():
+        sheet.append(row)
+    for row in client_rows(rows, seed):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _write_csv(path, rows, encoding, separator, seed):
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f, delimiter=separator)
+        writer.writerows(header_rows())
+        writer.writerows(client_rows(rows, seed))
+
+
+def _write_ods(path, rows, seed):
+    import pandas as pd
+
+    df = pd.DataFrame(header_rows() + list(client_rows(rows, seed)))
+    df.to_excel(path, engine='odf', header=False, index=False)
+
+
+def generate_suite(folder, sizes=DEFAULT_SIZES, formats=None, seed=0):
+    """
+    Generate every format at every size into folder and return their descriptions.
+
+    Files already present are reused, since generating the large ones takes
+    longer than benchmarking them. Each description is a dict with the keys
+    path, format, extension and rows.
+    """
+    os.makedirs(folder, exist_ok=True)
+    selected = [spec for spec in FORMATS if formats is None or spec[0] in formats]
+    workbooks = []
+    for rows in sizes:
+        for name, extension, encoding, separator in selected:
+            path = os.path.join(folder, f"clients_{rows}_{name}_seed{seed}_v{LAYOUT_VERSION}.{extension}")
+            if not os.path.exists(path):
+                staging_path = f"{path}.tmp.{extension}"
+                write_workbook(staging_path, extension, rows, encoding, separator, seed)
+                os.replace(staging_path, path)
+            workbooks.append({'path': path, 'format': name, 'extension': extension, 'rows': rows})
+    return workbooks
@@ -0,0 +1,343 @@
+"""Header-driven resolution of the client columns of a workbook.
+
+Exports from different suppliers do not all put the client name, address,
+breeder card and quantity in columns H, J, M and BF. resolve_columns matches
+the header row against known header names, ignoring accents, case and
+punctuation, with one dictionary lookup per header cell and prefix length.
+The historical position wins whenever its header names the field, several
+headers naming a field equally well are reported rather than guessed, and
+fields without a recognised header fall back to their historical position.
+Resolved mappings are stored as JSON files keyed by a hash of the header
+row, so a format seen before is projected straight away, and can be reviewed
+and overridden (see the /mappings endpoints).
+
+This module does not import the Flask application.
+"""
+import os
+import re
+import json
+import uuid
+import hashlib
+import logging
+import tempfile
+import datetime
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Client fields, in the order the readers yield them
+FIELDS = ('nom', 'adresse', 'carte_eleveur', 'quantite')
+FIELD_LABELS = {'nom': 'nom', 'adresse': 'adresse', 'carte_eleveur': 'carte éleveur', 'quantite': 'quantité'}
+
+# Normalised header names (see normalize_header) recognised for each field; a
+# header starting with one of them names the field too, so generic words
+# ("client", "carte", "volume") that other columns also start with are left out
+HEADER_ALIASES = {
+    'nom': ('nom et prenom', 'nom prenom', 'nom', 'nom complet', 'nom du client', 'nom client', 'nom eleveur',
+            'nom de l eleveur', 'nom du beneficiaire', 'full name', 'client name', 'customer name'),
+    'adresse': ('adresse', 'adresse complete', 'adresse du client', 'address', 'domicile'),
+    'carte_eleveur': ('carte eleveur', 'carte d eleveur', 'n carte eleveur', 'no carte eleveur',
+                      'numero carte eleveur', 'numero de carte eleveur', 'breeder card'),
+    'quantite': ('quantite', 'quantite litre', 'quantite litres', 'qte', 'qty', 'quantity'),
+}
+ALIAS_FIELDS = {alias: field for field, aliases in HEADER_ALIASES.items() for alias in aliases}
+MAX_ALIAS_WORDS = max(len(alias.split()) for alias in ALIAS_FIELDS)
+
+# Bump when HEADER_ALIASES or the matching rules change, stored detections are then redone
+DETECTION_VERSION = 2
+
+# Shared by the web application and batch.py, next to their other caches
+MAPPINGS_FOLDER = os.environ.get('COLUMN_MAPPINGS_FOLDER', os.path.join(tempfile.gettempdir(), 'invoiceflow_column_mappings'))
+
+NON_ALNUM = re.compile(r'[^a-z0-9]+')
+COLUMN_LETTERS = re.compile(r'^[A-Za-z]{1,3}$')
+
+
+def normalize_header(value):
+    """Lower-case ASCII words of a header cell, accents folded and punctuation dropped."""
+    if value is None:
+        return ''
+    # Accents are dropped, other characters such as the typographic apostrophe separate words
+    text = ''.join(char for char in unicodedata.normalize('NFKD', str(value)) if not unicodedata.combining(char))
+    return NON_ALNUM.sub(' ', text.lower()).strip()
+
+
+def header_signature(header):
+    """Hash identifying a header row, insensitive to accents, case and punctuation."""
+    return hashlib.sha1('\x1f'.join(normalize_header(value) for value in header).encode('utf-8')).hexdigest()
+
+
+def column_letter(index):
+    """Spreadsheet letters of a 0-based column index (0 is A, 57 is BF)."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def column_index(letters):
+    """0-based column index of spreadsheet letters."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def _header_field(value):
+    """Return (field, exact) for a header cell naming a client field, or None."""
+    words = normalize_header(value).split()
+    # Longest prefix first, so "Nom et prénom du client" is a name and "Adresse email" an address
+    for length in range(min(len(words), MAX_ALIAS_WORDS), 0, -1):
+        field = ALIAS_FIELDS.get(' '.join(words[:length]))
+        if field is not None:
+            return field, length == len(words)
+    return None
+
+
+def resolve_columns(header, column_count, fallback):
+    """
+    Map every client field to a column of the workbook.
+
+    Returns ({field: column index}, {field: source}). The fallback column of a
+    field is kept whenever its header names that field; otherwise the field is
+    taken from the only header cell naming it exactly, or else from the only
+    one starting with one of its names (source 'header'). A field named by no
+    header falls back to its index in fallback, unless that column is missing
+    or named as another field (source 'position'). A field left without a
+    column maps to None, with source 'ambiguous' when several headers name it
+    equally well, 'missing' otherwise.
+    """
+    candidates = {field: [] for field in FIELDS}
+    for index, value in enumerate(header):
+        match = _header_field(value)
+        if match is not None:
+            field, exact = match
+            candidates[field].append((index, exact))
+    named = {index for matches in candidates.values() for index, _ in matches}
+
+    columns, sources = {}, {}
+    for field, default in zip(FIELDS, fallback):
+        matches = candidates[field]
+        exact = [index for index, is_exact in matches if is_exact]
+        best = exact or [index for index, _ in matches]
+        if default in (index for index, _ in matches):
+            columns[field], sources[field] = default, 'header'
+        elif len(best) == 1:
+            columns[field], sources[field] = best[0], 'header'
+        elif best:
+            # Picking one could bill the wrong quantity, let the user choose
+            columns[field], sources[field] = None, 'ambiguous'
+        elif default < column_count and default not in named:
+            columns[field], sources[field] = default, 'position'
+        else:
+            columns[field], sources[field] = None, 'missing'
+    return columns, sources
+
+
+class MappingStore:
+    """
+    Column mappings stored as <signature>.json in a folder shared by every process.
+
+    A version file is rewritten whenever a mapping is overridden or deleted,
+    so that results rendered with the former columns can be told apart.
+    """
+
+    VERSION_NAME = 'version'
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, signature):
+        return os.path.join(self.folder, f"{signature}.json")
+
+    def version(self):
+        """Token that changes whenever a mapping is overridden or deleted, '' before the first change."""
+        try:
+            with open(os.path.join(self.folder, self.VERSION_NAME), encoding='ascii') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def bump_version(self):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, self.VERSION_NAME)
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staging_path, 'w', encoding='ascii') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(staging_path, path)
+
+    def get(self, signature):
+        """Return the stored mapping dict of a header signature, or None."""
+        if not re.fullmatch(r'[0-9a-f]{40}', signature):
+            return None
+        try:
+            with open(self._path(signature), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, mapping):
+        os.makedirs(self.folder, exist_ok=True)
+        mapping['updated_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        path = self._path(mapping['signature'])
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staging_path, 'w', encoding='utf-8') as f:
+            json.dump(mapping, f, ensure_ascii=False, indent=2)
+        os.replace(staging_path, path)
+
+    def delete(self, signature):
+        """Forget a mapping, so that the next workbook with that header is detected again; False if unknown."""
+        if self.get(signature) is None:
+            return False
+        os.remove(self._path(signature))
+        self.bump_version()
+        return True
+
+    def mappings(self):
+        """Every stored mapping, most recently updated first."""
+        if not os.path.isdir(self.folder):
+            return []
+        found = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.json'):
+                mapping = self.get(entry.name[:-len('.json')])
+                if mapping is not None:
+                    found.append(mapping)
+        return sorted(found, key=lambda mapping: mapping.get('updated_at', ''), reverse=True)
+
+
+_store = MappingStore(MAPPINGS_FOLDER)
+
+
+def get_mapping_store():
+    """Return the process-wide mapping store (COLUMN_MAPPINGS_FOLDER)."""
+    return _store
+
+
+def mappings_version():
+    """
+    Version of the column resolution as a whole, for result cache keys.
+
+    Detected mappings only depend on the header row and DETECTION_VERSION;
+    overridden and deleted mappings change the store version.
+    """
+    return f"{DETECTION_VERSION}:{get_mapping_store().version()}"
+
+
+def workbook_columns(header, column_count, fallback):
+    """
+    Return the mapping dict of a workbook from its header row, detecting and storing it the first time.
+
+    A stored mapping is used as is when it was overridden or detected by the
+    current DETECTION_VERSION. mapping['columns'] maps each field to its
+    0-based column index. Raises ValueError when a field has no column; the
+    mapping is stored all the same, so that it can be completed by hand.
+    """
+    header = ['' if value is None else str(value).strip() for value in header]
+    signature = header_signature(header)
+    store = get_mapping_store()
+    mapping = store.get(signature)
+    if mapping is not None and (is_overridden(mapping) or mapping.get('detection_version') == DETECTION_VERSION):
+        _check_complete(mapping, fallback)
+        return mapping
+
+    columns, sources = resolve_columns(header, column_count, fallback)
+    mapping = {
+        'signature': signature,
+        'headers': header,
+        'column_count': column_count,
+        'columns': columns,
+        'sources': sources,
+        'detection_version': DETECTION_VERSION,
+    }
+    try:
+        store.save(mapping)
+    except OSError as e:
+        logger.warning(f"Correspondance des colonnes non enregistrée: {e}")
+    logger.info(f"Colonnes détectées ({signature[:12]}): " + ', '.join(
+        f"{field} {column_letter(index) if index is not None else '-'} ({sources[field]})" for field, index in columns.items()))
+    _check_complete(mapping, fallback)
+    return mapping
+
+
+def _check_complete(mapping, fallback):
+    """Raise ValueError naming the fields of a mapping left without a column."""
+    unresolved = [field for field, index in mapping['columns'].items() if index is None]
+    if not unresolved:
+        return
+    problems = []
+    missing = [field for field in unresolved if mapping['sources'][field] != 'ambiguous']
+    if missing:
+        expected = ', '.join(f"{column_letter(index)}({index + 1})" for index in fallback)
+        problems.append(
+            f"Colonnes introuvables: {', '.join(FIELD_LABELS[field] for field in missing)}. "
+            f"Le fichier a {mapping['column_count']} colonnes et aucun en-tête reconnu pour ces champs "
+            f"(à défaut les colonnes {expected} sont utilisées)."
+        )
+    for field in unresolved:
+        if mapping['sources'][field] == 'ambiguous':
+            named = [
+                f"{column_letter(index)} ({header})" for index, header in enumerate(mapping['headers'])
+                if (_header_field(header) or (None,))[0] == field
+            ]
+            problems.append(f"Plusieurs colonnes possibles pour {FIELD_LABELS[field]}: {', '.join(named)}.")
+    raise ValueError(f"{' '.join(problems)} Indiquez la colonne à utiliser avec PUT /mappings/{mapping['signature']}.")
+
+
+def is_overridden(mapping):
+    return 'override' in mapping['sources'].values()
+
+
+def override_columns(mapping, values):
+    """
+    Point fields of a stored mapping at other columns and save it.
+
+    values maps field names to a column, given as spreadsheet letters ("BF")
+    or as the text of its header cell. Raises ValueError for an unknown field
+    or column.
+    """
+    headers = {normalize_header(header): index for index, header in reversed(list(enumerate(mapping['headers']))) if header}
+    columns = dict(mapping['columns'])
+    sources = dict(mapping['sources'])
+    for field, column in values.items():
+        if field not in FIELDS:
+            raise ValueError(f"Champ inconnu: {field} (attendus: {', '.join(FIELDS)})")
+        column = str(column).strip()
+        if normalize_header(column) in headers:
+            index = headers[normalize_header(column)]
+        elif COLUMN_LETTERS.match(column):
+            index = column_index(column)
+        else:
+            raise ValueError(f"Colonne inconnue pour {FIELD_LABELS[field]}: {column}")
+        if index >= mapping['column_count']:
+            raise ValueError(f"La colonne {column_letter(index)} dépasse les {mapping['column_count']} colonnes du fichier.")
+        columns[field], sources[field] = index, 'override'
+    mapping = dict(mapping, columns=columns, sources=sources)
+    store = get_mapping_store()
+    store.save(mapping)
+    # Results rendered from the former columns must no longer be served
+    store.bump_version()
+    return mapping
+
+
+def describe_mapping(mapping):
+    """JSON view of a mapping for review: letter, index, header and origin of every field's column."""
+    headers = mapping['headers']
+    return {
+        'signature': mapping['signature'],
+        'column_count': mapping['column_count'],
+        'overridden': is_overridden(mapping),
+        'updated_at': mapping.get('updated_at'),
+        'fields': {
+            field: {
+                'column': column_letter(index) if index is not None else None,
+                'index': index,
+                'header': headers[index] if index is not None and index < len(headers) else '',
+                'source': mapping['sources'][field],
+            }
+            for field, index in mapping['columns'].items()
+        },
+    }
@@ -0,0 +1,185 @@
+"""Columnar extraction of client records from the projected workbook rows.
+
+NaN handling, accent folding or Arabic shaping (see fonts.py), quantity
+coercion and empty-name filtering are
+done as whole-column operations on chunks of rows, producing ClientColumns
+record sets that the renderer draws without sanitising the values again.
+Chunks can be consumed one at a time so that memory does not grow with the
+size of the workbook.
+"""
+import time
+import logging
+from itertools import islice
+
+import pandas as pd
+
+from fonts import ACCENT_TRANSLATION, ARABIC_SCRIPT, invoice_fonts, shape_text
+
+logger = logging.getLogger(__name__)
+
+# Rows converted per vectorised chunk
+EXTRACTION_CHUNK_ROWS = 10000
+
+# One extracted row in this many is logged at DEBUG level, the rest only count in the summary
+LOG_SAMPLE_ROWS = 1000
+
+SOURCE_COLUMNS = ['row_index', 'nom', 'adresse', 'carte_eleveur', 'quantite']
+
+
+class ClientColumns:
+    """
+    Compact column-oriented set of sanitised client records.
+
+    noms holds the names as drawn, possibly shaped or accent-folded;
+    noms_saisis holds them as typed in the workbook, for the ledger, and
+    defaults to noms.
+    """
+
+    __slots__ = ('noms', 'adresses', 'cartes', 'quantites', 'noms_saisis')
+
+    def __init__(self, noms=None, adresses=None, cartes=None, quantites=None, noms_saisis=None):
+        self.noms = noms if noms is not None else []
+        self.adresses = adresses if adresses is not None else []
+        self.cartes = cartes if cartes is not None else []
+        self.quantites = quantites if quantites is not None else []
+        self.noms_saisis = noms_saisis if noms_saisis is not None else list(self.noms)
+
+    def __len__(self):
+        return len(self.noms)
+
+    def __iter__(self):
+        """Yield (nom, adresse, carte_eleveur, quantite) tuples."""
+        return zip(self.noms, self.adresses, self.cartes, self.quantites)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ClientColumns(
+                self.noms[index], self.adresses[index], self.cartes[index], self.quantites[index], self.noms_saisis[index]
+            )
+        return self.noms[index], self.adresses[index], self.cartes[index], self.quantites[index]
+
+    def extend(self, other):
+        """Append the records of another ClientColumns."""
+        self.noms.extend(other.noms)
+        self.adresses.extend(other.adresses)
+        self.cartes.extend(other.cartes)
+        self.quantites.extend(other.quantites)
+        self.noms_saisis.extend(other.noms_saisis)
+
+
+def clean_text_column(series):
+    """NaN to "", then strip."""
+    return series.where(series.notna(), '').astype(str).str.strip()
+
+
+def drawable_text_column(text):
+    """Shape the Arabic script of a cleaned text column, or fold its accents without a Unicode font."""
+    if not invoice_fonts().unicode:
+        return text.str.translate(ACCENT_TRANSLATION)
+    arabic = text.str.contains(ARABIC_SCRIPT)
+    if arabic.any():
+        text = text.where(~arabic, text[arabic].map(shape_text))
+    return text
+
+
+def sanitize_text_column(series):
+    """Vectorised safe_text_for_pdf: NaN to "", strip, then shape Arabic script or fold accents."""
+    return drawable_text_column(clean_text_column(series))
+
+
+def coerce_quantity_column(series):
+    """Convert quantities to float, defaulting missing or invalid values to 1.0."""
+    return pd.to_numeric(series, errors='coerce').fillna(1.0).astype(float)
+
+
+def extract_chunk(records):
+    """Sanitise one chunk of (row_index, name, address, card, quantity) tuples."""
+    df = pd.DataFrame.from_records(records, columns=SOURCE_COLUMNS)
+    noms_saisis = clean_text_column(df['nom'])
+
+    # Skip rows with empty names
+    keep = noms_saisis != ''
+    noms_saisis = noms_saisis[keep]
+    return ClientColumns(
+        drawable_text_column(noms_saisis).tolist(),
+        sanitize_text_column(df['adresse'][keep]).tolist(),
+        sanitize_text_column(df['carte_eleveur'][keep]).tolist(),
+        coerce_quantity_column(df['quantite'][keep]).tolist(),
+        noms_saisis.tolist()
+    ), len(df) - int(keep.sum())
+
+
+def log_sampled_rows(chunk):
+    """Log every LOG_SAMPLE_ROWS-th raw record of a chunk at DEBUG level."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    for record in chunk:
+        if record[0] % LOG_SAMPLE_ROWS == 0:
+            logger.debug(f"Ligne {record[0] + 1}: {record[1:]}")
+
+
+def iter_client_chunks(rows, chunk_rows=EXTRACTION_CHUNK_ROWS, stats=None):
+    """
+    Lazily yield a ClientColumns per chunk_rows rows of workbook_reader.read_client_rows.
+
+    Only one chunk of rows is held at a time. The reader is lazy, so time
+    spent pulling rows from it is recorded as the "parse" phase of stats
+    (a metrics.GenerationStats) and the rest as "extract". Raises ValueError
+    once the rows are exhausted if none of them had a client name.
+    """
+    kept = skipped = 0
+    records = ((row_index,) + tuple(values) for row_index, values in rows)
+    parse_seconds = extract_seconds = 0.0
+    while True:
+        start = time.perf_counter()
+        chunk = list(islice(records, chunk_rows))
+        parsed = time.perf_counter()
+        parse_seconds += parsed - start
+        if stats is not None:
+            stats.add('parse', parsed - start)
+        if not chunk:
+            break
+        log_sampled_rows(chunk)
+        chunk_clients, chunk_skipped = extract_chunk(chunk)
+        kept += len(chunk_clients)
+        skipped += chunk_skipped
+        elapsed = time.perf_counter() - parsed
+        extract_seconds += elapsed
+        if stats is not None:
+            stats.add('extract', elapsed)
+            stats.rows = kept
+            stats.skipped_rows = skipped
+        if chunk_clients:
+            yield chunk_clients
+
+    if not kept:
+        raise ValueError("Aucune donnée valide trouvée à partir de la ligne 3.")
+
+    logger.info(
+        f"{kept} clients extraits, {skipped} lignes sans nom ignorées "
+        f"(lecture {parse_seconds:.2f}s, extraction {extract_seconds:.2f}s)"
+    )
+
+
+def extract_clients(rows, chunk_rows=EXTRACTION_CHUNK_ROWS, stats=None):
+    """
+    Build a single ClientColumns from the (row_index, values) pairs of workbook_reader.read_client_rows.
+
+    Raises ValueError when no row has a client name.
+    """
+    clients = ClientColumns()
+    for chunk in iter_client_chunks(rows, chunk_rows, stats):
+        clients.extend(chunk)
+    return clients
+
+
+def page_aligned_chunks(chunks, chunk_rows):
+    """Regroup ClientColumns chunks into chunks of exactly chunk_rows records, the last one possibly shorter."""
+    pending = ClientColumns()
+    for chunk in chunks:
+        pending.extend(chunk)
+        while len(pending) >= chunk_rows:
+            yield pending[:chunk_rows]
+            pending = pending[chunk_rows:]
+    if pending:
+        yield pending
@@ -0,0 +1,256 @@
+"""Process-wide registry of the fonts drawn on the invoices.
+
+A Unicode TrueType font (DejaVu Sans by default, shipped in static/fonts) is
+looked up and registered with ReportLab once per process, on first use, and embedded in every PDF as
+glyph subsets. Accented names are then drawn as they are, and Arabic-script
+names are shaped when the optional arabic-reshaper and python-bidi packages
+are installed. Without a TrueType font the invoices fall back to the built-in
+Helvetica, which needs accents folded to plain ASCII.
+
+ReportLab rebuilds every glyph subset for each document it saves; InvoiceFont
+caches them instead, so the many small documents of a chunked or per-client
+render share the work.
+"""
+import os
+import re
+import struct
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFontFace, TTFontMaker
+
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+except ImportError:  # Arabic names are drawn unshaped
+    arabic_reshaper = None
+
+logger = logging.getLogger(__name__)
+
+# Explicit font files, e.g. a font with better Arabic coverage; "builtin" keeps Helvetica
+FONT_PATH = os.environ.get('INVOICE_FONT_PATH')
+BOLD_FONT_PATH = os.environ.get('INVOICE_BOLD_FONT_PATH')
+
+# (regular, bold) file names searched in FONT_DIRECTORIES when no path is configured
+FONT_CANDIDATES = (
+    ('DejaVuSans.ttf', 'DejaVuSans-Bold.ttf'),
+    ('NotoSans-Regular.ttf', 'NotoSans-Bold.ttf'),
+    ('LiberationSans-Regular.ttf', 'LiberationSans-Bold.ttf'),
+    ('FreeSans.ttf', 'FreeSansBold.ttf'),
+)
+FONT_DIRECTORIES = (
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts'),
+    '/usr/share/fonts',
+    '/usr/local/share/fonts',
+    '/run/current-system/sw/share/X11/fonts',
+    os.path.expanduser('~/.nix-profile/share/fonts'),
+    '/Library/Fonts',
+    'C:\\Windows\\Fonts',
+)
+
+REGULAR_FONT_NAME = 'InvoiceSans'
+BOLD_FONT_NAME = 'InvoiceSans-Bold'
+
+# Glyph subsets kept per process; a subset is at most 256 glyphs of font data
+SUBSET_CACHE_SIZE = 256
+
+# Font tables left out of the embedded subsets: names and hinting programs
+PRUNED_TABLES = ('name', 'fpgm', 'prep', 'cvt ', 'hdmx', 'LTSH', 'VDMX')
+
+# Flags of the components of a composite glyph
+COMPOSITE_WORD_ARGS = 0x0001
+COMPOSITE_SCALE = 0x0008
+COMPOSITE_MORE = 0x0020
+COMPOSITE_XY_SCALE = 0x0040
+COMPOSITE_2X2 = 0x0080
+COMPOSITE_HAS_INSTRUCTIONS = 0x0100
+
+# Characters given a fixed place in the first glyph subset of every document,
+# so that subsets, and their cache keys, do not depend on the order names come in
+COMMON_GLYPHS = 'àâäçéèêëîïôöùûüÿœæÀÂÄÇÉÈÊËÎÏÔÖÙÛÜŸŒÆ°€«»'
+
+ARABIC_SCRIPT = re.compile('[\u0600-\u06ff\u0750-\u077f\u08a0-\u08ff\ufb50-\ufdff\ufe70-\ufeff]')
+
+# Accented characters Helvetica cannot draw reliably, folded to plain ASCII
+ACCENT_TRANSLATION = str.maketrans(
+    'éèêëàâäùûüôöîïçÉÈÊËÀÂÄÙÛÜÔÖÎÏÇ',
+    'eeeeaaauuuooiicEEEEAAAUUUOOIIC'
+)
+
+InvoiceFonts = namedtuple('InvoiceFonts', ['regular', 'bold', 'unicode'])
+
+BUILTIN_FONTS = InvoiceFonts('Helvetica', 'Helvetica-Bold', False)
+
+_fonts = None
+_fonts_lock = threading.Lock()
+
+
+def _find_font_files():
+    """Return (regular, bold) paths of the first installed candidate font, or None."""
+    if FONT_PATH == 'builtin':
+        return None
+    if FONT_PATH:
+        return FONT_PATH, BOLD_FONT_PATH or FONT_PATH
+    for directory in FONT_DIRECTORIES:
+        if not os.path.isdir(directory):
+            continue
+        found = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                found.setdefault(name, os.path.join(root, name))
+        for regular, bold in FONT_CANDIDATES:
+            if regular in found:
+                return found[regular], found.get(bold, found[regular])
+    return None
+
+
+def _strip_instructions(glyph):
+    """Return a glyf table entry without its hinting instructions."""
+    if not glyph:
+        return glyph
+    contour_count = struct.unpack('>h', glyph[:2])[0]
+    if contour_count >= 0:
+        # Simple glyph: header, contour end points, then the instruction length and bytes
+        length_at = 10 + 2 * contour_count
+        instruction_length = struct.unpack('>H', glyph[length_at:length_at + 2])[0]
+        return glyph[:length_at] + b'\0\0' + glyph[length_at + 2 + instruction_length:]
+
+    # Composite glyph: walk the components, the instructions follow the last one
+    glyph = bytearray(glyph)
+    position = 10
+    while True:
+        flags = struct.unpack('>H', glyph[position:position + 2])[0]
+        if flags & COMPOSITE_HAS_INSTRUCTIONS:
+            struct.pack_into('>H', glyph, position, flags & ~COMPOSITE_HAS_INSTRUCTIONS)
+        position += 4 + (4 if flags & COMPOSITE_WORD_ARGS else 2)
+        if flags & COMPOSITE_SCALE:
+            position += 2
+        elif flags & COMPOSITE_XY_SCALE:
+            position += 4
+        elif flags & COMPOSITE_2X2:
+            position += 8
+        if not flags & COMPOSITE_MORE:
+            if flags & COMPOSITE_HAS_INSTRUCTIONS:
+                return bytes(glyph[:position])
+            return bytes(glyph)
+
+
+def _prune_subset(font_data):
+    """
+    Rebuild a TrueType subset without its name table and hinting.
+
+    Hinting is about half of DejaVu's glyph data and PDF viewers rasterise
+    without it; the name table is never read from an embedded font.
+    """
+    tables = {}
+    table_count = struct.unpack('>H', font_data[4:6])[0]
+    for index in range(table_count):
+        tag, _, offset, length = struct.unpack('>4sLLL', font_data[12 + 16 * index:28 + 16 * index])
+        tables[tag.decode('latin-1')] = font_data[offset:offset + length]
+
+    long_offsets = struct.unpack('>h', tables['head'][50:52])[0] == 1
+    loca = tables['loca']
+    if long_offsets:
+        offsets = struct.unpack(f'>{len(loca) // 4}L', loca)
+    else:
+        offsets = [offset * 2 for offset in struct.unpack(f'>{len(loca) // 2}H', loca)]
+
+    glyf = tables['glyf']
+    glyphs = []
+    new_offsets = [0]
+    for start, end in zip(offsets, offsets[1:]):
+        glyph = _strip_instructions(glyf[start:end])
+        # Keep every glyph 4-byte aligned, valid for both offset formats
+        glyph += b'\0' * (-len(glyph) % 4)
+        glyphs.append(glyph)
+        new_offsets.append(new_offsets[-1] + len(glyph))
+
+    maker = TTFontMaker()
+    for tag, data in tables.items():
+        if tag in PRUNED_TABLES:
+            continue
+        if tag == 'glyf':
+            data = b''.join(glyphs)
+        elif tag == 'loca':
+            data = struct.pack(f'>{len(new_offsets)}L', *new_offsets) if long_offsets else struct.pack(f'>{len(new_offsets)}H', *(offset // 2 for offset in new_offsets))
+        maker.add(tag, data)
+    return maker.makeStream()
+
+
+class SubsetCachingFace(TTFontFace):
+    """TrueType face memoising its pruned glyph subsets, which only depend on the glyphs."""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self._subsets = OrderedDict()
+        self._subsets_lock = threading.Lock()
+
+    def makeSubset(self, subset):
+        key = tuple(subset)
+        with self._subsets_lock:
+            if key in self._subsets:
+                self._subsets.move_to_end(key)
+                return self._subsets[key]
+        data = _prune_subset(super().makeSubset(subset))
+        with self._subsets_lock:
+            self._subsets[key] = data
+            if len(self._subsets) > SUBSET_CACHE_SIZE:
+                self._subsets.popitem(last=False)
+        return data
+
+
+class InvoiceFont(TTFont):
+    """TTFont embedding cached subsets, with COMMON_GLYPHS given the first codes of every document."""
+
+    def __init__(self, name, filename):
+        super().__init__(name, filename)
+        # TTFont always builds a plain face; reading the file again takes a few milliseconds
+        self.face = SubsetCachingFace(filename)
+
+    def splitString(self, text, doc, encoding='utf-8'):
+        if doc not in self.state:
+            super().splitString(COMMON_GLYPHS, doc, encoding)
+        return super().splitString(text, doc, encoding)
+
+
+def _register_fonts():
+    paths = _find_font_files()
+    if paths is None:
+        if FONT_PATH == 'builtin':
+            return BUILTIN_FONTS
+        logger.warning("Aucune police TrueType trouvée, les accents seront supprimés (définir INVOICE_FONT_PATH)")
+        return BUILTIN_FONTS
+    try:
+        for name, path in ((REGULAR_FONT_NAME, paths[0]), (BOLD_FONT_NAME, paths[1])):
+            pdfmetrics.registerFont(InvoiceFont(name, path))
+    except Exception as e:
+        logger.warning(f"Police {paths[0]} illisible, utilisation de Helvetica: {e}")
+        return BUILTIN_FONTS
+    logger.info(f"Police des factures: {paths[0]}")
+    return InvoiceFonts(REGULAR_FONT_NAME, BOLD_FONT_NAME, True)
+
+
+def invoice_fonts():
+    """Register the invoice fonts on first use in this process and return their InvoiceFonts."""
+    global _fonts
+    if _fonts is None:
+        with _fonts_lock:
+            if _fonts is None:
+                _fonts = _register_fonts()
+    return _fonts
+
+
+def shape_text(text):
+    """Reorder and join Arabic-script text for drawing left to right; other text is returned as is."""
+    if arabic_reshaper is None or not ARABIC_SCRIPT.search(text):
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+
+def prepare_text(text):
+    """Make already stripped text drawable with the invoice fonts."""
+    if invoice_fonts().unicode:
+        return shape_text(text)
+    return text.translate(ACCENT_TRANSLATION)
@@ -0,0 +1,414 @@
+"""Flask-free invoice generation core.
+
+generer_factures_pdf reads a workbook, extracts the client records and renders
+the invoices PDF; generer_factures_zip streams one PDF per client as a ZIP.
+validate_workbook and generer_apercu_pdf are the dry-run counterparts used
+before a full run. The web application and the batch command line both call
+it; neither the Flask app nor a request context is needed.
+"""
+import os
+import re
+import math
+import unicodedata
+import time
+import logging
+import datetime
+import tempfile
+from itertools import chain
+
+from archive import stream_zip
+from rendering import render_pdf, render_pdf_chunks, iter_invoice_pdfs, invoice_numbers, FACTURES_PAR_PAGE, OUTPUT_PROFILES, DEFAULT_OUTPUT_PROFILE
+from numbering import NUMBERING_MODES
+from incremental import render_pdf_incremental
+from workbook_reader import read_client_rows
+from extraction import ClientColumns, iter_client_chunks
+from metrics import GenerationStats, stream_size, server_timing
+from column_mapping import describe_mapping
+
+logger = logging.getLogger(__name__)
+
+# Smaller batches are faster drawn serially than sharded across processes
+PARALLEL_RENDER_MIN_ROWS = 2000
+
+# Characters kept in per-client PDF file names, and their maximum length before ".pdf"
+UNSAFE_FILENAME_CHARS = re.compile(r'[^A-Za-z0-9._-]+')
+MAX_FILENAME_STEM = 80
+
+
+def _wrap_read_errors(chunks):
+    """Re-raise reader and extraction errors with a user-facing message."""
+    try:
+        yield from chunks
+    except Exception as e:
+        raise ValueError(f"Erreur lors de l'extraction des données (nom, adresse, carte, quantité): {e}")
+
+
+def iter_clients(fichier_excel, file_ext=None, stats=None):
+    """
+    Lazily yield the sanitised client records of a workbook as ClientColumns chunks.
+
+    Read errors surface while iterating, as ValueError with a user-facing message.
+    """
+    # Read the name, address, card and quantity columns found from the header
+    # (H, J, M, BF by default) starting from row 3, streaming only those four
+    return _wrap_read_errors(iter_client_chunks(read_client_rows(fichier_excel, file_ext, stats), stats=stats))
+
+
+def _recorded(chunks, recorder, stats, render_options):
+    """Hand every chunk and its invoice numbers to recorder.add before passing it on, timed as the "ledger" phase."""
+    position = 0
+    for chunk in chunks:
+        with stats.phase('ledger'):
+            recorder.add(chunk, invoice_numbers(render_options, position, len(chunk)))
+        position += len(chunk)
+        yield chunk
+
+
+def _reserve_numbers(sequence, count, render_options, stats):
+    """Reserve count sequential numbers and start the batch at the first one, timed as the "numbering" phase."""
+    if sequence is None:
+        raise ValueError("La numérotation séquentielle nécessite une base de données.")
+    with stats.phase('numbering'):
+        render_options['first_invoice_number'] = sequence.reserve(count)
+    return render_options['first_invoice_number']
+
+
+def count_clients(fichier_excel, file_ext=None):
+    """Number of invoices a workbook yields; a file object is rewound to where it was."""
+    position = None if isinstance(fichier_excel, (str, os.PathLike)) else fichier_excel.tell()
+    count = sum(len(chunk) for chunk in iter_clients(fichier_excel, file_ext))
+    if position is not None:
+        fichier_excel.seek(position)
+    return count
+
+
+def load_clients(fichier_excel, file_ext=None, stats=None):
+    """Read and sanitise all the client records of a workbook; raises ValueError with a user-facing message."""
+    clients = ClientColumns()
+    for chunk in iter_clients(fichier_excel, file_ext, stats):
+        clients.extend(chunk)
+    logger.info(f"Total de {len(clients)} clients trouvés pour générer les factures.")
+    return clients
+
+
+def _progress_with_total(progress_callback, stats, rows_total=None):
+    """
+    Wrap progress_callback to report rows_total, or once the workbook is open
+    the data rows it declares (stats.rows_expected), instead of an unknown total.
+    """
+    def report(rows_done, _):
+        total = rows_total if rows_total is not None else stats.rows_expected
+        # Skipped rows make the declared total an upper bound, never below the rows drawn
+        progress_callback(rows_done, max(total, rows_done) if total is not None else None)
+
+    return report
+
+
+def peek_rows(chunks, min_rows):
+    """
+    Read ahead until min_rows records have been seen or the chunks run out.
+
+    Returns (enough, chunks) where chunks still yields every record.
+    """
+    head = []
+    rows = 0
+    for chunk in chunks:
+        head.append(chunk)
+        rows += len(chunk)
+        if rows >= min_rows:
+            return True, chain(head, chunks)
+    return False, iter(head)
+
+
+def build_render_options(factures_par_page=1, fixed_invoice_number="FAC-001", invoice_date=None, company_name="", address="", rc_name="", nif="", item_name="", client_profession="", month_year="", rib="", unit_price=0.0, use_template=True, numbering="fixed", incremental=False, output_profile=DEFAULT_OUTPUT_PROFILE):
+    """Validate the batch parameters and return the options dict of the renderer."""
+    # Use provided date or today's date
+    if invoice_date:
+        date = datetime.datetime.strptime(invoice_date, '%Y-%m-%d').date()
+    else:
+        date = datetime.date.today()
+    if factures_par_page not in FACTURES_PAR_PAGE:
+        # Also keeps RENDER_CHUNK_ROWS a whole number of pages
+        raise ValueError(f"Nombre de factures par page invalide: {factures_par_page} (attendus: {', '.join(map(str, FACTURES_PAR_PAGE))})")
+    if numbering not in NUMBERING_MODES:
+        raise ValueError(f"Numérotation inconnue: {numbering}")
+    if incremental and numbering == 'sequential':
+        # Every run takes new numbers, no page could ever be reused
+        raise ValueError("La régénération incrémentale n'est pas possible avec la numérotation séquentielle.")
+    if output_profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Profil de sortie inconnu: {output_profile} (attendus: {', '.join(OUTPUT_PROFILES)})")
+    
+    return {
+        'factures_par_page': factures_par_page,
+        # The fixed invoice number for ALL invoices, or the prefix of sequential numbers
+        'fixed_invoice_number': fixed_invoice_number,
+        'numbering': numbering,
+        'invoice_year': date.year,
+        # Set once the block of sequential numbers is reserved
+        'first_invoice_number': None,
+        'company_name': company_name,
+        'address': address,
+        'rc_name': rc_name,
+        'nif': nif,
+        'item_name': item_name,
+        'client_profession': client_profession,
+        'month_year': month_year,
+        'rib': rib,
+        'unit_price': unit_price,
+        'use_template': use_template,
+        # Reuse the pages of an earlier generation of the same batch (PDF output only)
+        'incremental': bool(incremental),
+        # "fast", "compact" or "archive", see rendering.OUTPUT_PROFILES
+        'output_profile': output_profile,
+    }
+
+
+def generer_factures_pdf(fichier_excel, output_path=None, progress_callback=None, file_ext=None, stats=None, render_workers=1, parallel_min_rows=PARALLEL_RENDER_MIN_ROWS, recorder=None, sequence=None, page_store=None, **parameters):
+    """
+    Generate PDF invoices from Excel data with fixed invoice number.
+    Returns the path to the generated PDF file, or output_path itself.
+
+    fichier_excel is a file path, or a seekable binary file object whose
+    extension is given by file_ext. output_path may be a path or a writable
+    binary file object; by default a timestamped file in the temp directory.
+    parameters are the batch parameters of build_render_options.
+
+    If given, progress_callback is called as progress_callback(rows_done, rows_total)
+    while invoices are drawn; rows_total is None until the workbook is open,
+    then the exact count with sequential numbering, otherwise the number of
+    data rows the workbook declares, which rows without a name make an
+    upper bound. Phase timings, rows and sizes are recorded into
+    stats (a metrics.GenerationStats) when given, and published to the metrics
+    histograms either way.
+
+    Rows are read, sanitised and drawn in chunks, and finished pages are
+    flushed to the output as they come, so memory does not grow with the
+    workbook. Batches of at least parallel_min_rows clients are rendered across
+    render_workers processes; use_template draws the static invoice skeleton
+    once as a reusable form. output_profile trades render time for file size:
+    "fast" skips compression, "compact" (the default) gives the smallest file
+    and "archive" adds the document metadata.
+
+    recorder, such as a ledger.LedgerRecorder, is handed every chunk of client
+    records with add(clients, invoice_numbers) as they are drawn, then close()
+    once the PDF is complete or discard() if the generation fails.
+
+    With numbering="sequential" the workbook is first counted, then a block of
+    that many numbers is reserved from sequence (a numbering.InvoiceSequence)
+    and released again if the generation fails.
+
+    With incremental=True, pages already rendered by an earlier generation
+    with the same parameters are copied from page_store (an
+    incremental.PageStore) and only the invoices on changed pages are drawn;
+    stats.reused_rows counts the invoices reused.
+    """
+    stats = stats if stats is not None else GenerationStats()
+    pdf_path = None
+    first_number = None
+    try:
+        stats.bytes_in = stream_size(fichier_excel)
+        render_options = build_render_options(**parameters)
+        if render_options['numbering'] == 'sequential':
+            # Numbers are only taken once the whole workbook is known to be readable
+            with stats.phase('numbering'):
+                count = count_clients(fichier_excel, file_ext)
+            first_number = _reserve_numbers(sequence, count, render_options, stats)
+        if render_options['incremental'] and page_store is None:
+            raise ValueError("La régénération incrémentale est désactivée.")
+        
+        # Create temporary PDF file unless the caller chose the destination
+        pdf_path = output_path if output_path is not None else os.path.join(tempfile.gettempdir(), f"factures_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf")
+        
+        # Rows flow from the reader to the renderer in chunks; the total is the
+        # count of the numbering step, or else the rows the workbook declares
+        if progress_callback is not None:
+            progress_callback = _progress_with_total(progress_callback, stats, count if first_number is not None else None)
+        chunks = iter_clients(fichier_excel, file_ext, stats)
+        if recorder is not None:
+            chunks = _recorded(chunks, recorder, stats, render_options)
+        
+        # Spread big batches across processes, small ones are faster drawn serially
+        workers = 1
+        if render_workers > 1:
+            enough, chunks = peek_rows(chunks, parallel_min_rows)
+            workers = render_workers if enough else 1
+        if render_options['incremental']:
+            render_pdf_incremental(chunks, pdf_path, render_options, page_store, workers, progress_callback, stats=stats)
+        else:
+            render_pdf_chunks(chunks, pdf_path, render_options, workers, progress_callback, stats=stats)
+        
+        stats.bytes_out = stream_size(pdf_path)
+        if recorder is not None:
+            with stats.phase('ledger'):
+                recorder.close()
+        stats.publish()
+        logger.info(f"Génération terminée: {stats.rows} factures, {stats.bytes_in} octets lus, {stats.bytes_out} octets de PDF, {server_timing(stats.timings)}")
+        return pdf_path
+        
+    except Exception as e:
+        stats.publish(status='failed')
+        logger.error(f"Erreur lors de la génération du PDF: {str(e)}")
+        if recorder is not None:
+            recorder.discard()
+        if first_number is not None:
+            sequence.release(first_number, count)
+        # Pages are written as they are drawn, do not leave a truncated PDF behind
+        if isinstance(pdf_path, str) and os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        raise
+
+
+def validate_workbook(fichier_excel, file_ext=None, unit_price=0.0):
+    """
+    Check that a workbook can be rendered, without drawing anything.
+
+    Only the projected columns are read and sanitised. Returns a dict with the
+    number of invoices, the data rows skipped for lack of a name, the quantity
+    total and the grand total at unit_price, the columns used for each field
+    (see column_mapping.describe_mapping), plus errors, the user-facing
+    messages that would make the full generation fail (empty when valid).
+    """
+    stats = GenerationStats()
+    total_quantity = 0.0
+    errors = []
+    try:
+        for chunk in iter_clients(fichier_excel, file_ext, stats):
+            total_quantity += math.fsum(chunk.quantites)
+    except ValueError as e:
+        errors.append(str(e))
+    
+    return {
+        'valid': not errors,
+        'rows': stats.rows,
+        'skipped_rows': stats.skipped_rows,
+        'total_quantity': total_quantity,
+        'unit_price': unit_price,
+        'grand_total': round(total_quantity * unit_price, 2),
+        'columns': describe_mapping(stats.columns) if stats.columns else None,
+        'errors': errors,
+        'timings': {name: round(seconds, 6) for name, seconds in stats.timings.items()},
+    }
+
+
+def generer_apercu_pdf(fichier_excel, output_path, file_ext=None, **parameters):
+    """
+    Render the first page of the invoices only, as a preview of the chosen layout.
+
+    The workbook is read no further than the first chunk holding a client.
+    output_path may be a path or a writable binary file object; parameters are
+    those of build_render_options, the preview always being drawn with the
+    "fast" output profile. Raises ValueError with a user-facing message when
+    the workbook cannot be read.
+    """
+    render_options = build_render_options(**dict(parameters, output_profile='fast'))
+    chunks = iter_clients(fichier_excel, file_ext)
+    try:
+        first_chunk = next(chunks)
+    finally:
+        chunks.close()
+    
+    render_pdf(first_chunk[:render_options['factures_par_page']], output_path, render_options)
+    return output_path
+
+
+def _file_name_part(text):
+    """ASCII file name fragment of a client field, accents folded and other characters replaced."""
+    ascii_text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return UNSAFE_FILENAME_CHARS.sub('_', ascii_text).strip('._')
+
+
+def invoice_file_names(clients):
+    """File names of the per-client PDFs, from the breeder card and the name, unique within the batch."""
+    names = []
+    used = set()
+    for index, (nom, _, carte, _) in enumerate(clients, start=1):
+        stem = '_'.join(part for part in (_file_name_part(carte), _file_name_part(nom)) if part)
+        stem = stem[:MAX_FILENAME_STEM] or f"facture_{index:06d}"
+        name = f"{stem}.pdf"
+        counter = 2
+        while name in used:
+            name = f"{stem}_{counter}.pdf"
+            counter += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def generer_factures_zip(fichier_excel, file_ext=None, stats=None, render_workers=1, parallel_min_rows=PARALLEL_RENDER_MIN_ROWS, recorder=None, sequence=None, **parameters):
+    """
+    Generate one PDF per client, packed in a ZIP archive streamed as the invoices are rendered.
+
+    The workbook is read and validated before returning, so input errors are
+    raised here; the returned generator then yields the archive bytes entry
+    by entry without holding the archive in memory or on disk. Each file is
+    named after the breeder card and the client name. Other arguments are
+    those of generer_factures_pdf; factures_par_page and incremental do not apply, and the
+    recorder is closed once the whole archive has been sent. Sequential
+    numbers are reserved once the workbook is read, and released if the
+    archive fails or is abandoned before any byte of it was sent; once
+    invoices carrying them may have reached the client the block is kept,
+    leaving a gap rather than issuing a number twice.
+    """
+    stats = stats if stats is not None else GenerationStats()
+    render_options = None
+    clients_data = ()
+    
+    def release_numbers():
+        if render_options is not None and render_options['first_invoice_number'] is not None:
+            sequence.release(render_options['first_invoice_number'], len(clients_data))
+    
+    try:
+        stats.bytes_in = stream_size(fichier_excel)
+        render_options = build_render_options(**parameters)
+        clients_data = load_clients(fichier_excel, file_ext, stats)
+        if render_options['numbering'] == 'sequential':
+            _reserve_numbers(sequence, len(clients_data), render_options, stats)
+        if recorder is not None:
+            with stats.phase('ledger'):
+                recorder.add(clients_data, invoice_numbers(render_options, 0, len(clients_data)))
+    except Exception as e:
+        stats.publish(status='failed')
+        logger.error(f"Erreur lors de la génération des PDF séparés: {str(e)}")
+        if recorder is not None:
+            recorder.discard()
+        release_numbers()
+        raise
+    
+    workers = render_workers if len(clients_data) >= parallel_min_rows else 1
+    
+    def archive_chunks():
+        started = time.perf_counter()
+        try:
+            # Primed below, so that closing the archive before its first entry still runs the handlers
+            yield b''
+            pdfs = iter_invoice_pdfs(clients_data, render_options, workers)
+            for chunk in stream_zip(zip(invoice_file_names(clients_data), pdfs)):
+                stats.bytes_out += len(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The client went away, the remaining invoices are not rendered
+            logger.info(f"Archive interrompue après {stats.bytes_out} octets")
+            if recorder is not None:
+                recorder.discard()
+            if not stats.bytes_out:
+                release_numbers()
+            raise
+        except Exception as e:
+            stats.publish(status='failed')
+            logger.error(f"Erreur lors de la génération des PDF séparés: {str(e)}")
+            if recorder is not None:
+                recorder.discard()
+            if not stats.bytes_out:
+                release_numbers()
+            raise
+        # Rendering and zipping are interleaved with sending, they count as one phase
+        stats.add('render', time.perf_counter() - started)
+        if recorder is not None:
+            with stats.phase('ledger'):
+                recorder.close()
+        stats.publish()
+        logger.info(f"Archive terminée: {stats.rows} factures, {stats.bytes_out} octets, {server_timing(stats.timings)}")
+    
+    chunks = archive_chunks()
+    next(chunks)
+    return chunks
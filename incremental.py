@@ -0,0 +1,265 @@
+"""Incremental regeneration of a revised workbook from previously rendered pages.
+
+Every client record is fingerprinted together with the batch parameters, and
+every page by the fingerprints of the invoices it holds, in slot order, so a
+page of the 2 and 4 per page layouts is only reused when all its invoices are
+unchanged. Rendered parts are kept on disk by PageStore with the keys of
+their pages; a new generation with the same parameters copies the pages it
+already has from those parts and renders only the others, splicing both into
+the output in document order.
+
+This module does not import the Flask application.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from extraction import ClientColumns, page_aligned_chunks
+from fonts import FONT_PATH, invoice_fonts
+from rendering import RENDER_CHUNK_ROWS, render_chunk, output_profile, pdf_writer, _phase
+from result_cache import CACHE_FORMAT_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Render options that do not change what a page looks like; of the output
+# profile only page stream compression is drawn into the stored parts
+UNKEYED_OPTIONS = ('incremental', 'first_invoice_number', 'output_profile')
+
+
+def batch_fingerprint(options):
+    """Hash of everything besides the client records that a rendered page depends on."""
+    payload = json.dumps(
+        {
+            'version': CACHE_FORMAT_VERSION,
+            'fonts': list(invoice_fonts()),
+            'font_path': FONT_PATH,
+            'options': {name: value for name, value in options.items() if name not in UNKEYED_OPTIONS},
+            'compressed': output_profile(options) != 'fast',
+        },
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def row_fingerprint(batch_key, client):
+    """Digest of one (nom, adresse, carte_eleveur, quantite) record rendered with the batch batch_key."""
+    nom, adresse, carte, quantite = client
+    payload = '\x1f'.join((batch_key, nom, adresse, carte, repr(float(quantite))))
+    return hashlib.sha256(payload.encode('utf-8')).digest()
+
+
+def page_key(batch_key, clients):
+    """Key of the page drawing these records, in slot order."""
+    return hashlib.sha256(b''.join(row_fingerprint(batch_key, client) for client in clients)).hexdigest()
+
+
+class PageStore:
+    """
+    Rendered parts stored as <batch>/<part>.pdf with the page keys in <part>.json.
+
+    Parts are written once and shared by all worker processes; least recently
+    reused ones are evicted once the size or age limit is hit. A part evicted
+    while a generation wanted it is simply rendered again.
+    """
+
+    def __init__(self, folder, max_bytes, max_age_seconds):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, batch_key, part, extension):
+        return os.path.join(self.folder, batch_key, f"{part}.{extension}")
+
+    def page_index(self, batch_key):
+        """Return {page key: (part, page index)} of every stored page of the batch, the latest part winning."""
+        folder = os.path.join(self.folder, batch_key)
+        if not os.path.isdir(folder):
+            return {}
+        now = time.time()
+        parts = []
+        for entry in os.scandir(folder):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                modified = os.path.getmtime(entry.path[:-len('.json')] + '.pdf')
+            except FileNotFoundError:
+                continue
+            if now - modified <= self.max_age_seconds:
+                parts.append((modified, entry.name[:-len('.json')], entry.path))
+
+        index = {}
+        for _, part, path in sorted(parts):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    keys = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            index.update((key, (part, page)) for page, key in enumerate(keys))
+        return index
+
+    def read_part(self, batch_key, part):
+        """Return the PDF bytes of a stored part, or None once evicted."""
+        path = self._path(batch_key, part, 'pdf')
+        try:
+            with open(path, 'rb') as f:
+                pdf_bytes = f.read()
+            # The modification time doubles as the LRU timestamp
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return pdf_bytes
+
+    def add_part(self, batch_key, pdf_bytes, keys):
+        """Store a freshly rendered part whose pages have these keys and return its name."""
+        part = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.folder, batch_key), exist_ok=True)
+        # The PDF goes first: a part is only listed once its keys are in place
+        for extension, data in (('pdf', pdf_bytes), ('json', json.dumps(keys).encode('utf-8'))):
+            path = self._path(batch_key, part, extension)
+            staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(staging_path, 'wb') as f:
+                f.write(data)
+            os.replace(staging_path, path)
+        return part
+
+    def evict(self):
+        """Drop expired parts, then the least recently reused ones until the size limit holds."""
+        now = time.time()
+        parts = []
+        for batch in os.scandir(self.folder):
+            if not batch.is_dir():
+                continue
+            for entry in os.scandir(batch.path):
+                if not entry.name.endswith('.pdf'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(entry.path)
+                else:
+                    parts.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in parts)
+        for _, size, path in sorted(parts):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def _remove(self, pdf_path):
+        for path in (pdf_path[:-len('.pdf')] + '.json', pdf_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _page_runs(parts, factures_par_page, batch_key, index, stats):
+    """
+    Split the document into runs of consecutive pages and yield them as (part, pages, clients, keys).
+
+    A run reused from a stored part has its name and the indexes of the pages
+    in it; a run to render has part None and at most RENDER_CHUNK_ROWS records.
+    """
+    run_part, run_pages, run_clients, run_keys = None, [], ClientColumns(), []
+    for chunk in parts:
+        with _phase(stats, 'diff'):
+            pages = []
+            for start in range(0, len(chunk), factures_par_page):
+                clients = chunk[start:start + factures_par_page]
+                key = page_key(batch_key, clients)
+                pages.append((clients, key) + index.get(key, (None, None)))
+        for clients, key, part, page in pages:
+            if run_keys and (part != run_part or (part is None and len(run_clients) >= RENDER_CHUNK_ROWS)):
+                yield run_part, run_pages, run_clients, run_keys
+                run_pages, run_clients, run_keys = [], ClientColumns(), []
+            run_part = part
+            if part is not None:
+                run_pages.append(page)
+            run_clients.extend(clients)
+            run_keys.append(key)
+    if run_keys:
+        yield run_part, run_pages, run_clients, run_keys
+
+
+def render_pdf_incremental(chunks, pdf_path, options, store, workers=1, progress_callback=None, rows_total=None, stats=None):
+    """
+    Render ClientColumns chunks into a single PDF like rendering.render_pdf_chunks, reusing stored pages.
+
+    Pages whose invoices were already rendered with the same options are
+    copied from the parts kept in store (a PageStore); the others are drawn,
+    across a process pool with several workers, and stored in turn for the
+    next revision. The output profile applies to reused and new pages
+    alike. The records on reused pages are counted into
+    stats.reused_rows. Returns pdf_path.
+    """
+    batch_key = batch_fingerprint(options)
+    with _phase(stats, 'diff'):
+        index = store.page_index(batch_key)
+    runs = _page_runs(page_aligned_chunks(chunks, RENDER_CHUNK_ROWS), options['factures_par_page'], batch_key, index, stats)
+
+    rows_done = 0
+    reused_rows = 0
+    if progress_callback:
+        progress_callback(0, rows_total)
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    pending = deque()
+
+    def submit_next():
+        run = next(runs, None)
+        if run is not None:
+            part, _, clients, _ = run
+            pending.append((run, pool.submit(render_chunk, clients, options) if part is None and pool is not None else None))
+        return run is not None
+
+    # The last stored part read, runs often come from the same one in a row
+    loaded_part, loaded_bytes = None, None
+    try:
+        with pdf_writer(pdf_path, options) as writer:
+            # At most two runs per worker in flight, so memory stays bounded
+            while len(pending) < max(workers, 1) * 2 and submit_next():
+                pass
+            while pending:
+                (part, pages, clients, keys), future = pending.popleft()
+                if part is not None and part != loaded_part:
+                    with _phase(stats, 'serialize'):
+                        loaded_part, loaded_bytes = part, store.read_part(batch_key, part)
+                if part is not None and loaded_bytes is None:
+                    # Evicted since the index was read, draw the pages again
+                    part = loaded_part = None
+                if part is None:
+                    with _phase(stats, 'render'):
+                        pdf_bytes = future.result() if future is not None else render_chunk(clients, options)
+                    with _phase(stats, 'serialize'):
+                        part = store.add_part(batch_key, pdf_bytes, keys)
+                        writer.append(pdf_bytes, source=part)
+                else:
+                    with _phase(stats, 'serialize'):
+                        writer.append(loaded_bytes, pages, source=part)
+                    reused_rows += len(clients)
+                submit_next()
+                rows_done += len(clients)
+                if progress_callback:
+                    progress_callback(rows_done, rows_total)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    with _phase(stats, 'serialize'):
+        store.evict()
+    if stats is not None:
+        stats.reused_rows = reused_rows
+    logger.info(f"{rows_done} factures, {reused_rows} reprises d'une génération précédente et {rows_done - reused_rows} redessinées, {writer.page_count} pages")
+    return pdf_path
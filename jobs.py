@@ -0,0 +1,253 @@
+"""Background invoice generation jobs.
+
+Uploads are recorded as GenerationJob rows and rendered by a local thread
+pool, so any gunicorn worker can report progress or serve the finished PDF.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import datetime
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+from app import app, db, generer_factures_pdf, ledger_recorder, invoice_sequence, page_store
+from models import GenerationJob
+from metrics import GenerationStats
+from result_cache import ResultCache, hash_stream, cache_key
+from column_mapping import mappings_version
+
+# Number of rendered rows between two progress writes to the database
+PROGRESS_UPDATE_INTERVAL = 200
+
+# Seconds between two heartbeats of the jobs queued or running in this process;
+# a job without one for JOB_STALE_SECONDS was left behind by a dead process
+JOB_HEARTBEAT_SECONDS = 30
+
+PENDING_STATUSES = ('queued', 'running')
+
+_executor = None
+_executor_lock = threading.Lock()
+_result_cache = None
+# IDs of the jobs this process has queued and not finished yet
+_active_jobs = set()
+
+
+def get_executor():
+    """Return the process-wide job executor, creating it on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config['JOB_WORKERS'],
+                thread_name_prefix='invoice-job'
+            )
+            threading.Thread(target=_heartbeat, name='invoice-job-heartbeat', daemon=True).start()
+        return _executor
+
+
+def _heartbeat():
+    """Refresh updated_at of the jobs held by this process, so that live jobs are never taken for stale ones."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _executor_lock:
+            job_ids = list(_active_jobs)
+        if not job_ids:
+            continue
+        try:
+            with app.app_context():
+                GenerationJob.query.filter(
+                    GenerationJob.id.in_(job_ids),
+                    GenerationJob.status.in_(PENDING_STATUSES)
+                ).update({GenerationJob.updated_at: db.func.current_timestamp()}, synchronize_session=False)
+                db.session.commit()
+        except Exception as e:
+            app.logger.warning(f"Battement des tâches non enregistré: {e}")
+
+
+def _utc_now():
+    # current_timestamp() is stored in UTC without timezone information
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def stale_cutoff():
+    """updated_at before which a queued or running job is considered abandoned."""
+    return _utc_now() - datetime.timedelta(seconds=app.config['JOB_STALE_SECONDS'])
+
+
+def fail_stale_jobs():
+    """Mark as failed the queued and running jobs whose process stopped sending heartbeats; returns their number."""
+    failed = GenerationJob.query.filter(
+        GenerationJob.status.in_(PENDING_STATUSES),
+        GenerationJob.updated_at < stale_cutoff()
+    ).update({
+        GenerationJob.status: 'failed',
+        GenerationJob.error: "Tâche abandonnée: le processus qui la traitait s'est arrêté. Veuillez relancer la génération.",
+    }, synchronize_session=False)
+    db.session.commit()
+    if failed:
+        app.logger.warning(f"{failed} tâche(s) abandonnée(s) marquée(s) en échec")
+    return failed
+
+
+def get_result_cache():
+    """Return the process-wide result cache, creating it on first use."""
+    global _result_cache
+    with _executor_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                app.config['RESULT_CACHE_FOLDER'],
+                app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024,
+                app.config['RESULT_CACHE_MAX_AGE_HOURS'] * 3600
+            )
+        return _result_cache
+
+
+def generation_cache_key(file, parameters):
+    """Cache key of an upload: hash of its bytes plus every rendering parameter and the column mappings version."""
+    keyed_parameters = dict(parameters)
+    # An empty date means today, so the key must change with the day
+    keyed_parameters['invoice_date'] = parameters.get('invoice_date') or datetime.date.today().isoformat()
+    # The columns read from the upload change when a mapping is overridden or deleted
+    keyed_parameters['column_mappings'] = mappings_version()
+    return cache_key(hash_stream(file.stream), keyed_parameters)
+
+
+def submit_job(file, parameters):
+    """
+    Record a generation job for the uploaded file.
+
+    Returns (job, cached). A job whose PDF is already in the result cache is
+    recorded as done; an identical submission still running, with a recent
+    heartbeat, is returned as is; otherwise the upload is copied to a private spooled buffer and handed to
+    the pool with the job.
+    """
+    os.makedirs(app.config['JOBS_FOLDER'], exist_ok=True)
+    purge_expired_jobs()
+
+    # Sequentially numbered invoices differ on every run, they are neither cached nor joined
+    result_cache = get_result_cache()
+    key = None
+    if parameters.get('numbering') != 'sequential':
+        key = generation_cache_key(file, parameters)
+    cached_path = result_cache.get(key) if key else None
+
+    if cached_path is None and key:
+        # A double submission joins the job already rendering the same PDF
+        pending = GenerationJob.query.filter(
+            GenerationJob.cache_key == key,
+            GenerationJob.status.in_(PENDING_STATUSES),
+            GenerationJob.updated_at >= stale_cutoff()
+        ).first()
+        if pending is not None:
+            return pending, False
+
+    job_id = uuid.uuid4().hex
+    job = GenerationJob(
+        id=job_id,
+        filename=secure_filename(file.filename),
+        parameters=json.dumps(parameters),
+        cache_key=key if key and result_cache.enabled else None
+    )
+
+    if cached_path is not None:
+        job.status = 'done'
+        job.result_path = cached_path
+        db.session.add(job)
+        db.session.commit()
+        app.logger.info(f"Factures de {file.filename} servies depuis le cache ({key[:12]})")
+        return job, True
+
+    # The request stream is closed once the response is sent, the job keeps its own copy
+    upload = tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_MAX_BYTES'])
+    shutil.copyfileobj(file.stream, upload)
+    upload.seek(0)
+
+    job.status = 'queued'
+    db.session.add(job)
+    db.session.commit()
+
+    executor = get_executor()
+    with _executor_lock:
+        _active_jobs.add(job_id)
+    executor.submit(run_job, job_id, upload, file.filename.rsplit('.', 1)[1])
+    app.logger.info(f"Tâche {job_id} mise en file pour {file.filename}")
+    return job, False
+
+
+def run_job(job_id, upload, file_ext):
+    """Render the PDF for a queued job from its spooled upload and record the outcome."""
+    try:
+        _run_job(job_id, upload, file_ext)
+    finally:
+        with _executor_lock:
+            _active_jobs.discard(job_id)
+
+
+def _run_job(job_id, upload, file_ext):
+    with app.app_context():
+        job = db.session.get(GenerationJob, job_id)
+        if job is None or job.status != 'queued':
+            upload.close()
+            return
+
+        job.status = 'running'
+        db.session.commit()
+
+        # rows_total is None until the workbook is open
+        def report_progress(rows_done, rows_total):
+            if rows_done == rows_total or rows_done % PROGRESS_UPDATE_INTERVAL == 0:
+                job.rows_processed = rows_done
+                job.rows_total = rows_total
+                db.session.commit()
+
+        stats = GenerationStats()
+        try:
+            result_path = os.path.join(app.config['JOBS_FOLDER'], f"{job_id}.pdf")
+            parameters = json.loads(job.parameters or '{}')
+            generer_factures_pdf(
+                fichier_excel=upload,
+                file_ext=file_ext,
+                output_path=result_path,
+                progress_callback=report_progress,
+                stats=stats,
+                recorder=ledger_recorder(parameters, job.filename, job_id),
+                sequence=invoice_sequence(parameters),
+                page_store=page_store(parameters),
+                **parameters
+            )
+            if job.cache_key:
+                result_path = get_result_cache().put(job.cache_key, result_path)
+            job.result_path = result_path
+            job.rows_processed = job.rows_total = stats.rows
+            job.status = 'done'
+        except Exception as e:
+            app.logger.error(f"Échec de la tâche {job_id}: {str(e)}")
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            upload.close()
+            job.metrics = json.dumps(stats.to_dict())
+            db.session.commit()
+
+
+def purge_expired_jobs():
+    """Fail abandoned jobs, then delete finished jobs, and their files, older than the retention period."""
+    fail_stale_jobs()
+    cutoff = _utc_now() - datetime.timedelta(hours=app.config['JOB_RETENTION_HOURS'])
+    expired = GenerationJob.query.filter(
+        GenerationJob.status.in_(('done', 'failed')),
+        GenerationJob.updated_at < cutoff
+    ).all()
+    result_cache = get_result_cache()
+    for job in expired:
+        # Cached PDFs outlive their job, the cache evicts them itself
+        if job.result_path and os.path.exists(job.result_path) and not result_cache.owns(job.result_path):
+            os.remove(job.result_path)
+        db.session.delete(job)
+    if expired:
+        db.session.commit()
@@ -0,0 +1,220 @@
+"""Persisted ledger of every generated invoice.
+
+A LedgerRecorder receives the client records of a generation as they stream
+through the pipeline and writes them in bulk: PostgreSQL COPY when
+DATABASE_URL points at PostgreSQL, a single executemany INSERT per flush on
+other databases. Rows are written in short transactions so that SQLite is
+never locked for the whole render; the batch stays "pending", and out of
+search results, until the generation succeeds, and its rows are deleted if
+it fails.
+
+The recorder works on a plain SQLAlchemy engine and the reflected ledger
+tables, so batch.py's worker processes record their invoices without
+importing the Flask application; only search_invoices needs it.
+"""
+import io
+import csv
+import logging
+import datetime
+import threading
+import unicodedata
+
+from sqlalchemy import MetaData, Table, delete, func, insert, select, tuple_, update
+
+logger = logging.getLogger(__name__)
+
+# Invoice rows buffered before they are written
+LEDGER_FLUSH_ROWS = 5000
+
+# Tables of the Invoice and InvoiceBatch models
+INVOICE_TABLE = 'invoice'
+BATCH_TABLE = 'invoice_batch'
+
+# Largest page a search may ask for
+SEARCH_MAX_LIMIT = 500
+
+INVOICE_COLUMNS = (
+    'batch_id', 'position', 'invoice_number', 'client_name', 'client_key', 'address', 'breeder_card',
+    'quantity', 'unit_price', 'total', 'month_year', 'invoice_date',
+)
+
+# Always strings: COPY must keep their empty values as '' rather than read them as NULL
+COPY_TEXT_COLUMNS = ('client_name', 'client_key', 'address', 'breeder_card', 'month_year')
+
+
+def client_search_key(text):
+    """Upper-case ASCII form of a client name, as stored in Invoice.client_key."""
+    folded = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(folded.upper().split())
+
+
+# Reflected (invoice, invoice_batch) tables per database URL
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def ledger_tables(engine):
+    """Return the reflected (invoice, invoice_batch) tables of an engine's database."""
+    key = str(engine.url)
+    with _tables_lock:
+        if key not in _tables:
+            metadata = MetaData()
+            _tables[key] = (Table(INVOICE_TABLE, metadata, autoload_with=engine), Table(BATCH_TABLE, metadata, autoload_with=engine))
+        return _tables[key]
+
+
+class LedgerRecorder:
+    """Record the invoices of one generation into an InvoiceBatch of engine's database, in bulk."""
+
+    def __init__(self, engine, parameters, filename='', job_id=None):
+        # An engine rather than the Flask session, so that recording also works outside
+        # of the app context, while a streamed response is being sent, and in batch.py
+        self._engine = engine
+        self._invoices, self._batches = ledger_tables(engine)
+        self._pending = []
+        self._position = 0
+        self._total_quantity = 0.0
+        self._unit_price = float(parameters.get('unit_price') or 0.0)
+        self._fixed_number = parameters.get('fixed_invoice_number')
+        self._month_year = (parameters.get('month_year') or '').strip()
+        invoice_date = parameters.get('invoice_date')
+        self._invoice_date = datetime.datetime.strptime(invoice_date, '%Y-%m-%d').date() if invoice_date else datetime.date.today()
+
+        with self._engine.begin() as connection:
+            self.batch_id = connection.execute(insert(self._batches).values(
+                status='pending',
+                job_id=job_id,
+                filename=filename,
+                invoice_number=self._fixed_number,
+                numbering=parameters.get('numbering') or 'fixed',
+                invoice_date=self._invoice_date,
+                month_year=self._month_year,
+                company_name=parameters.get('company_name'),
+                item_name=parameters.get('item_name'),
+                unit_price=self._unit_price,
+                # The model's defaults, which the reflected table does not have
+                invoice_count=0,
+                total_quantity=0.0,
+                total_amount=0.0,
+                created_at=func.current_timestamp(),
+            )).inserted_primary_key[0]
+
+    def add(self, clients, invoice_numbers=None):
+        """
+        Buffer a ClientColumns chunk, writing the buffer once it holds LEDGER_FLUSH_ROWS rows.
+
+        invoice_numbers are the sequential numbers of the clients, None for the fixed number.
+        Names are recorded as typed in the workbook, not as shaped for drawing.
+        """
+        invoice_numbers = invoice_numbers or [None] * len(clients)
+        records = zip(clients.noms_saisis, clients.adresses, clients.cartes, clients.quantites)
+        for (nom, adresse, carte, quantite), invoice_number in zip(records, invoice_numbers):
+            self._pending.append((
+                self.batch_id, self._position, invoice_number or self._fixed_number, nom, client_search_key(nom), adresse, carte,
+                quantite, self._unit_price, round(quantite * self._unit_price, 2),
+                self._month_year, self._invoice_date,
+            ))
+            self._position += 1
+            self._total_quantity += quantite
+        if len(self._pending) >= LEDGER_FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows in one bulk operation."""
+        if not self._pending:
+            return
+        if self._engine.dialect.name == 'postgresql':
+            self._copy_rows(self._pending)
+        else:
+            with self._engine.begin() as connection:
+                connection.execute(insert(self._invoices), [dict(zip(INVOICE_COLUMNS, row)) for row in self._pending])
+        self._pending = []
+
+    def _copy_rows(self, rows):
+        """
+        Stream rows into the invoice table with PostgreSQL COPY.
+
+        An unquoted empty CSV field is NULL, as for None invoice numbers, except in COPY_TEXT_COLUMNS.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        connection = self._engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {INVOICE_TABLE} ({', '.join(INVOICE_COLUMNS)}) FROM STDIN "
+                    f"WITH (FORMAT csv, FORCE_NOT_NULL ({', '.join(COPY_TEXT_COLUMNS)}))",
+                    buffer
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def close(self):
+        """Write the remaining rows and mark the batch done with its totals."""
+        self.flush()
+        with self._engine.begin() as connection:
+            connection.execute(update(self._batches).where(self._batches.c.id == self.batch_id).values(
+                status='done',
+                invoice_count=self._position,
+                total_quantity=round(self._total_quantity, 6),
+                total_amount=round(self._total_quantity * self._unit_price, 2),
+            ))
+        logger.info(f"Lot {self.batch_id}: {self._position} factures enregistrées")
+
+    def discard(self):
+        """Delete the batch and the rows already written, after a failed generation."""
+        self._pending = []
+        try:
+            with self._engine.begin() as connection:
+                connection.execute(delete(self._invoices).where(self._invoices.c.batch_id == self.batch_id))
+                connection.execute(delete(self._batches).where(self._batches.c.id == self.batch_id))
+        except Exception as e:
+            logger.error(f"Impossible de supprimer le lot {self.batch_id}: {e}")
+
+
+def search_invoices(card=None, client=None, month=None, batch_id=None, after=None, limit=50, number=None):
+    """
+    Return (invoices, next_after) for the invoices of finished batches matching every given filter.
+
+    card, month and number (the invoice number) match exactly, client is a case and accent insensitive
+    prefix of the client name; a client with no letter of the search key, such as
+    an Arabic name, matches nothing. Results are ordered by id, or by client name then id when
+    client is given, and paged by keyset: pass next_after, the id of the last invoice,
+    back as after to get the following page, None on the last one.
+    """
+    from app import db
+    from models import Invoice, InvoiceBatch
+
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    client_key = client_search_key(client) if client else None
+    if client_key == '':
+        return [], None
+    query = select(Invoice).where(
+        Invoice.batch_id.in_(select(InvoiceBatch.id).where(InvoiceBatch.status == 'done'))
+    )
+    if card:
+        query = query.where(Invoice.breeder_card == card)
+    order = (Invoice.id,)
+    if client:
+        query = query.where(Invoice.client_key.startswith(client_key, autoescape=True))
+        # The (client_key, id) index returns a prefix in that order, without sorting every match
+        order = (Invoice.client_key, Invoice.id)
+    if month:
+        query = query.where(Invoice.month_year == month)
+    if number:
+        query = query.where(Invoice.invoice_number == number)
+    if batch_id is not None:
+        query = query.where(Invoice.batch_id == batch_id)
+    if after is not None:
+        if client:
+            after_key = select(Invoice.client_key).where(Invoice.id == after).scalar_subquery()
+            query = query.where(tuple_(Invoice.client_key, Invoice.id) > tuple_(after_key, after))
+        else:
+            query = query.where(Invoice.id > after)
+
+    # One extra row tells whether there is a next page
+    invoices = db.session.execute(query.order_by(*order).limit(limit + 1)).scalars().all()
+    next_after = invoices[limit - 1].id if len(invoices) > limit else None
+    return invoices[:limit], next_after
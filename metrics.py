@@ -0,0 +1,195 @@
+"""Per-phase performance instrumentation of invoice generation.
+
+GenerationStats records the duration of each phase of one generation (parse,
+extract, numbering, diff, render, serialize, ledger, send) along with row
+counts and bytes in and out.
+Published stats feed process-wide Prometheus histograms, exposed by the
+/metrics endpoint; each gunicorn worker reports its own series.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PHASES = ('parse', 'extract', 'numbering', 'diff', 'render', 'serialize', 'ledger', 'send')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+ROW_BUCKETS = (10, 100, 1000, 5000, 10000, 50000, 100000, 500000)
+BYTE_BUCKETS = tuple(1024 * size for size in (16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Histogram:
+    """Prometheus histogram with optional labels."""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    labels = _format_labels(key + (('le', _format_value(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+class Counter:
+    """Prometheus counter with optional labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+PHASE_SECONDS = Histogram('invoiceflow_phase_seconds', 'Duration of each invoice generation phase.', DURATION_BUCKETS, ('phase',))
+GENERATION_ROWS = Histogram('invoiceflow_generation_rows', 'Invoices rendered per generation.', ROW_BUCKETS)
+UPLOAD_BYTES = Histogram('invoiceflow_upload_bytes', 'Size of the uploaded workbooks.', BYTE_BUCKETS)
+PDF_BYTES = Histogram('invoiceflow_pdf_bytes', 'Size of the generated PDF documents.', BYTE_BUCKETS)
+GENERATIONS = Counter('invoiceflow_generations_total', 'Invoice generations by outcome.', ('status',))
+REQUEST_SECONDS = Histogram('invoiceflow_http_request_seconds', 'HTTP request duration by endpoint.', DURATION_BUCKETS, ('endpoint', 'method', 'status'))
+
+REGISTRY = [PHASE_SECONDS, GENERATION_ROWS, UPLOAD_BYTES, PDF_BYTES, GENERATIONS, REQUEST_SECONDS]
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where the platform cannot tell."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def stream_size(source):
+    """Size in bytes of a file path or seekable binary file object."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+class GenerationStats:
+    """Phase timings, row counts and byte sizes of one generation."""
+
+    def __init__(self):
+        self.timings = {}
+        self.rows = 0
+        self.skipped_rows = 0
+        # Invoices copied from an earlier generation instead of drawn (incremental mode)
+        self.reused_rows = 0
+        # Column mapping the workbook was read with (column_mapping.workbook_columns)
+        self.columns = None
+        # Data rows the workbook declares once it is open, an upper bound of rows
+        self.rows_expected = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as (part of) the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def to_dict(self):
+        return {
+            'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()},
+            'rows': self.rows,
+            'skipped_rows': self.skipped_rows,
+            'reused_rows': self.reused_rows,
+            'rendered_rows': self.rows - self.reused_rows,
+            'columns': self.columns['columns'] if self.columns else None,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+    def publish(self, status='done'):
+        """Feed this generation into the process-wide histograms."""
+        for name, seconds in self.timings.items():
+            PHASE_SECONDS.observe(seconds, phase=name)
+        GENERATIONS.inc(status=status)
+        if status != 'done':
+            return
+        GENERATION_ROWS.observe(self.rows)
+        UPLOAD_BYTES.observe(self.bytes_in)
+        PDF_BYTES.observe(self.bytes_out)
+
+
+def server_timing(timings):
+    """Format phase timings (in seconds) as a Server-Timing header value."""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def observe_send(seconds):
+    PHASE_SECONDS.observe(seconds, phase='send')
+
+
+def render_prometheus(extra_lines=()):
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    peak = peak_rss_bytes()
+    if peak is not None:
+        lines.extend([
+            "# HELP invoiceflow_peak_rss_bytes Peak resident set size of this worker process.",
+            "# TYPE invoiceflow_peak_rss_bytes gauge",
+            f"invoiceflow_peak_rss_bytes {peak}",
+        ])
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,11 @@
+import json
+
 from app import db
 
 class CompanySettings(db.Model):
-    """Model to store company settings for invoice generation."""
+    """Model to store a named profile of company settings for invoice generation."""
     id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=True, default='', server_default='')
     company_name = db.Column(db.String(200), nullable=True, default='')
     address = db.Column(db.Text, nullable=True, default='')
     rc_name = db.Column(db.String(100), nullable=True, default='')
@@ -11,8 +14,151 @@ class CompanySettings(db.Model):
     client_profession = db.Column(db.String(100), nullable=True, default='')
     rib = db.Column(db.String(100), nullable=True, default='')
     unit_price = db.Column(db.Float, nullable=True, default=0.0)
+    # Bumped by every update; profiles.py compares versions to spot changes made by other workers
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
+    __mapper_args__ = {'version_id_col': version}
+
+    def to_dict(self):
+        """Return the profile as a JSON-serialisable dict."""
+        return {
+            'id': self.id,
+            'name': self.name or self.company_name or f"Profil {self.id}",
+            'company_name': self.company_name or '',
+            'address': self.address or '',
+            'rc_name': self.rc_name or '',
+            'nif': self.nif or '',
+            'item_name': self.item_name or '',
+            'client_profession': self.client_profession or '',
+            'rib': self.rib or '',
+            'unit_price': self.unit_price or 0.0,
+            'version': self.version,
+        }
+
     def __repr__(self):
         return f'<CompanySettings {self.company_name}>'
+
+
+class GenerationJob(db.Model):
+    """Model to track background invoice generation jobs."""
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    filename = db.Column(db.String(255), nullable=True, default='')
+    result_path = db.Column(db.Text, nullable=True)
+    parameters = db.Column(db.Text, nullable=True, default='{}')
+    cache_key = db.Column(db.String(64), nullable=True, index=True)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_total = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # JSON of metrics.GenerationStats.to_dict(): phase timings, rows, bytes, peak memory
+    metrics = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    def to_dict(self):
+        """Return the job state as a JSON-serialisable dict."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'rows_processed': self.rows_processed,
+            'rows_total': self.rows_total,
+            'error': self.error,
+            'metrics': json.loads(self.metrics) if self.metrics else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def __repr__(self):
+        return f'<GenerationJob {self.id} {self.status}>'
+
+
+class InvoiceBatch(db.Model):
+    """Model to record one generated batch of invoices and its totals."""
+    id = db.Column(db.Integer, primary_key=True)
+    # pending while invoices are being written, done once the generation succeeded
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    job_id = db.Column(db.String(32), nullable=True, index=True)
+    filename = db.Column(db.String(255), nullable=True, default='')
+    # Fixed number of every invoice, or prefix of the sequential numbers
+    invoice_number = db.Column(db.String(100), nullable=True)
+    numbering = db.Column(db.String(20), nullable=False, default='fixed')
+    invoice_date = db.Column(db.Date, nullable=True)
+    month_year = db.Column(db.String(50), nullable=True, index=True)
+    company_name = db.Column(db.String(200), nullable=True)
+    item_name = db.Column(db.String(200), nullable=True)
+    unit_price = db.Column(db.Float, nullable=False, default=0.0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def to_dict(self):
+        """Return the batch as a JSON-serialisable dict."""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'job_id': self.job_id,
+            'filename': self.filename,
+            'invoice_number': self.invoice_number,
+            'numbering': self.numbering,
+            'invoice_date': self.invoice_date.isoformat() if self.invoice_date else None,
+            'month_year': self.month_year,
+            'company_name': self.company_name,
+            'item_name': self.item_name,
+            'unit_price': self.unit_price,
+            'invoice_count': self.invoice_count,
+            'total_quantity': self.total_quantity,
+            'total_amount': self.total_amount,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def __repr__(self):
+        return f'<InvoiceBatch {self.id} {self.status}>'
+
+
+class Invoice(db.Model):
+    """Model to record one generated invoice, written in bulk by ledger.py."""
+    # Searches filter on one column and page on id, hence the (column, id) indexes
+    __table_args__ = (
+        db.Index('ix_invoice_breeder_card_id', 'breeder_card', 'id'),
+        db.Index('ix_invoice_client_key_id', 'client_key', 'id', postgresql_ops={'client_key': 'varchar_pattern_ops'}),
+        db.Index('ix_invoice_month_year_id', 'month_year', 'id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('invoice_batch.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    invoice_number = db.Column(db.String(100), nullable=True, index=True)
+    client_name = db.Column(db.String(255), nullable=False)
+    # Upper-case ASCII form of the client name, for case and accent insensitive prefix search
+    client_key = db.Column(db.String(255), nullable=False)
+    address = db.Column(db.Text, nullable=True)
+    breeder_card = db.Column(db.String(100), nullable=True)
+    quantity = db.Column(db.Float, nullable=False)
+    unit_price = db.Column(db.Float, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    month_year = db.Column(db.String(50), nullable=True)
+    invoice_date = db.Column(db.Date, nullable=True)
+
+    def to_dict(self):
+        """Return the invoice as a JSON-serialisable dict."""
+        return {
+            'id': self.id,
+            'batch_id': self.batch_id,
+            'position': self.position,
+            'invoice_number': self.invoice_number,
+            'client_name': self.client_name,
+            'address': self.address,
+            'breeder_card': self.breeder_card,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price,
+            'total': self.total,
+            'month_year': self.month_year,
+            'invoice_date': self.invoice_date.isoformat() if self.invoice_date else None,
+        }
+
+    def __repr__(self):
+        return f'<Invoice {self.id} {self.breeder_card}>'
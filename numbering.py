@@ -0,0 +1,105 @@
+"""Sequential invoice numbers, unique per company and year.
+
+The next free number of every (company, year) pair is kept in the
+invoice_sequence table. A generation reserves the whole block of numbers it
+needs with a single atomic UPSERT ... RETURNING, in one short transaction,
+then numbers its invoices locally: concurrent gunicorn workers, jobs and
+batch processes only ever contend for that one statement, never per invoice.
+A failed generation gives its block back when no later block was reserved
+meanwhile, so numbers stay gapless unless generations fail concurrently.
+
+This module does not import the Flask application so that the batch command
+line can number invoices too.
+"""
+import logging
+import datetime
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, UniqueConstraint, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+NUMBERING_MODES = ('fixed', 'sequential')
+
+metadata = MetaData()
+
+invoice_sequence = Table(
+    'invoice_sequence', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('company', String(200), nullable=False),
+    Column('year', Integer, nullable=False),
+    Column('next_number', Integer, nullable=False),
+    UniqueConstraint('company', 'year', name='uq_invoice_sequence_company_year'),
+)
+
+
+def create_sequence_table(engine):
+    """Create the invoice_sequence table if it does not exist yet."""
+    metadata.create_all(engine)
+
+
+def format_invoice_number(prefix, year, number):
+    """Printed form of a sequential invoice number, e.g. FAC-2024-000123."""
+    prefix = (prefix or '').strip()
+    return f"{prefix}-{year}-{number:06d}" if prefix else f"{year}-{number:06d}"
+
+
+class InvoiceSequence:
+    """Reserve blocks of consecutive invoice numbers for one company and year."""
+
+    def __init__(self, engine, company, year):
+        self._engine = engine
+        self.company = company
+        self.year = year
+
+    def reserve(self, count):
+        """Reserve count consecutive numbers in one transaction and return the first one."""
+        table = invoice_sequence
+        dialect = self._engine.dialect.name
+        with self._engine.begin() as connection:
+            if dialect in ('postgresql', 'sqlite'):
+                insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+                statement = insert(table).values(
+                    company=self.company, year=self.year, next_number=1 + count
+                ).on_conflict_do_update(
+                    index_elements=[table.c.company, table.c.year],
+                    set_={'next_number': table.c.next_number + count},
+                ).returning(table.c.next_number)
+                next_number = connection.execute(statement).scalar_one()
+            else:
+                # No portable UPSERT: lock the row, creating it on first use
+                key = (table.c.company == self.company) & (table.c.year == self.year)
+                current = connection.execute(select(table.c.next_number).where(key).with_for_update()).scalar()
+                if current is None:
+                    next_number = 1 + count
+                    connection.execute(table.insert().values(company=self.company, year=self.year, next_number=next_number))
+                else:
+                    next_number = current + count
+                    connection.execute(update(table).where(key).values(next_number=next_number))
+        first = next_number - count
+        logger.info(f"Numéros {first} à {next_number - 1} réservés pour {self.company or 'la société'} ({self.year})")
+        return first
+
+    def release(self, first, count):
+        """
+        Give back a block that was not used, if it is still the last one reserved.
+
+        Returns False, leaving a gap, when another block was reserved after it.
+        """
+        table = invoice_sequence
+        with self._engine.begin() as connection:
+            released = connection.execute(update(table).where(
+                (table.c.company == self.company) & (table.c.year == self.year)
+                & (table.c.next_number == first + count)
+            ).values(next_number=first)).rowcount == 1
+        if not released:
+            logger.warning(f"Numéros {first} à {first + count - 1} de {self.company or 'la société'} ({self.year}) perdus: un autre lot a été numéroté entre-temps")
+        return released
+
+
+def sequence_for(engine, parameters):
+    """Return the InvoiceSequence of a generation's parameters: per NIF (or company name) and invoice year."""
+    company = (parameters.get('nif') or '').strip() or (parameters.get('company_name') or '').strip()
+    invoice_date = parameters.get('invoice_date')
+    year = datetime.datetime.strptime(invoice_date, '%Y-%m-%d').year if invoice_date else datetime.date.today().year
+    return InvoiceSequence(engine, company, year)
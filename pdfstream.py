@@ -0,0 +1,356 @@
+"""Progressive assembly of one PDF document from separately rendered parts.
+
+ReportLab keeps every page of a canvas in memory until save(), so large
+batches are rendered as a series of small PDFs instead. StreamingPdfWriter
+copies the objects of each part straight to the output file under new object
+numbers and forgets them; only the byte offset of every object and the
+number of every page are kept until the page tree, catalog and
+cross-reference table are written by close().
+
+Parts are ReportLab output, whose layout is fixed: a classic cross-reference
+table, a flat page tree and plain-text object headers. Object headers are
+renumbered with a regular expression and stream data is copied untouched,
+which is several times faster than a general PDF parser. A part may also be
+appended page by page, copying only the objects those pages use, so pages
+kept from an earlier document can be spliced between freshly rendered ones.
+
+ReportLab tags the font subsets of every part alike (AAAAAA+DejaVuSans), so
+each copied font takes a tag derived from the object number of its font
+descriptor, unique in the output.
+
+A compact writer also shares objects that are byte for byte identical across
+parts (the embedded fonts and the invoice template of every part are the
+same) and packs the small objects, mostly page dictionaries, into compressed
+object streams indexed by a cross-reference stream (PDF 1.5).
+"""
+import re
+import zlib
+import hashlib
+import datetime
+from xml.sax.saxutils import escape
+
+# Object numbers of the page tree root and the catalog, written last
+PAGES_ID = 1
+CATALOG_ID = 2
+
+XREF_ENTRY = re.compile(rb'(\d{10}) (\d{5}) ([nf])')
+REFERENCE = re.compile(rb'(\d+) 0 R')
+TRAILER_ROOT = re.compile(rb'/Root (\d+) 0 R')
+TRAILER_INFO = re.compile(rb'/Info (\d+) 0 R')
+CATALOG_PAGES = re.compile(rb'/Pages (\d+) 0 R')
+PAGES_KIDS = re.compile(rb'/Kids \[([^\]]*)\]')
+# Font subset names, a six letter tag then the font name
+FONT_NAME = re.compile(rb'/FontName /[A-Z]{6}\+')
+BASE_FONT = re.compile(rb'/BaseFont /[A-Z]{6}\+')
+FONT_DESCRIPTOR = re.compile(rb'/FontDescriptor (\d+) 0 R')
+
+# Objects packed per object stream by a compact writer
+OBJECT_STREAM_SIZE = 200
+
+# Document information keys a metadata dict may set
+METADATA_KEYS = ('Title', 'Author', 'Subject', 'Keywords', 'Creator', 'Producer')
+
+
+class StreamingPdfWriter:
+    """
+    Write ReportLab PDF parts to a path or binary file object as they come, in constant memory.
+
+    compact shares identical objects and packs small ones into object streams.
+    metadata, a dict of METADATA_KEYS, is written as the document information
+    dictionary and an XMP metadata stream, with the creation date.
+    """
+
+    def __init__(self, output, compact=False, metadata=None):
+        self._owns_file = not hasattr(output, 'write')
+        self._file = open(output, 'wb') if self._owns_file else output
+        self._position = 0
+        self._compact = compact
+        self._metadata = metadata
+        # _offsets[n - 1] is the offset of object n, or (object stream, index) once
+        # packed; the reserved objects are filled in by close()
+        self._offsets = [None, None]
+        self._page_ids = []
+        # Object numbers already copied per append source, {source: {part object: output object}}
+        self._sources = {}
+        # Output object number of every object written by a compact writer, by digest of its content
+        self._digests = {}
+        # Objects waiting to be packed into the next object stream, as (object number, body)
+        self._packed = []
+        self._write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n" if compact else b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._position += len(data)
+
+    def _reserve(self):
+        """Allocate the next object number."""
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, object_id, header, stream=b''):
+        """Write an object, or queue it for the next object stream when compact and without stream data."""
+        if self._compact and not stream:
+            self._packed.append((object_id, header))
+            if len(self._packed) >= OBJECT_STREAM_SIZE:
+                self._flush_packed()
+            return
+        self._offsets[object_id - 1] = self._position
+        self._write(b'%d 0 obj\n' % object_id + header + stream + b'\nendobj\n')
+
+    def _flush_packed(self):
+        """Write the queued objects as one compressed object stream."""
+        if not self._packed:
+            return
+        stream_id = self._reserve()
+        index, data = [], []
+        position = 0
+        for number, (object_id, header) in enumerate(self._packed):
+            index.append(b'%d %d' % (object_id, position))
+            data.append(header)
+            position += len(header) + 1
+            self._offsets[object_id - 1] = (stream_id, number)
+        first = b' '.join(index) + b'\n'
+        content = zlib.compress(first + b'\n'.join(data) + b'\n', 9)
+        self._packed = []
+        self._write_object(stream_id, b'<< /Type /ObjStm /N %d /First %d /Filter /FlateDecode /Length %d >>\n' % (len(index), len(first), len(content)), b'stream\n' + content + b'\nendstream')
+
+    def append(self, pdf_bytes, pages=None, source=None):
+        """
+        Copy every page of a ReportLab PDF, given as bytes, to the end of the document.
+
+        pages, a list of page indexes, copies only those pages, in that order,
+        with the objects they use. Objects already copied from the same source
+        (any name of pdf_bytes) by an earlier append, such as the fonts and the
+        invoice template, are shared instead of copied again; page objects
+        themselves are always copied.
+        """
+        xref_start = int(pdf_bytes[pdf_bytes.rindex(b'startxref') + len(b'startxref'):].split()[0])
+        trailer_start = pdf_bytes.index(b'trailer', xref_start)
+        trailer = pdf_bytes[trailer_start:]
+        entries = XREF_ENTRY.findall(pdf_bytes, xref_start, trailer_start)
+        # Entry 0 is the head of the free list; objects are laid out in offset order
+        spans = sorted(
+            (int(offset), object_id)
+            for object_id, (offset, _, kind) in enumerate(entries)
+            if kind == b'n' and object_id
+        )
+        bounds = {object_id: (offset, spans[index + 1][0] if index + 1 < len(spans) else xref_start)
+                  for index, (offset, object_id) in enumerate(spans)}
+
+        def body(object_id):
+            start, end = bounds[object_id]
+            data = pdf_bytes[start:end]
+            data = data[data.index(b'obj') + 3:]
+            return data[:data.rindex(b'endobj')].strip()
+
+        def split_stream(data):
+            stream_start = data.find(b'stream')
+            return (data, b'') if stream_start < 0 else (data[:stream_start], data[stream_start:])
+
+        catalog_id = int(TRAILER_ROOT.search(trailer).group(1))
+        info = TRAILER_INFO.search(trailer)
+        pages_id = int(CATALOG_PAGES.search(body(catalog_id)).group(1))
+        kids = [int(kid) for kid in REFERENCE.findall(PAGES_KIDS.search(body(pages_id)).group(1))]
+
+        # The part's catalog, document info and page tree are replaced by the output's own
+        skipped = {catalog_id, pages_id, int(info.group(1)) if info else None}
+        if pages is not None:
+            kids = [kids[index] for index in pages]
+            # Only the objects reachable from the chosen pages
+            used = set()
+            pending = list(kids)
+            while pending:
+                object_id = pending.pop()
+                if object_id in used or object_id in skipped:
+                    continue
+                used.add(object_id)
+                pending.extend(int(reference) for reference in REFERENCE.findall(split_stream(body(object_id))[0]))
+            skipped.update(object_id for _, object_id in spans if object_id not in used)
+        shared = self._sources.setdefault(source, {}) if source is not None else {}
+        page_set = set(kids)
+        new_ids = {pages_id: PAGES_ID}
+        if self._compact:
+            self._append_compact(kids, body, split_stream, shared, new_ids)
+            return
+        copied = []
+        for _, object_id in spans:
+            if object_id in skipped:
+                continue
+            if object_id in shared and object_id not in page_set:
+                new_ids[object_id] = shared[object_id]
+                continue
+            self._offsets.append(None)
+            new_ids[object_id] = len(self._offsets)
+            copied.append(object_id)
+
+        def renumber(match):
+            return b'%d 0 R' % new_ids[int(match.group(1))]
+
+        for object_id in copied:
+            header, stream = split_stream(body(object_id))
+            new_id = new_ids[object_id]
+            self._offsets[new_id - 1] = self._position
+            self._write(b'%d 0 obj\n' % new_id + _retag_subset(REFERENCE.sub(renumber, header), new_id) + stream + b'\nendobj\n')
+
+        if source is not None:
+            shared.update((object_id, new_ids[object_id]) for object_id in copied if object_id not in page_set)
+        self._page_ids.extend(new_ids[kid] for kid in kids)
+
+    def _append_compact(self, kids, body, split_stream, shared, new_ids):
+        """Copy the pages kids and the objects they use, sharing the objects already in the output."""
+        visiting = set()
+        page_set = set(kids)
+
+        def resolve(object_id):
+            if object_id in visiting:
+                # A reference cycle: the object is numbered now and never shared
+                if object_id not in new_ids:
+                    new_ids[object_id] = self._reserve()
+                return new_ids[object_id]
+            if object_id in new_ids:
+                return new_ids[object_id]
+            if object_id in shared and object_id not in page_set:
+                new_ids[object_id] = shared[object_id]
+                return new_ids[object_id]
+
+            visiting.add(object_id)
+            if object_id in page_set:
+                new_ids[object_id] = self._reserve()
+            header, stream = split_stream(body(object_id))
+            # Objects are written after those they refer to, whose final numbers are then known
+            header = REFERENCE.sub(lambda match: b'%d 0 R' % resolve(int(match.group(1))), header)
+            visiting.discard(object_id)
+
+            new_id = new_ids.get(object_id)
+            if new_id is None:
+                digest = hashlib.sha1(header + stream).digest()
+                new_id = self._digests.get(digest)
+                if new_id is not None:
+                    new_ids[object_id] = shared[object_id] = new_id
+                    return new_id
+                new_id = new_ids[object_id] = self._digests[digest] = self._reserve()
+            if object_id not in page_set:
+                shared[object_id] = new_id
+            self._write_object(new_id, _retag_subset(header, new_id), stream)
+            return new_id
+
+        self._page_ids.extend(resolve(kid) for kid in kids)
+
+    def _information(self):
+        """Write the document information dictionary and XMP metadata stream; returns their object numbers."""
+        created = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        entries = [f"/{key} <{_text_string(self._metadata[key])}>" for key in METADATA_KEYS if self._metadata.get(key)]
+        entries.append(f"/CreationDate (D:{created.strftime('%Y%m%d%H%M%S')}Z)")
+        info_id = self._reserve()
+        self._write_object(info_id, f"<< {' '.join(entries)} >>".encode('ascii'))
+
+        metadata_id = self._reserve()
+        xmp = _xmp_packet(self._metadata, created.isoformat())
+        # Left uncompressed, so that archiving tools can read it without a PDF library
+        self._write_object(metadata_id, b'<< /Type /Metadata /Subtype /XML /Length %d >>\n' % len(xmp), b'stream\n' + xmp + b'\nendstream')
+        return info_id, metadata_id
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer, then close an owned file."""
+        info_id = metadata_id = None
+        if self._metadata is not None:
+            info_id, metadata_id = self._information()
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(PAGES_ID, f"<< /Type /Pages /Count {len(self._page_ids)} /Kids [{kids}] >>".encode('ascii'))
+        catalog = f"/Type /Catalog /Pages {PAGES_ID} 0 R /PageMode /UseNone"
+        if metadata_id is not None:
+            catalog += f" /Metadata {metadata_id} 0 R /Lang (fr-FR)"
+        self._write_object(CATALOG_ID, f"<< {catalog} >>".encode('ascii'))
+        info = f" /Info {info_id} 0 R" if info_id is not None else ''
+
+        if self._compact:
+            self._flush_packed()
+            self._write_xref_stream(info)
+        else:
+            xref_offset = self._position
+            lines = [f"xref\n0 {len(self._offsets) + 1}\n", "0000000000 65535 f \n"]
+            lines.extend(f"{offset:010d} 00000 n \n" for offset in self._offsets)
+            self._write(''.join(lines).encode('ascii'))
+            self._write(f"trailer\n<< /Size {len(self._offsets) + 1} /Root {CATALOG_ID} 0 R{info} >>\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+        if self._owns_file:
+            self._file.close()
+
+    def _write_xref_stream(self, info):
+        """Write the cross-reference stream of a compact document, which is also its trailer."""
+        xref_id = self._reserve()
+        xref_offset = self._offsets[xref_id - 1] = self._position
+        width = max(1, (xref_offset.bit_length() + 7) // 8)
+        rows = [b'\x00' + bytes(width) + b'\xff\xff']
+        for offset in self._offsets:
+            if isinstance(offset, tuple):
+                rows.append(b'\x02' + offset[0].to_bytes(width, 'big') + offset[1].to_bytes(2, 'big'))
+            else:
+                rows.append(b'\x01' + offset.to_bytes(width, 'big') + b'\x00\x00')
+        content = zlib.compress(b''.join(rows), 9)
+        size = len(self._offsets) + 1
+        self._write(
+            f"{xref_id} 0 obj\n<< /Type /XRef /Size {size} /W [1 {width} 2] /Root {CATALOG_ID} 0 R{info} "
+            f"/Filter /FlateDecode /Length {len(content)} >>\nstream\n".encode('ascii')
+            + content + f"\nendstream\nendobj\nstartxref\n{xref_offset}\n%%EOF\n".encode('ascii')
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._owns_file:
+            self._file.close()
+
+
+def _subset_tag(object_id):
+    """Six capital letters unique to an output object number."""
+    letters = []
+    for _ in range(6):
+        object_id, letter = divmod(object_id, 26)
+        letters.append(chr(ord('A') + letter))
+    return ''.join(reversed(letters)).encode('ascii')
+
+
+def _retag_subset(header, object_id):
+    """Tag the font subset named by a renumbered font or font descriptor after its descriptor's object number."""
+    if b'/FontName /' in header:
+        return FONT_NAME.sub(b'/FontName /' + _subset_tag(object_id) + b'+', header)
+    descriptor = FONT_DESCRIPTOR.search(header)
+    if descriptor is not None:
+        return BASE_FONT.sub(b'/BaseFont /' + _subset_tag(int(descriptor.group(1))) + b'+', header)
+    return header
+
+
+def _text_string(text):
+    """Hexadecimal PDF text string of any text, UTF-16 with a byte order mark."""
+    return (b'\xfe\xff' + str(text).encode('utf-16-be')).hex().upper()
+
+
+def _xmp_packet(metadata, created):
+    """XMP metadata packet of the document information, as UTF-8 bytes."""
+    def value(key):
+        return escape(str(metadata.get(key) or ''))
+
+    return f"""<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmlns:pdf="http://ns.adobe.com/pdf/1.3/">
+<dc:format>application/pdf</dc:format>
+<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{value('Title')}</rdf:li></rdf:Alt></dc:title>
+<dc:creator><rdf:Seq><rdf:li>{value('Author')}</rdf:li></rdf:Seq></dc:creator>
+<dc:description><rdf:Alt><rdf:li xml:lang="x-default">{value('Subject')}</rdf:li></rdf:Alt></dc:description>
+<dc:language><rdf:Bag><rdf:li>fr-FR</rdf:li></rdf:Bag></dc:language>
+<pdf:Keywords>{value('Keywords')}</pdf:Keywords>
+<pdf:Producer>{value('Producer')}</pdf:Producer>
+<xmp:CreatorTool>{value('Creator')}</xmp:CreatorTool>
+<xmp:CreateDate>{created}</xmp:CreateDate>
+</rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="r"?>""".encode('utf-8')
@@ -0,0 +1,113 @@
+"""Named company profiles (CompanySettings rows), cached in every worker process.
+
+Pages and generations read the profiles from a per-process copy instead of
+querying them each time. The copy carries a version stamp of the table,
+(row count, highest id, sum of the row versions), which any insert or update
+changes; it is checked with one aggregate query at most every
+SETTINGS_CACHE_SECONDS and the profiles are reloaded when another worker
+changed them. Saves go through save_profile, which writes through to the
+copy of the saving worker.
+"""
+import time
+import threading
+
+from sqlalchemy import func, select
+
+from app import app, db
+from models import CompanySettings
+
+# Company fields a profile provides to a generation
+PROFILE_FIELDS = ('company_name', 'address', 'rc_name', 'nif', 'item_name', 'client_profession', 'rib', 'unit_price')
+
+
+class ProfileCache:
+    """Per-process copy of every profile, revalidated against the table's version stamp."""
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._profiles = None
+        self._stamp = None
+        self._checked = 0.0
+
+    def _table_stamp(self):
+        return tuple(db.session.execute(select(
+            func.count(CompanySettings.id),
+            func.coalesce(func.max(CompanySettings.id), 0),
+            func.coalesce(func.sum(CompanySettings.version), 0),
+        )).one())
+
+    def profiles(self):
+        """Return {id: profile dict} of every saved profile, in id order."""
+        with self._lock:
+            if self._profiles is not None and time.monotonic() - self._checked < self.max_age:
+                return self._profiles
+            stamp = self._table_stamp()
+            if stamp != self._stamp:
+                rows = CompanySettings.query.order_by(CompanySettings.id).all()
+                self._profiles = {row.id: row.to_dict() for row in rows}
+                # The stamp read before the rows: a change made in between only causes another reload
+                self._stamp = stamp
+            self._checked = time.monotonic()
+            return self._profiles
+
+    def store(self, profile, created):
+        """Write a just committed profile through to the copy."""
+        with self._lock:
+            if self._profiles is None:
+                return
+            self._profiles = dict(self._profiles)
+            self._profiles[profile['id']] = profile
+            # The stamp this save alone leads to: any other change makes the next check reload
+            count, max_id, versions = self._stamp
+            if created:
+                self._stamp = (count + 1, max(max_id, profile['id']), versions + profile['version'])
+            else:
+                self._stamp = (count, max_id, versions + 1)
+            self._checked = 0.0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_cache():
+    """Return the process-wide profile cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ProfileCache(app.config['SETTINGS_CACHE_SECONDS'])
+        return _cache
+
+
+def list_profiles():
+    """Return every saved profile as dicts, in id order."""
+    return list(get_profile_cache().profiles().values())
+
+
+def get_profile(profile_id):
+    """Return the profile dict with that id, or None."""
+    return get_profile_cache().profiles().get(profile_id)
+
+
+def save_profile(values, profile_id=None):
+    """
+    Update the profile profile_id, or create one, from a dict of PROFILE_FIELDS plus name.
+
+    Returns the saved profile dict; raises ValueError for an unknown profile_id.
+    """
+    created = profile_id is None
+    if created:
+        row = CompanySettings()
+        db.session.add(row)
+    else:
+        row = db.session.get(CompanySettings, profile_id)
+        if row is None:
+            raise ValueError("Profil introuvable.")
+    for field, value in values.items():
+        setattr(row, field, value)
+    db.session.commit()
+
+    profile = row.to_dict()
+    get_profile_cache().store(profile, created)
+    return profile
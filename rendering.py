@@ -0,0 +1,555 @@
+"""PDF drawing of invoices with ReportLab, serial or across processes, in page-aligned parts.
+
+This module does not import the Flask application so that it can be loaded
+cheaply by render worker processes.
+"""
+import io
+import logging
+import multiprocessing
+from collections import deque
+from contextlib import nullcontext
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from reportlab import Version as reportlab_version
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+from amounts import numbers_to_french_words, amounts_to_french_words
+from extraction import page_aligned_chunks
+from fonts import invoice_fonts, prepare_text, shape_text
+from pdfstream import StreamingPdfWriter
+from numbering import format_invoice_number
+
+logger = logging.getLogger(__name__)
+
+# Name of the form XObject holding the static invoice skeleton
+TEMPLATE_FORM_NAME = 'invoice_template'
+
+# Invoice layouts: invoices per A4 page
+FACTURES_PAR_PAGE = (1, 2, 4)
+
+# Invoices drawn per canvas before its pages are flushed to the output document,
+# a multiple of every invoices-per-page layout so that parts end on a page boundary
+RENDER_CHUNK_ROWS = 1000
+
+# Company details drawn on every invoice, shaped once per document
+BATCH_TEXT_FIELDS = ('company_name', 'address', 'rc_name', 'nif', 'item_name', 'month_year', 'rib', 'fixed_invoice_number')
+
+# Clients per task when one PDF per client is rendered across processes
+SPLIT_CHUNK_ROWS = 250
+
+# PDF output profiles: "fast" leaves page streams uncompressed (previews),
+# "compact" shares identical objects across parts and packs the small ones
+# into object streams, "archive" is compact plus the document metadata
+OUTPUT_PROFILES = ('fast', 'compact', 'archive')
+DEFAULT_OUTPUT_PROFILE = 'compact'
+
+# Creator recorded in the metadata of archive documents
+PDF_CREATOR = 'InvoiceFlow'
+
+
+def truncate_text(text, max_length=None):
+    """Cut already sanitised text to max_length characters, marking the cut with an ellipsis."""
+    if max_length and len(text) > max_length:
+        return text[:max_length] + "..."
+    return text
+
+
+def safe_text_for_pdf(value, max_length=None):
+    """Safely convert value to string for PDF display, handling NaN and special characters."""
+    if pd.isna(value) or value is None:
+        return ""
+    
+    try:
+        # Convert to string, then shape Arabic script or fold accents for the invoice font
+        text = prepare_text(str(value).strip())
+        
+        return truncate_text(text, max_length)
+    except Exception as e:
+        logger.warning(f"Error converting text for PDF: {e}")
+        return str(value)[:max_length] if max_length else str(value)
+
+
+def invoice_slot_size(factures_par_page):
+    """Return (largeur_facture, hauteur_facture) of one invoice slot on an A4 page."""
+    largeur, hauteur = A4
+    factures_par_ligne = 2 if factures_par_page == 4 else 1
+    factures_par_col = factures_par_page // factures_par_ligne
+    return largeur / factures_par_ligne, hauteur / factures_par_col
+
+
+def draw_invoice(c, pos_x, pos_y, batch, client=None, draw_static=True, amount_words=None, invoice_number=None):
+    """
+    Draw the invoice slot whose lower-left corner is (pos_x, pos_y).
+
+    batch holds the render options plus the sanitised 'profession'. The static
+    skeleton shared by every invoice of the batch (frame, table grid, labels,
+    invoice number, company block, item and unit price) is drawn when
+    draw_static is true; the client fields and totals when client, a
+    (nom, adresse, carte_eleveur, quantite) tuple, is given. amount_words is the
+    total in words as returned by invoice_amount_words, computed when omitted.
+    invoice_number is the client's own number when the batch is numbered
+    sequentially, drawn with the client fields; otherwise the batch-wide
+    fixed_invoice_number is part of the skeleton.
+    """
+    factures_par_page = batch['factures_par_page']
+    fonts = invoice_fonts()
+    largeur_facture, hauteur_facture = invoice_slot_size(factures_par_page)
+    unit_price = batch['unit_price']
+    item_name = batch['item_name']
+
+    # Adjust font sizes and spacing based on number of invoices per page
+    if factures_par_page == 4:
+        header_font_size = 7
+        normal_font_size = 6
+        title_font_size = 8
+        line_spacing = 8
+        section_spacing = 15
+        table_height = 40
+        margin = 5
+    else:
+        header_font_size = 10
+        normal_font_size = 9
+        title_font_size = 12
+        line_spacing = 15
+        section_spacing = 35
+        table_height = 60
+        margin = 10
+
+    if draw_static:
+        # Draw invoice frame
+        c.rect(pos_x+margin, pos_y+margin, largeur_facture-2*margin, hauteur_facture-2*margin)
+
+    # Client header with name and address
+    y_pos = pos_y + hauteur_facture - 20
+    c.setFont(fonts.regular, header_font_size)
+    if factures_par_page == 4:
+        if client is not None:
+            nom, adresse, carte_eleveur, quantity = client
+            # Shorter text for compact layout
+            c.drawString(pos_x+margin+5, y_pos, f"NOM: {truncate_text(nom, 15).upper()}")
+            c.drawString(pos_x+margin+5, y_pos - line_spacing, f"ADRESSE: {truncate_text(adresse, 20)}")
+            c.drawString(pos_x+margin+5, y_pos - 2*line_spacing, f"CARTE: {truncate_text(carte_eleveur, 15)}")
+        y_pos -= 2*line_spacing
+    else:
+        if client is not None:
+            nom, adresse, carte_eleveur, quantity = client
+            c.drawString(pos_x+20, y_pos, f"NOM ET PRENOM: {nom.upper()}")
+            c.drawString(pos_x+20, y_pos - line_spacing, f"ADRESSE: {adresse}")
+            c.drawString(pos_x+20, y_pos - 2*line_spacing, f"CARTE ELEVEUR: {carte_eleveur}")
+        y_pos -= 3*line_spacing
+        if draw_static:
+            c.drawString(pos_x+20, y_pos, f"PROFESSION: {batch['profession']}")
+
+    # Invoice number and month (centered)
+    y_pos -= section_spacing
+    # A fixed number is part of the skeleton, a sequential one is drawn with the client
+    if invoice_number is None:
+        invoice_display = batch['fixed_invoice_number'] if draw_static else None
+    else:
+        invoice_display = prepare_text(invoice_number) if client is not None else None
+    if invoice_display is not None:
+        c.setFont(fonts.bold, title_font_size)
+        text_width = c.stringWidth(invoice_display, fonts.bold, title_font_size)
+        c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos - line_spacing, invoice_display)
+    if draw_static:
+        c.setFont(fonts.bold, title_font_size)
+        invoice_text = f"FACTURE N°:"
+        text_width = c.stringWidth(invoice_text, fonts.bold, title_font_size)
+        c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos, invoice_text)
+        c.setFont(fonts.regular, normal_font_size)
+        month_text = f"MOIS : {batch['month_year']}"
+        text_width = c.stringWidth(month_text, fonts.regular, normal_font_size)
+        c.drawString(pos_x + (largeur_facture - text_width)/2, y_pos - 2*line_spacing, month_text)
+    y_pos -= 2*line_spacing
+
+    # Company details section
+    y_pos -= section_spacing
+    if draw_static:
+        address = batch['address']
+        rc_name = batch['rc_name']
+        nif = batch['nif']
+        rib = batch['rib']
+        c.setFont(fonts.bold, normal_font_size)
+        c.drawString(pos_x+margin+5, y_pos, f"DOIT : {batch['company_name']}")
+        c.setFont(fonts.regular, normal_font_size-1)
+        if factures_par_page == 4:
+            # Split long address for compact layout
+            c.drawString(pos_x+margin+5, y_pos - line_spacing, f"ADRESSE: {address[:25]}")
+            c.drawString(pos_x+margin+5, y_pos - 2*line_spacing + 2, f"RC:{rc_name[:12]} NIF:{nif[:12]}")
+            c.drawString(pos_x+margin+5, y_pos - 3*line_spacing + 4, f"RIB:{rib[:15]}")
+        else:
+            c.drawString(pos_x+20, y_pos - line_spacing, f"ADRESSE: {address}")
+            c.drawString(pos_x+20, y_pos - line_spacing - 12, f" RC:{rc_name}    NIF: {nif}            RIB : {rib}")
+    if factures_par_page == 4:
+        y_pos -= 3*line_spacing - 4
+    else:
+        y_pos -= line_spacing + 12
+
+    # Table with borders
+    y_pos -= section_spacing
+
+    # Adjust table columns positions based on layout
+    if factures_par_page == 4:
+        col1_x = pos_x + margin + 5   # Désignation
+        col2_x = pos_x + largeur_facture * 0.5  # Quantité/LITRE
+        col3_x = pos_x + largeur_facture * 0.7  # P.U
+        col4_x = pos_x + largeur_facture * 0.85  # Total
+        table_end_x = pos_x + largeur_facture - margin - 5
+    else:
+        col1_x = pos_x + 20   # Désignation
+        col2_x = pos_x + 200  # Quantité/LITRE
+        col3_x = pos_x + 280  # P.U
+        col4_x = pos_x + 350  # Total
+        table_end_x = pos_x + largeur_facture - 30
+
+    if draw_static:
+        # Draw table borders
+        c.rect(col1_x, y_pos - table_height, table_end_x - col1_x, table_height)
+        # Vertical lines
+        c.line(col2_x, y_pos, col2_x, y_pos - table_height)
+        c.line(col3_x, y_pos, col3_x, y_pos - table_height)
+        c.line(col4_x, y_pos, col4_x, y_pos - table_height)
+        # Horizontal line for header
+        header_line_y = y_pos - (table_height * 0.4)
+        c.line(col1_x, header_line_y, table_end_x, header_line_y)
+
+        # Table header
+        c.setFont(fonts.bold, normal_font_size-1)
+        if factures_par_page == 4:
+            c.drawString(col1_x + 2, y_pos - 8, "Désign.")
+            c.drawString(col2_x + 2, y_pos - 8, "Qté")
+            c.drawString(col3_x + 2, y_pos - 8, "P.U")
+            c.drawString(col4_x + 2, y_pos - 8, "Total")
+        else:
+            c.drawString(col2_x + 5, y_pos - 10, "Quantité/LITR")
+            c.drawString(pos_x + 25, y_pos - 22, "Désignation")
+            c.drawString(col2_x + 25, y_pos - 22, "E")
+            c.drawString(col3_x + 10, y_pos - 22, "P.U")
+            c.drawString(col4_x + 15, y_pos - 22, "Total")
+
+    # Table content
+    if factures_par_page == 4:
+        y_pos -= table_height * 0.6
+    else:
+        y_pos -= 40
+    c.setFont(fonts.regular, normal_font_size-1)
+    if draw_static:
+        if factures_par_page == 4:
+            # Compact layout for table content
+            c.drawString(col1_x + 2, y_pos, item_name[:8] + "..." if len(item_name) > 8 else item_name)
+            c.drawString(col3_x + 2, y_pos, f"{unit_price:.0f}")
+        else:
+            c.drawString(col1_x + 5, y_pos, item_name)
+            c.drawString(col3_x + 10, y_pos, f"{unit_price:.2f}")
+
+    if client is None:
+        return
+
+    total = quantity * unit_price
+    if factures_par_page == 4:
+        c.drawString(col2_x + 2, y_pos, str(int(quantity)))
+        c.drawString(col4_x + 2, y_pos, f"{total:,.0f}")
+    else:
+        c.drawString(col2_x + 15, y_pos, str(int(quantity)))
+        c.drawString(col4_x + 10, y_pos, f"{total:,.2f}")
+
+    # Amount section
+    y_pos -= section_spacing
+    c.setFont(fonts.bold, normal_font_size)
+    if factures_par_page == 4:
+        c.drawString(col1_x, y_pos, f"Montant: {total:,.0f}")
+    else:
+        c.drawString(col3_x, y_pos, f"Montant                        {total:,.2f}")
+
+    # Amount in French words
+    y_pos -= line_spacing
+    c.setFont(fonts.regular, normal_font_size-2)
+    if amount_words is None:
+        amount_words = invoice_amount_words([total], factures_par_page)[0]
+    if factures_par_page == 4:
+        # Truncate text for compact layout
+        words_text = f"Arrêté: {amount_words[:30]}... dinars"
+        c.drawString(pos_x + margin + 5, y_pos, words_text)
+    else:
+        c.drawString(pos_x + 20, y_pos, f"Arrêté la présente facture à la somme de : {amount_words}")
+
+
+def invoice_amount_words(totals, factures_par_page):
+    """
+    Convert invoice totals to the words drawn on the invoice, one conversion per distinct total.
+
+    The compact 4-per-page layout truncates the words, so it only gets the
+    integer part; other layouts get dinars and centimes.
+    """
+    if factures_par_page == 4:
+        return numbers_to_french_words(totals)
+    return amounts_to_french_words(totals)
+
+
+def invoice_numbers(options, first_index, count):
+    """
+    Numbers of count invoices starting at position first_index of the batch.
+
+    Returns a list of None when the batch uses its fixed_invoice_number.
+    """
+    first_number = options.get('first_invoice_number')
+    if first_number is None:
+        return [None] * count
+    return [
+        format_invoice_number(options['fixed_invoice_number'], options['invoice_year'], first_number + index)
+        for index in range(first_index, first_index + count)
+    ]
+
+
+def batch_values(options):
+    """Render options plus the batch-wide texts prepared for the invoice font, once per document."""
+    # Client records arrive sanitised from extraction, only the batch-wide values need it
+    batch = dict(options, profession=safe_text_for_pdf(options['client_profession']))
+    if invoice_fonts().unicode:
+        # Helvetica draws accented company details as they are, only Arabic needs shaping
+        for field in BATCH_TEXT_FIELDS:
+            batch[field] = shape_text(str(batch[field]))
+    return batch
+
+
+def render_invoices(c, clients, options, progress_callback=None, first_index=0):
+    """
+    Draw one invoice per client record on the canvas, factures_par_page per A4 page.
+
+    clients is an extraction.ClientColumns, or any sequence of sanitised
+    (nom, adresse, carte_eleveur, quantite) tuples.
+
+    options holds the batch parameters: factures_par_page, fixed_invoice_number,
+    company_name, address, rc_name, nif, item_name, client_profession, month_year,
+    rib and unit_price. With options['use_template'] the static skeleton is drawn
+    once as a form XObject and placed with doForm for every invoice. When
+    options['first_invoice_number'] is set the invoices are numbered in
+    sequence, first_index being the position of clients[0] in the batch.
+    """
+    factures_par_page = options['factures_par_page']
+    use_template = options.get('use_template', False)
+    _, hauteur = A4
+
+    factures_par_ligne = 2 if factures_par_page == 4 else 1
+    factures_par_col = factures_par_page // factures_par_ligne
+    largeur_facture, hauteur_facture = invoice_slot_size(factures_par_page)
+
+    batch = batch_values(options)
+
+    if use_template:
+        # Static skeleton drawn once at the slot origin; the bounding box is the
+        # whole page so that long company lines are never clipped
+        c.beginForm(TEMPLATE_FORM_NAME, -largeur_facture, -hauteur, 2*largeur_facture, hauteur)
+        draw_invoice(c, 0, 0, batch)
+        c.endForm()
+
+    unit_price = options['unit_price']
+    words = invoice_amount_words([client[3] * unit_price for client in clients], factures_par_page)
+    numbers = invoice_numbers(options, first_index, len(clients))
+
+    total_rows = len(clients)
+    if progress_callback:
+        progress_callback(0, total_rows)
+
+    for i, client in enumerate(clients):
+        pos_x = (i % factures_par_ligne) * largeur_facture
+        pos_y = hauteur - ((i // factures_par_ligne) % factures_par_col + 1) * hauteur_facture
+
+        if use_template:
+            c.saveState()
+            c.translate(pos_x, pos_y)
+            c.doForm(TEMPLATE_FORM_NAME)
+            c.restoreState()
+            draw_invoice(c, pos_x, pos_y, batch, client, draw_static=False, amount_words=words[i], invoice_number=numbers[i])
+        else:
+            draw_invoice(c, pos_x, pos_y, batch, client, amount_words=words[i], invoice_number=numbers[i])
+
+        if (i+1) % factures_par_page == 0:
+            c.showPage()
+
+        if progress_callback:
+            progress_callback(i + 1, total_rows)
+
+
+def output_profile(options):
+    return options.get('output_profile', DEFAULT_OUTPUT_PROFILE)
+
+
+def new_canvas(buffer, options):
+    """Return an A4 canvas drawing into buffer; the "fast" profile skips page stream compression."""
+    return canvas.Canvas(buffer, pagesize=A4, pageCompression=0 if output_profile(options) == 'fast' else 1)
+
+
+def document_metadata(options):
+    """Document information of an "archive" PDF: title, company, item and invoice number."""
+    return {
+        'Title': f"Factures {options.get('month_year', '')}".strip(),
+        'Author': options.get('company_name', ''),
+        'Subject': options.get('item_name', ''),
+        'Keywords': options.get('fixed_invoice_number', ''),
+        'Creator': PDF_CREATOR,
+        'Producer': f"ReportLab {reportlab_version}",
+    }
+
+
+def pdf_writer(pdf_path, options):
+    """Return the StreamingPdfWriter of the options' output profile."""
+    profile = output_profile(options)
+    return StreamingPdfWriter(
+        pdf_path,
+        compact=profile != 'fast',
+        metadata=document_metadata(options) if profile == 'archive' else None
+    )
+
+
+def _phase(stats, name):
+    """Time a block into stats (a metrics.GenerationStats) when one is given."""
+    return stats.phase(name) if stats is not None else nullcontext()
+
+
+def render_chunk(clients, options, progress_callback=None, first_index=0):
+    """Render client records on a canvas of their own and return the PDF bytes."""
+    buffer = io.BytesIO()
+    c = new_canvas(buffer, options)
+    render_invoices(c, clients, options, progress_callback, first_index)
+    c.save()
+    return buffer.getvalue()
+
+
+def _rendered_parts(parts, options, pool, workers, stats, part_progress):
+    """Yield (rows, pdf_bytes) for every part, in order, drawn here or in the pool."""
+    first_index = 0
+    if pool is None:
+        for part in parts:
+            with _phase(stats, 'render'):
+                pdf_bytes = render_chunk(part, options, part_progress, first_index)
+            first_index += len(part)
+            yield len(part), pdf_bytes
+        return
+
+    pending = deque()
+
+    def submit_next():
+        nonlocal first_index
+        part = next(parts, None)
+        if part is not None:
+            pending.append((len(part), pool.submit(render_chunk, part, options, None, first_index)))
+            first_index += len(part)
+        return part is not None
+
+    # At most two parts per worker in flight, so memory stays bounded
+    while len(pending) < workers * 2 and submit_next():
+        pass
+    while pending:
+        rows, future = pending.popleft()
+        with _phase(stats, 'render'):
+            pdf_bytes = future.result()
+        submit_next()
+        yield rows, pdf_bytes
+
+
+def render_pdf_chunks(chunks, pdf_path, options, workers=1, progress_callback=None, rows_total=None, stats=None):
+    """
+    Render ClientColumns chunks into a single PDF file or binary file object, in constant memory.
+
+    chunks is any iterable of ClientColumns, such as extraction.iter_client_chunks.
+    It is regrouped into page-aligned parts of RENDER_CHUNK_ROWS invoices, each
+    drawn on a canvas of its own and flushed to pdf_path by a StreamingPdfWriter
+    set up for options['output_profile'] (see OUTPUT_PROFILES), so only one part (one per worker in flight with a pool) is ever in memory.
+    With several workers the parts are drawn in a process pool.
+
+    progress_callback is called as progress_callback(rows_done, rows_total);
+    rows_total is None when the caller streams chunks of unknown total. Drawing,
+    or waiting for the pool, is recorded as the "render" phase of stats and
+    copying the parts to the output as "serialize".
+    """
+    parts = page_aligned_chunks(chunks, RENDER_CHUNK_ROWS)
+    rows_done = 0
+    if progress_callback:
+        progress_callback(0, rows_total)
+
+    part_progress = None
+    if progress_callback:
+        def part_progress(rows, _):
+            progress_callback(rows_done + rows, rows_total)
+
+    # Spawned workers only import this module, never the Flask app
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    try:
+        with pdf_writer(pdf_path, options) as writer:
+            for rows, pdf_bytes in _rendered_parts(parts, options, pool, workers, stats, part_progress):
+                with _phase(stats, 'serialize'):
+                    writer.append(pdf_bytes)
+                rows_done += rows
+                if pool is not None and progress_callback:
+                    progress_callback(rows_done, rows_total)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"{rows_done} factures rendues sur {max(workers, 1)} processus, {writer.page_count} pages")
+    return pdf_path
+
+
+def render_pdf(clients, pdf_path, options, progress_callback=None, stats=None):
+    """Render the client records into a single PDF file or binary file object, serially."""
+    return render_pdf_chunks([clients], pdf_path, options, progress_callback=progress_callback, rows_total=len(clients), stats=stats)
+
+
+def render_invoice_pdfs(clients, options, first_index=0):
+    """Render every client record as its own one-page PDF and return their bytes, in order."""
+    batch = dict(batch_values(options), factures_par_page=1)
+    _, hauteur = A4
+    _, hauteur_facture = invoice_slot_size(1)
+    words = invoice_amount_words([client[3] * options['unit_price'] for client in clients], 1)
+    numbers = invoice_numbers(options, first_index, len(clients))
+    # Single-page files have nothing to share, only archive adds to the canvas defaults
+    metadata = document_metadata(options) if output_profile(options) == 'archive' else None
+
+    pdfs = []
+    for client, amount_words, invoice_number in zip(clients, words, numbers):
+        buffer = io.BytesIO()
+        c = new_canvas(buffer, options)
+        if metadata is not None:
+            c.setTitle(f"Facture {client[0]}")
+            c.setAuthor(metadata['Author'])
+            c.setSubject(metadata['Subject'])
+            c.setKeywords(invoice_number or metadata['Keywords'])
+            c.setCreator(metadata['Creator'])
+        # A template form only pays off when reused, each file holds one invoice
+        draw_invoice(c, 0, hauteur - hauteur_facture, batch, client, amount_words=amount_words, invoice_number=invoice_number)
+        c.showPage()
+        c.save()
+        pdfs.append(buffer.getvalue())
+    return pdfs
+
+
+def iter_invoice_pdfs(clients, options, workers=1, chunk_rows=SPLIT_CHUNK_ROWS):
+    """
+    Lazily yield one PDF (bytes) per client record, in order.
+
+    With several workers, chunks of chunk_rows clients are rendered in a
+    process pool, keeping at most two chunks per worker in flight so that
+    memory stays bounded however many clients there are. Closing the
+    generator early cancels the pending chunks.
+    """
+    chunks = ((start, clients[start:start + chunk_rows]) for start in range(0, len(clients), chunk_rows))
+    if workers <= 1 or len(clients) <= chunk_rows:
+        for start, chunk in chunks:
+            yield from render_invoice_pdfs(chunk, options, start)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        pending = deque(pool.submit(render_invoice_pdfs, chunk, options, start) for start, chunk in islice(chunks, workers * 2))
+        while pending:
+            pdfs = pending.popleft().result()
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.submit(render_invoice_pdfs, chunk[1], options, chunk[0]))
+            yield from pdfs
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
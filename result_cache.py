@@ -0,0 +1,152 @@
+"""Content-addressed, disk-backed cache of generated PDFs.
+
+Entries are keyed by the hash of the uploaded bytes plus every rendering
+parameter, so re-submitting the same workbook with the same form returns the
+existing PDF. The cache lives on disk and is shared by all worker processes;
+entries expire a fixed time after they were created, however often they are
+served, and the least recently used ones are evicted once the size limit is
+hit. A file's modification time is its creation time and its access time,
+set explicitly on every hit, the LRU timestamp.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Bump when a rendering change makes previously cached PDFs stale
+CACHE_FORMAT_VERSION = 3
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_stream(stream):
+    """Return the SHA-256 hex digest of a binary stream, rewinding it afterwards."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, parameters):
+    """Build the cache key of an upload hash and its rendering parameters."""
+    payload = json.dumps(
+        {'version': CACHE_FORMAT_VERSION, 'content': content_hash, 'parameters': parameters},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """PDF files stored as <key>.pdf in a folder, expired by age and evicted LRU by size."""
+
+    def __init__(self, folder, max_bytes, max_age_seconds):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def path_for(self, key):
+        return os.path.join(self.folder, f"{key}.pdf")
+
+    def owns(self, path):
+        """Check whether a file path belongs to the cache folder."""
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.folder)
+
+    def get(self, key):
+        """Return the cached PDF path for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        try:
+            created = os.path.getmtime(path)
+            now = time.time()
+            if now - created > self.max_age_seconds:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            # Set even on noatime mounts; the modification time is left alone
+            os.utime(path, (now, created))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, key, source_path):
+        """Move a freshly generated PDF into the cache and return its cached path."""
+        if not self.enabled:
+            return source_path
+        path = self.path_for(key)
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.move(source_path, staging_path)
+        os.utime(staging_path)
+        os.replace(staging_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Drop the entries created more than max_age_seconds ago, then the least recently used ones until the size limit holds."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith('.pdf'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                self._remove(entry.path)
+            else:
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss/eviction counters of this process and the current cache size."""
+        sizes = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.pdf'):
+                try:
+                    sizes.append(entry.stat().st_size)
+                except FileNotFoundError:
+                    continue
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(sizes),
+                'bytes': sum(sizes),
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age_seconds,
+            }
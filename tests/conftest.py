@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    """The web application on a fresh SQLite database, with its tables created."""
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'invoices.db'}"
+    os.environ['STARTUP_WARMUP'] = '0'
+    from app import app, warmup
+
+    warmup.wait(30)
+    assert warmup.state == 'done', warmup.error
+    return app
@@ -0,0 +1,68 @@
+"""French spelling of numbers and amounts."""
+import pytest
+
+from amounts import amount_to_french_words, amounts_to_french_words, number_to_french_words, numbers_to_french_words
+
+
+@pytest.mark.parametrize('number, words', [
+    (0, 'zéro'),
+    (1, 'un'),
+    (16, 'seize'),
+    (17, 'dix-sept'),
+    (21, 'vingt et un'),
+    (22, 'vingt-deux'),
+    (61, 'soixante et un'),
+    (70, 'soixante-dix'),
+    (71, 'soixante et onze'),
+    (77, 'soixante-dix-sept'),
+    (80, 'quatre-vingts'),
+    (81, 'quatre-vingt-un'),
+    (91, 'quatre-vingt-onze'),
+    (99, 'quatre-vingt-dix-neuf'),
+    (100, 'cent'),
+    (101, 'cent un'),
+    (200, 'deux cents'),
+    (201, 'deux cent un'),
+    (280, 'deux cent quatre-vingts'),
+    (1000, 'mille'),
+    (1001, 'mille un'),
+    (2000, 'deux mille'),
+    (80000, 'quatre-vingt mille'),
+    (200000, 'deux cent mille'),
+    (1000000, 'un million'),
+    (2000000, 'deux millions'),
+    (1200300, 'un million deux cent mille trois cents'),
+    (1000000000, 'un milliard'),
+    (3000000001, 'trois milliards un'),
+    (-42, 'moins quarante-deux'),
+])
+def test_number_spelling(number, words):
+    assert number_to_french_words(number) == words
+
+
+@pytest.mark.parametrize('amount, words', [
+    (0, 'zéro dinar'),
+    (1, 'un dinar'),
+    (2, 'deux dinars'),
+    (1200.5, 'mille deux cents dinars et cinquante centimes'),
+    (3.01, 'trois dinars et un centime'),
+    (0.999, 'un dinar'),
+    (2000000, 'deux millions de dinars'),
+    (2000001, 'deux millions un dinars'),
+    (1000000000, 'un milliard de dinars'),
+    (-12.5, 'moins douze dinars et cinquante centimes'),
+    (-0.001, 'zéro dinar'),
+])
+def test_amount_spelling(amount, words):
+    assert amount_to_french_words(amount) == words
+
+
+def test_amount_currency_names():
+    assert amount_to_french_words(1.5, ('euro', 'euros'), ('cent', 'cents')) == 'un euro et cinquante cents'
+
+
+def test_batch_conversion_matches_single_values():
+    values = [5, 80, 5, 1000000, 80]
+    assert numbers_to_french_words(values) == [number_to_french_words(value) for value in values]
+    amounts = [2500.0, '2500', 12.349, 0]
+    assert amounts_to_french_words(amounts) == ['deux mille cinq cents dinars'] * 2 + [amount_to_french_words(12.35), 'zéro dinar']
@@ -0,0 +1,120 @@
+"""Resolution of the client columns from the header row, and the stored mappings."""
+import pytest
+
+import column_mapping
+from column_mapping import (
+    MappingStore, column_index, column_letter, mappings_version, normalize_header, override_columns,
+    resolve_columns, workbook_columns,
+)
+
+# Historical positions: H, J, M and BF
+FALLBACK = (7, 9, 12, 57)
+
+
+def header_with(cells, width=60):
+    """A header row of width generic cells, with {index: text} set."""
+    header = [f"Colonne {index + 1}" for index in range(width)]
+    for index, text in cells.items():
+        header[index] = text
+    return header
+
+
+HISTORICAL = {7: 'Nom et prénom', 9: 'Adresse', 12: 'Carte éleveur', 57: 'Quantité'}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = MappingStore(str(tmp_path / 'mappings'))
+    monkeypatch.setattr(column_mapping, '_store', store)
+    return store
+
+
+def test_header_normalisation_and_letters():
+    assert normalize_header('  N° Carte d’Éleveur ') == 'n carte d eleveur'
+    assert normalize_header(None) == ''
+    assert [column_letter(index) for index in (0, 25, 26, 57)] == ['A', 'Z', 'AA', 'BF']
+    assert column_index('bf') == 57
+
+
+def test_historical_layout_resolves_from_the_headers():
+    columns, sources = resolve_columns(header_with(HISTORICAL), 60, FALLBACK)
+    assert columns == {'nom': 7, 'adresse': 9, 'carte_eleveur': 12, 'quantite': 57}
+    assert set(sources.values()) == {'header'}
+
+
+def test_moved_columns_follow_their_headers():
+    header = header_with({0: 'Quantité (litres)', 2: 'NOM ET PRENOM', 3: 'Adresse du client', 4: 'N° carte éleveur'})
+    columns, _ = resolve_columns(header, 60, FALLBACK)
+    assert columns == {'nom': 2, 'adresse': 3, 'carte_eleveur': 4, 'quantite': 0}
+
+
+def test_historical_column_wins_over_another_match():
+    header = header_with({**HISTORICAL, 20: 'Quantité'})
+    columns, sources = resolve_columns(header, 60, FALLBACK)
+    assert (columns['quantite'], sources['quantite']) == (57, 'header')
+
+
+def test_exact_header_wins_over_a_prefix():
+    header = header_with({3: 'Quantité livrée', 4: 'Quantité', 5: 'Nom', 6: 'Adresse', 8: 'Carte éleveur'}, width=20)
+    columns, _ = resolve_columns(header, 20, FALLBACK)
+    assert columns['quantite'] == 4
+
+
+def test_equally_good_headers_are_ambiguous():
+    header = header_with({3: 'Quantité', 4: 'Quantité', 5: 'Nom', 6: 'Adresse', 8: 'Carte éleveur'}, width=20)
+    columns, sources = resolve_columns(header, 20, FALLBACK)
+    assert (columns['quantite'], sources['quantite']) == (None, 'ambiguous')
+
+
+def test_unnamed_fields_fall_back_to_their_position():
+    columns, sources = resolve_columns(header_with({}), 60, FALLBACK)
+    assert columns == dict(zip(column_mapping.FIELDS, FALLBACK))
+    assert set(sources.values()) == {'position'}
+
+
+def test_fallback_is_missing_when_out_of_range_or_named_otherwise():
+    header = header_with({7: 'Adresse'}, width=20)
+    columns, sources = resolve_columns(header, 20, FALLBACK)
+    # H names the address, BF does not exist
+    assert (columns['nom'], sources['nom']) == (None, 'missing')
+    assert (columns['adresse'], sources['adresse']) == (7, 'header')
+    assert (columns['quantite'], sources['quantite']) == (None, 'missing')
+
+
+def test_generic_words_do_not_name_a_field():
+    header = header_with({**HISTORICAL, 1: 'Client', 2: 'Carte grise', 3: 'Volume'})
+    columns, _ = resolve_columns(header, 60, FALLBACK)
+    assert columns == {'nom': 7, 'adresse': 9, 'carte_eleveur': 12, 'quantite': 57}
+
+
+def test_mappings_are_stored_and_reused(store):
+    header = header_with(HISTORICAL)
+    mapping = workbook_columns(header, 60, FALLBACK)
+    assert store.get(mapping['signature'])['columns'] == mapping['columns']
+    # The same header up to accents and case is the same format
+    assert workbook_columns([cell.upper().replace('É', 'E') for cell in header], 60, FALLBACK)['signature'] == mapping['signature']
+    assert workbook_columns(header, 60, FALLBACK) == store.get(mapping['signature'])
+
+
+def test_unresolved_fields_raise_with_the_candidates(store):
+    header = header_with({**HISTORICAL, 3: 'Quantité', 20: 'Quantité', 57: 'Colonne 58'})
+    with pytest.raises(ValueError) as error:
+        workbook_columns(header, 60, FALLBACK)
+    assert 'Plusieurs colonnes possibles pour quantité: D (Quantité), U (Quantité).' in str(error.value)
+    assert 'PUT /mappings/' in str(error.value)
+
+
+def test_override_completes_a_mapping_and_changes_the_version(store):
+    header = header_with({**HISTORICAL, 3: 'Quantité', 56: 'Quantité', 57: 'Colonne 58'})
+    with pytest.raises(ValueError):
+        workbook_columns(header, 60, FALLBACK)
+    mapping = store.mappings()[0]
+    version = mappings_version()
+
+    override_columns(mapping, {'quantite': 'BE'})
+    assert workbook_columns(header, 60, FALLBACK)['columns']['quantite'] == 56
+    assert mappings_version() != version
+    with pytest.raises(ValueError):
+        override_columns(mapping, {'quantite': 'ZZ'})
+    with pytest.raises(ValueError):
+        override_columns(mapping, {'prix': 'A'})
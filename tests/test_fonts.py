@@ -0,0 +1,127 @@
+"""Invoice font subsets: hinting pruned without touching the outlines, and stable glyph codes."""
+import struct
+
+import pytest
+from reportlab.pdfbase.pdfdoc import PDFDocument
+from reportlab.pdfbase.ttfonts import TTFontFace
+
+import fonts
+
+FONT_FILES = fonts._find_font_files()
+
+pytestmark = pytest.mark.skipif(FONT_FILES is None, reason="pas de police TrueType")
+
+# Plain, accented (composite in DejaVu) and ligature glyphs
+TEXT = 'AZaz09 éèÉçÇœŒ€«»fiÀ°'
+
+
+def read_tables(font_data):
+    """{tag: data} of a TrueType file."""
+    tables = {}
+    for index in range(struct.unpack('>H', font_data[4:6])[0]):
+        tag, _, offset, length = struct.unpack('>4sLLL', font_data[12 + 16 * index:28 + 16 * index])
+        tables[tag.decode('latin-1')] = font_data[offset:offset + length]
+    return tables
+
+
+def file_checksum(font_data):
+    """Sum of a TrueType file as 32-bit words, 0xB1B0AFBA when its head checksum adjustment is right."""
+    font_data += b'\0' * (-len(font_data) % 4)
+    return sum(struct.unpack(f'>{len(font_data) // 4}L', font_data)) & 0xFFFFFFFF
+
+
+def read_glyphs(tables):
+    """Glyph entries of a TrueType file, without their alignment padding."""
+    loca = tables['loca']
+    if struct.unpack('>h', tables['head'][50:52])[0] == 1:
+        offsets = struct.unpack(f'>{len(loca) // 4}L', loca)
+    else:
+        offsets = [offset * 2 for offset in struct.unpack(f'>{len(loca) // 2}H', loca)]
+    assert list(offsets) == sorted(offsets) and offsets[-1] <= len(tables['glyf'])
+    return [tables['glyf'][start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+def outline(glyph):
+    """A glyph entry split into (outline without instructions, instruction bytes)."""
+    if not glyph:
+        return b'', b''
+    contour_count = struct.unpack('>h', glyph[:2])[0]
+    if contour_count >= 0:
+        length_at = 10 + 2 * contour_count
+        length = struct.unpack('>H', glyph[length_at:length_at + 2])[0]
+        points = glyph[length_at + 2 + length:]
+        return glyph[:length_at] + points.rstrip(b'\0'), glyph[length_at + 2:length_at + 2 + length]
+    components = []
+    position = 10
+    while True:
+        flags = struct.unpack('>H', glyph[position:position + 2])[0]
+        size = 4 + (4 if flags & fonts.COMPOSITE_WORD_ARGS else 2)
+        if flags & fonts.COMPOSITE_SCALE:
+            size += 2
+        elif flags & fonts.COMPOSITE_XY_SCALE:
+            size += 4
+        elif flags & fonts.COMPOSITE_2X2:
+            size += 8
+        record = bytearray(glyph[position:position + size])
+        struct.pack_into('>H', record, 0, flags & ~fonts.COMPOSITE_HAS_INSTRUCTIONS)
+        components.append(bytes(record))
+        position += size
+        if not flags & fonts.COMPOSITE_MORE:
+            instructions = b''
+            if flags & fonts.COMPOSITE_HAS_INSTRUCTIONS:
+                length = struct.unpack('>H', glyph[position:position + 2])[0]
+                instructions = glyph[position + 2:position + 2 + length]
+            return glyph[:10] + b''.join(components), instructions
+
+
+@pytest.fixture(scope='module')
+def face():
+    return TTFontFace(FONT_FILES[0])
+
+
+def subset_of(face, text):
+    return [0] + sorted({ord(char) for char in text if ord(char) in face.charToGlyph})
+
+
+def test_pruned_subset_keeps_every_outline(face):
+    subset = subset_of(face, TEXT)
+    original = read_tables(face.makeSubset(subset))
+    pruned_data = fonts._prune_subset(face.makeSubset(subset))
+    pruned = read_tables(pruned_data)
+
+    assert file_checksum(pruned_data) == 0xB1B0AFBA
+    assert set(pruned) == set(original) - set(fonts.PRUNED_TABLES)
+    for tag in set(pruned) - {'glyf', 'loca', 'head'}:
+        assert pruned[tag] == original[tag], tag
+    # Only the checksum adjustment of the head table changes
+    assert pruned['head'][:8] + pruned['head'][12:] == original['head'][:8] + original['head'][12:]
+
+    original_glyphs, pruned_glyphs = read_glyphs(original), read_glyphs(pruned)
+    assert len(pruned_glyphs) == len(original_glyphs) == struct.unpack('>H', pruned['maxp'][4:6])[0]
+    assert any(glyph[:2] == b'\xff\xff' for glyph in pruned_glyphs), "aucun glyphe composite testé"
+    assert any(outline(glyph)[1] for glyph in original_glyphs), "aucune instruction à supprimer"
+    for before, after in zip(original_glyphs, pruned_glyphs):
+        assert len(after) % 4 == 0
+        assert outline(after) == (outline(before)[0], b'')
+
+
+def test_pruned_subset_is_smaller(face):
+    subset = subset_of(face, TEXT)
+    assert len(fonts._prune_subset(face.makeSubset(subset))) < len(face.makeSubset(subset)) / 2
+
+
+def test_subsets_are_cached_per_glyph_list():
+    face = fonts.SubsetCachingFace(FONT_FILES[0])
+    subset = subset_of(face, TEXT)
+    first = face.makeSubset(subset)
+    assert face.makeSubset(list(subset)) is first
+    assert face.makeSubset(subset[:-1]) is not first
+
+
+def test_common_glyphs_have_the_same_codes_in_every_document():
+    font = fonts.InvoiceFont('InvoiceSans-Test', FONT_FILES[0])
+    first, second = PDFDocument(), PDFDocument()
+    font.splitString('Zoé Ÿ', first)
+    font.splitString('Œuvre ç', second)
+    assert font.splitString('éçŒ', first) == font.splitString('éçŒ', second)
+    assert font.state[first].subsets == font.state[second].subsets
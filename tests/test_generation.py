@@ -0,0 +1,23 @@
+"""Validation of the batch parameters."""
+import pytest
+
+from generation import build_render_options
+from rendering import FACTURES_PAR_PAGE, RENDER_CHUNK_ROWS
+
+
+@pytest.mark.parametrize('factures_par_page', FACTURES_PAR_PAGE)
+def test_layouts_fill_whole_render_chunks(factures_par_page):
+    assert build_render_options(factures_par_page=factures_par_page)['factures_par_page'] == factures_par_page
+    assert RENDER_CHUNK_ROWS % factures_par_page == 0
+
+
+@pytest.mark.parametrize('factures_par_page', [0, 3, -1, 8, '2'])
+def test_other_layouts_are_rejected(factures_par_page):
+    with pytest.raises(ValueError, match='factures par page'):
+        build_render_options(factures_par_page=factures_par_page)
+
+
+@pytest.mark.parametrize('parameters', [{'numbering': 'random'}, {'output_profile': 'tiny'}, {'incremental': True, 'numbering': 'sequential'}])
+def test_invalid_options_are_rejected(parameters):
+    with pytest.raises(ValueError):
+        build_render_options(**parameters)
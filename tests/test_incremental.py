@@ -0,0 +1,98 @@
+"""Incremental regeneration: only the pages of changed invoices are drawn again."""
+import io
+
+import pytest
+from pypdf import PdfReader
+
+import incremental
+from extraction import ClientColumns
+from generation import build_render_options
+from incremental import PageStore, render_pdf_incremental
+from metrics import GenerationStats
+from rendering import render_pdf
+
+ROWS = 10
+
+CHANGED_ROW = 5
+
+
+def clients(changed_row=None):
+    noms = [f"Ali {index}" for index in range(ROWS)]
+    if changed_row is not None:
+        noms[changed_row] = 'Sami'
+    return ClientColumns(
+        noms,
+        [f"Adresse {index}" for index in range(ROWS)],
+        [f"CE-{index:04d}" for index in range(ROWS)],
+        [float(index + 1) for index in range(ROWS)],
+    )
+
+
+def options(factures_par_page):
+    return build_render_options(
+        factures_par_page=factures_par_page, fixed_invoice_number='FAC-2024-001', invoice_date='2024-01-31',
+        company_name='Coopérative de Sétif', item_name='Orge', month_year='Janvier 2024', unit_price=2500.0, incremental=True
+    )
+
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Record the size of every run handed to render_chunk."""
+    runs = []
+
+    def render_chunk(clients, options):
+        runs.append(len(clients))
+        return real_render_chunk(clients, options)
+
+    real_render_chunk = incremental.render_chunk
+    monkeypatch.setattr(incremental, 'render_chunk', render_chunk)
+    return runs
+
+
+def pages_text(data):
+    return [page.extract_text() for page in PdfReader(io.BytesIO(data), strict=True).pages]
+
+
+def render(records, batch_options, store):
+    output, stats = io.BytesIO(), GenerationStats()
+    render_pdf_incremental([records], output, batch_options, store, stats=stats)
+    return output.getvalue(), stats
+
+
+@pytest.mark.parametrize('factures_par_page', [2, 4])
+def test_only_the_page_of_a_changed_row_is_drawn_again(factures_par_page, tmp_path, rendered):
+    store = PageStore(str(tmp_path), max_bytes=10 ** 8, max_age_seconds=3600)
+    batch_options = options(factures_par_page)
+
+    _, first = render(clients(), batch_options, store)
+    assert first.reused_rows == 0 and rendered == [ROWS]
+
+    rendered.clear()
+    revised, second = render(clients(CHANGED_ROW), batch_options, store)
+    assert rendered == [factures_par_page]
+    assert second.reused_rows == ROWS - factures_par_page
+
+    full = io.BytesIO()
+    render_pdf(clients(CHANGED_ROW), full, batch_options)
+    revised_pages, full_pages = pages_text(revised), pages_text(full.getvalue())
+    assert len(revised_pages) == len(full_pages) == -(-ROWS // factures_par_page)
+    assert revised_pages == full_pages
+    changed_page = CHANGED_ROW // factures_par_page
+    assert 'SAMI' in revised_pages[changed_page]
+    assert not any('SAMI' in text for page, text in enumerate(revised_pages) if page != changed_page)
+
+
+def test_pages_are_keyed_by_every_invoice_in_slot_order():
+    batch_key = incremental.batch_fingerprint(options(2))
+    records = clients()
+    assert incremental.page_key(batch_key, records[0:2]) != incremental.page_key(batch_key, records[1::-1])
+    assert incremental.page_key(batch_key, records[0:2]) != incremental.page_key(incremental.batch_fingerprint(options(4)), records[0:2])
+
+
+def test_unchanged_revision_is_copied_whole(tmp_path, rendered):
+    store = PageStore(str(tmp_path), max_bytes=10 ** 8, max_age_seconds=3600)
+    first, _ = render(clients(), options(4), store)
+    rendered.clear()
+    second, stats = render(clients(), options(4), store)
+    assert rendered == [] and stats.reused_rows == ROWS
+    assert pages_text(second) == pages_text(first)
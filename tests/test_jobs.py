@@ -0,0 +1,173 @@
+"""Background generation jobs, driven through the Flask test client."""
+import io
+import os
+import datetime
+
+import pytest
+
+import jobs
+
+HEADER = 'Colonne 1,Nom et prénom,Adresse,Carte éleveur,Quantité\r\n,,,,\r\nRéf.,,,,\r\n'
+
+WORKBOOK = (HEADER + '1,Hélène Dupré,Sétif,CE-1,12\r\n2,Zoé Chérif,Béjaïa,CE-2,3.5\r\n').encode('utf-8')
+
+FORM = {'factures_par_page': '2', 'fixed_invoice_number': 'FAC-2024-001', 'invoice_date': '2024-01-31', 'company_name': 'Coopérative'}
+
+
+class QueueExecutor:
+    """Executor holding the submitted jobs until the test runs them."""
+
+    def __init__(self):
+        self.queue = []
+
+    def submit(self, function, *args):
+        self.queue.append((function, args))
+
+    def run_all(self):
+        while self.queue:
+            function, args = self.queue.pop(0)
+            function(*args)
+
+
+@pytest.fixture
+def app(flask_app, tmp_path, monkeypatch):
+    from app import db
+    from models import GenerationJob
+
+    monkeypatch.setitem(flask_app.config, 'JOBS_FOLDER', str(tmp_path / 'jobs'))
+    monkeypatch.setitem(flask_app.config, 'RESULT_CACHE_FOLDER', str(tmp_path / 'cache'))
+    monkeypatch.setitem(flask_app.config, 'INVOICE_LEDGER', False)
+    monkeypatch.setitem(flask_app.config, 'RENDER_WORKERS', 1)
+    monkeypatch.setattr(jobs, '_result_cache', None)
+    yield flask_app
+    with flask_app.app_context():
+        GenerationJob.query.delete()
+        db.session.commit()
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = QueueExecutor()
+    monkeypatch.setattr(jobs, '_executor', executor)
+    return executor
+
+
+def submit(client, workbook=WORKBOOK, **form):
+    data = dict(FORM, **form, file=(io.BytesIO(workbook), 'clients.csv'))
+    response = client.post('/generate', data=data, headers={'Accept': 'application/json'})
+    assert response.status_code in (200, 202), response.get_json()
+    return response.get_json()
+
+
+def job_status(client, job_id):
+    return client.get(f"/jobs/{job_id}").get_json()
+
+
+def set_updated_at(app, job_id, age_seconds):
+    """Backdate the last heartbeat of a job."""
+    from app import db
+    from models import GenerationJob
+
+    with app.app_context():
+        updated_at = jobs._utc_now() - datetime.timedelta(seconds=age_seconds)
+        GenerationJob.query.filter_by(id=job_id).update({GenerationJob.updated_at: updated_at}, synchronize_session=False)
+        db.session.commit()
+
+
+def test_job_goes_from_queued_to_running_to_done(app, executor, monkeypatch):
+    client = app.test_client()
+    seen = []
+
+    def generate(**kwargs):
+        seen.append(job_status(client, job_id)['status'])
+        return real_generate(**kwargs)
+
+    real_generate = jobs.generer_factures_pdf
+    monkeypatch.setattr(jobs, 'generer_factures_pdf', generate)
+
+    submitted = submit(client)
+    job_id = submitted['job_id']
+    assert (submitted['status'], submitted['cached']) == ('queued', False)
+    assert job_status(client, job_id)['status'] == 'queued'
+    assert client.get(f"/jobs/{job_id}/download").status_code == 409
+
+    executor.run_all()
+    assert seen == ['running']
+    status = job_status(client, job_id)
+    assert (status['status'], status['rows_processed'], status['rows_total']) == ('done', 2, 2)
+    download = client.get(f"/jobs/{job_id}/download")
+    assert download.status_code == 200 and download.data.startswith(b'%PDF')
+
+
+def test_job_without_clients_fails(app, executor):
+    client = app.test_client()
+    job_id = submit(client, (HEADER + '1,,Sétif,CE-1,12\r\n').encode('utf-8'))['job_id']
+    executor.run_all()
+    status = job_status(client, job_id)
+    assert status['status'] == 'failed' and 'Aucune donnée valide' in status['error']
+
+
+def test_identical_upload_joins_the_pending_job(app, executor):
+    client = app.test_client()
+    first = submit(client)
+    assert submit(client)['job_id'] == first['job_id']
+    assert len(executor.queue) == 1
+    # Other parameters are another job
+    assert submit(client, fixed_invoice_number='FAC-2024-002')['job_id'] != first['job_id']
+
+    executor.run_all()
+    cached = submit(client)
+    assert cached['cached'] and cached['status'] == 'done' and cached['job_id'] != first['job_id']
+
+
+def test_stale_job_is_failed_and_not_joined(app, executor):
+    client = app.test_client()
+    stale = submit(client)['job_id']
+    set_updated_at(app, stale, app.config['JOB_STALE_SECONDS'] + 60)
+
+    fresh = submit(client)['job_id']
+    assert fresh != stale
+    status = job_status(client, stale)
+    assert status['status'] == 'failed' and 'abandonnée' in status['error']
+    assert job_status(client, fresh)['status'] == 'queued'
+
+
+def test_fail_stale_jobs_spares_jobs_with_a_heartbeat(app, executor):
+    client = app.test_client()
+    stale = submit(client)['job_id']
+    live = submit(client, fixed_invoice_number='FAC-2024-002')['job_id']
+    set_updated_at(app, stale, app.config['JOB_STALE_SECONDS'] + 60)
+    set_updated_at(app, live, app.config['JOB_STALE_SECONDS'] - 60)
+
+    with app.app_context():
+        assert jobs.fail_stale_jobs() == 1
+    assert job_status(client, stale)['status'] == 'failed'
+    assert job_status(client, live)['status'] == 'queued'
+
+    # The stale job was never started, the queue skips it
+    executor.run_all()
+    assert job_status(client, stale)['status'] == 'failed'
+    assert job_status(client, live)['status'] == 'done'
+
+
+def test_purge_keeps_the_files_of_the_result_cache(app, executor):
+    from app import db
+    from models import GenerationJob
+
+    client = app.test_client()
+    cached_job = submit(client)['job_id']
+    private_job = submit(client, numbering='sequential')['job_id']
+    executor.run_all()
+
+    with app.app_context():
+        cached_path = db.session.get(GenerationJob, cached_job).result_path
+        private_path = db.session.get(GenerationJob, private_job).result_path
+        assert jobs.get_result_cache().owns(cached_path) and not jobs.get_result_cache().owns(private_path)
+    retention = app.config['JOB_RETENTION_HOURS'] * 3600
+    set_updated_at(app, cached_job, retention + 60)
+    set_updated_at(app, private_job, retention + 60)
+
+    with app.app_context():
+        jobs.purge_expired_jobs()
+        assert GenerationJob.query.count() == 0
+    assert os.path.exists(cached_path) and not os.path.exists(private_path)
@@ -0,0 +1,159 @@
+"""Invoice ledger: recorded names, bulk writes and keyset search."""
+import io
+import csv
+
+import pytest
+from sqlalchemy import delete, func, select
+
+import ledger
+from extraction import ClientColumns, extract_chunk
+from fonts import shape_text
+
+ARABIC_NAME = 'محمد بن علي'
+
+PARAMETERS = {'unit_price': 2500.0, 'fixed_invoice_number': '0001', 'month_year': 'Janvier 2024', 'invoice_date': '2024-01-31'}
+
+
+@pytest.fixture
+def engine(flask_app):
+    from app import db
+
+    with flask_app.app_context():
+        yield db.engine
+        invoices, batches = ledger.ledger_tables(db.engine)
+        with db.engine.begin() as connection:
+            connection.execute(delete(invoices))
+            connection.execute(delete(batches))
+        db.session.remove()
+
+
+def record(engine, clients, parameters=PARAMETERS):
+    recorder = ledger.LedgerRecorder(engine, parameters, 'clients.xlsx')
+    recorder.add(clients)
+    recorder.close()
+    return recorder.batch_id
+
+
+def test_extraction_keeps_the_typed_name():
+    clients, skipped = extract_chunk([(2, f"  {ARABIC_NAME} ", 'Adresse', 'CE-1', 2), (3, ' ', '', '', None)])
+    assert skipped == 1
+    assert clients.noms_saisis == [ARABIC_NAME]
+    assert clients[:1].noms_saisis == [ARABIC_NAME]
+
+
+def test_typed_name_is_recorded_rather_than_the_drawn_one(engine):
+    clients = ClientColumns([shape_text(ARABIC_NAME), 'ZOÉ'], ['', ''], ['CE-1', 'CE-2'], [1.0, 2.0], [ARABIC_NAME, 'Zoé'])
+    batch_id = record(engine, clients)
+    invoices, _ = ledger.search_invoices(batch_id=batch_id)
+    assert [invoice.client_name for invoice in invoices] == [ARABIC_NAME, 'Zoé']
+
+
+def test_search_key_without_letters_matches_nothing(engine):
+    record(engine, ClientColumns(['Ali'], [''], ['CE-1'], [1.0], [ARABIC_NAME]))
+    record(engine, ClientColumns(['Ali'], [''], ['CE-2'], [1.0]))
+    assert ledger.search_invoices(client=ARABIC_NAME) == ([], None)
+    assert [invoice.breeder_card for invoice in ledger.search_invoices(client='ali')[0]] == ['CE-2']
+
+
+def all_pages(limit, **filters):
+    """Every page of a search, followed through next_after."""
+    pages, after = [], None
+    while True:
+        invoices, after = ledger.search_invoices(after=after, limit=limit, **filters)
+        pages.append([(invoice.client_name, invoice.breeder_card, invoice.month_year) for invoice in invoices])
+        if after is None:
+            return pages
+
+
+def test_card_search_pages_by_id(engine):
+    record(engine, ClientColumns(['A', 'B', 'C', 'D', 'E'], [''] * 5, ['CE-1', 'CE-2', 'CE-1', 'CE-1', 'CE-1'], [1.0] * 5))
+    record(engine, ClientColumns(['F', 'G'], [''] * 2, ['CE-1', 'CE-1'], [1.0] * 2))
+    assert all_pages(2, card='CE-1') == [
+        [('A', 'CE-1', 'Janvier 2024'), ('C', 'CE-1', 'Janvier 2024')],
+        [('D', 'CE-1', 'Janvier 2024'), ('E', 'CE-1', 'Janvier 2024')],
+        [('F', 'CE-1', 'Janvier 2024'), ('G', 'CE-1', 'Janvier 2024')],
+    ]
+
+
+def test_client_search_pages_by_name_then_id(engine):
+    names = ['Amine', 'Zoé', 'Ali', 'Émile', 'amine', 'Ali']
+    record(engine, ClientColumns(names, [''] * 6, [f"CE-{index}" for index in range(6)], [1.0] * 6))
+    pages = all_pages(2, client='a')
+    assert [[card for _, card, _ in page] for page in pages] == [['CE-2', 'CE-5'], ['CE-0', 'CE-4']]
+    assert [invoice.client_name for invoice in ledger.search_invoices(client='emi')[0]] == ['Émile']
+
+
+def test_month_search_pages_across_batches(engine):
+    january = dict(PARAMETERS)
+    february = dict(PARAMETERS, month_year='Février 2024')
+    record(engine, ClientColumns(['A', 'B', 'C'], [''] * 3, ['CE-1'] * 3, [1.0] * 3), january)
+    record(engine, ClientColumns(['D', 'E'], [''] * 2, ['CE-1'] * 2, [1.0] * 2), february)
+    record(engine, ClientColumns(['F'], [''], ['CE-1'], [1.0]), january)
+    pages = all_pages(2, month='Janvier 2024')
+    assert [[name for name, _, _ in page] for page in pages] == [['A', 'B'], ['C', 'F']]
+    assert [[name for name, _, _ in page] for page in all_pages(2, month='Février 2024')] == [['D', 'E']]
+
+
+def test_pending_and_discarded_batches_leave_no_invoice(engine):
+    from app import db
+    from models import InvoiceBatch
+
+    pending = ledger.LedgerRecorder(engine, PARAMETERS, 'pending.xlsx')
+    pending.add(ClientColumns(['A'], [''], ['CE-1'], [1.0]))
+    pending.flush()
+    assert ledger.search_invoices(card='CE-1') == ([], None)
+
+    discarded = ledger.LedgerRecorder(engine, PARAMETERS, 'failed.xlsx')
+    discarded.add(ClientColumns(['B', 'C'], [''] * 2, ['CE-2'] * 2, [1.0] * 2))
+    discarded.flush()
+    discarded.add(ClientColumns(['D'], [''], ['CE-2'], [1.0]))
+    discarded.discard()
+    invoices, batches = ledger.ledger_tables(engine)
+    with engine.connect() as connection:
+        assert connection.scalar(select(func.count()).select_from(invoices).where(invoices.c.batch_id == discarded.batch_id)) == 0
+        assert connection.scalar(select(func.count()).select_from(batches).where(batches.c.id == discarded.batch_id)) == 0
+        assert connection.scalar(select(func.count()).select_from(invoices).where(invoices.c.batch_id == pending.batch_id)) == 1
+    assert db.session.get(InvoiceBatch, pending.batch_id).status == 'pending'
+
+
+
+class CopyConnection:
+    """Raw DB-API connection recording the COPY statements it is given."""
+
+    def __init__(self):
+        self.copies = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, buffer.read()))
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_copy_keeps_empty_text_fields(engine, monkeypatch):
+    from models import Invoice
+
+    recorder = ledger.LedgerRecorder(engine, dict(PARAMETERS, month_year=''), 'clients.xlsx')
+    connection = CopyConnection()
+    monkeypatch.setattr(recorder, '_engine', type('Engine', (), {'raw_connection': lambda self: connection})())
+    recorder.add(ClientColumns([ARABIC_NAME], [''], [''], [1.0]))
+    recorder._copy_rows(recorder._pending)
+
+    (sql, data), = connection.copies
+    assert f"FORCE_NOT_NULL ({', '.join(ledger.COPY_TEXT_COLUMNS)})" in sql
+    required = {column.name for column in Invoice.__table__.columns if not column.nullable and column.type.python_type is str}
+    assert required <= set(ledger.COPY_TEXT_COLUMNS)
+    row = dict(zip(ledger.INVOICE_COLUMNS, next(csv.reader(io.StringIO(data)))))
+    assert [row[column] for column in ledger.COPY_TEXT_COLUMNS] == [ARABIC_NAME, '', '', '', '']
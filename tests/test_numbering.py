@@ -0,0 +1,55 @@
+"""Reservation and release of sequential invoice numbers."""
+import pytest
+from sqlalchemy import create_engine
+
+from numbering import InvoiceSequence, create_sequence_table, format_invoice_number, sequence_for
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'numbering.db'}")
+    create_sequence_table(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_blocks_follow_each_other(engine):
+    sequence = InvoiceSequence(engine, '0002190', 2024)
+    assert sequence.reserve(36) == 1
+    assert sequence.reserve(10) == 37
+    assert InvoiceSequence(engine, '0002190', 2024).reserve(1) == 47
+
+
+def test_companies_and_years_are_numbered_apart(engine):
+    assert InvoiceSequence(engine, 'A', 2024).reserve(5) == 1
+    assert InvoiceSequence(engine, 'B', 2024).reserve(5) == 1
+    assert InvoiceSequence(engine, 'A', 2025).reserve(5) == 1
+    assert InvoiceSequence(engine, 'A', 2024).reserve(5) == 6
+
+
+def test_last_block_is_given_back(engine):
+    sequence = InvoiceSequence(engine, 'A', 2024)
+    sequence.reserve(10)
+    first = sequence.reserve(5)
+    assert sequence.release(first, 5)
+    assert sequence.reserve(3) == first
+
+
+def test_block_followed_by_another_is_lost(engine):
+    sequence = InvoiceSequence(engine, 'A', 2024)
+    first = sequence.reserve(5)
+    later = sequence.reserve(5)
+    assert not sequence.release(first, 5)
+    assert sequence.reserve(1) == later + 5
+
+
+def test_sequence_is_per_nif_else_company_name_and_invoice_year(engine):
+    by_nif = sequence_for(engine, {'nif': ' 0002190 ', 'company_name': 'Coop', 'invoice_date': '2023-12-31'})
+    assert (by_nif.company, by_nif.year) == ('0002190', 2023)
+    by_name = sequence_for(engine, {'nif': '', 'company_name': 'Coop', 'invoice_date': '2024-01-01'})
+    assert (by_name.company, by_name.year) == ('Coop', 2024)
+
+
+def test_invoice_number_format():
+    assert format_invoice_number('FAC', 2024, 123) == 'FAC-2024-000123'
+    assert format_invoice_number('  ', 2024, 7) == '2024-000007'
@@ -0,0 +1,147 @@
+"""StreamingPdfWriter output, parsed back in strict mode for every output profile."""
+import io
+
+import pytest
+from pypdf import PdfReader
+
+from extraction import ClientColumns
+from pdfstream import StreamingPdfWriter
+from rendering import OUTPUT_PROFILES, pdf_writer, render_chunk
+
+OPTIONS = {
+    'factures_par_page': 2,
+    'fixed_invoice_number': 'FAC-2024-001',
+    'numbering': 'fixed',
+    'invoice_year': 2024,
+    'first_invoice_number': None,
+    'company_name': 'Coopérative de Sétif',
+    'address': 'Sétif',
+    'rc_name': 'RC 19/00',
+    'nif': '0002190',
+    'item_name': 'Orge',
+    'client_profession': 'Éleveur',
+    'month_year': 'Janvier 2024',
+    'rib': '0079',
+    'unit_price': 2500.0,
+    'use_template': True,
+}
+
+
+def clients(prefix, count):
+    return ClientColumns(
+        [f"{prefix} {index}" for index in range(count)],
+        [f"Adresse {index}" for index in range(count)],
+        [f"CE-{index:04d}" for index in range(count)],
+        [float(index + 1) for index in range(count)],
+    )
+
+
+def options(profile):
+    return dict(OPTIONS, output_profile=profile)
+
+
+def read_strict(data):
+    """Parse a PDF in strict mode and resolve every object of its cross-reference table."""
+    reader = PdfReader(io.BytesIO(data), strict=True)
+    for object_id in range(1, int(reader.trailer['/Size'])):
+        assert reader.get_object(object_id) is not None, object_id
+    return reader
+
+
+@pytest.mark.parametrize('profile', OUTPUT_PROFILES)
+def test_whole_parts_are_appended_in_order(profile):
+    first = render_chunk(clients('Ali', 4), options(profile))
+    second = render_chunk(clients('Sami', 6), options(profile))
+    output = io.BytesIO()
+    with pdf_writer(output, options(profile)) as writer:
+        writer.append(first)
+        writer.append(second)
+    assert writer.page_count == 5
+
+    reader = read_strict(output.getvalue())
+    assert len(reader.pages) == 5
+    text = [page.extract_text() for page in reader.pages]
+    assert 'ALI 0' in text[0] and 'ALI 3' in text[1]
+    assert 'SAMI 0' in text[2] and 'SAMI 5' in text[4]
+
+
+@pytest.mark.parametrize('profile', OUTPUT_PROFILES)
+def test_selected_pages_are_spliced_in_document_order(profile):
+    stored = render_chunk(clients('Ali', 6), options(profile))
+    fresh = render_chunk(clients('Sami', 2), options(profile))
+    output = io.BytesIO()
+    with pdf_writer(output, options(profile)) as writer:
+        writer.append(stored, pages=[2], source='stored')
+        writer.append(fresh)
+        writer.append(stored, pages=[0, 1], source='stored')
+    assert writer.page_count == 4
+
+    text = [page.extract_text() for page in read_strict(output.getvalue()).pages]
+    assert 'ALI 4' in text[0]
+    assert 'SAMI 0' in text[1]
+    assert 'ALI 0' in text[2] and 'ALI 2' in text[3]
+
+
+def test_compact_shares_fonts_and_packs_objects():
+    parts = [render_chunk(clients(f"Client{part}", 10), options('compact')) for part in range(3)]
+    plain, compact = io.BytesIO(), io.BytesIO()
+    with StreamingPdfWriter(plain) as writer:
+        for part in parts:
+            writer.append(part)
+    with StreamingPdfWriter(compact, compact=True) as writer:
+        for part in parts:
+            writer.append(part)
+
+    assert compact.getvalue().startswith(b'%PDF-1.5')
+    assert b'/Type /ObjStm' in compact.getvalue() and b'/Type /XRef' in compact.getvalue()
+    assert len(compact.getvalue()) < len(plain.getvalue())
+    # Every part embeds the same font subsets and template, the compact document once
+    assert compact.getvalue().count(b'/Length1') * len(parts) == plain.getvalue().count(b'/Length1')
+    assert [page.extract_text() for page in read_strict(compact.getvalue()).pages] == \
+        [page.extract_text() for page in read_strict(plain.getvalue()).pages]
+
+
+def test_archive_writes_document_metadata():
+    output = io.BytesIO()
+    with pdf_writer(output, options('archive')) as writer:
+        writer.append(render_chunk(clients('Ali', 2), options('archive')))
+
+    reader = read_strict(output.getvalue())
+    assert reader.metadata['/Title'] == 'Factures Janvier 2024'
+    assert reader.metadata['/Author'] == 'Coopérative de Sétif'
+    assert reader.metadata['/CreationDate'].startswith('D:')
+    xmp = reader.trailer['/Root']['/Metadata'].get_object().get_data()
+    assert 'Coopérative de Sétif'.encode('utf-8') in xmp
+
+
+def test_fast_leaves_page_streams_uncompressed():
+    output = io.BytesIO()
+    with pdf_writer(output, options('fast')) as writer:
+        writer.append(render_chunk(clients('Ali', 2), options('fast')))
+
+    data = output.getvalue()
+    assert data.startswith(b'%PDF-1.4') and b'/Type /ObjStm' not in data
+    assert 'ALI 1' in read_strict(data).pages[0].extract_text()
+
+
+@pytest.mark.parametrize('profile', OUTPUT_PROFILES)
+def test_every_embedded_subset_has_its_own_tag(profile):
+    output = io.BytesIO()
+    with pdf_writer(output, options(profile)) as writer:
+        for part in range(3):
+            writer.append(render_chunk(clients(f"Client{part}", 4), options(profile)))
+
+    font_files = {}
+    for page in read_strict(output.getvalue()).pages:
+        for font in page['/Resources']['/Font'].values():
+            font = font.get_object()
+            if '/FontDescriptor' not in font:
+                continue
+            descriptor = font['/FontDescriptor'].get_object()
+            assert descriptor['/FontName'] == font['/BaseFont']
+            font_files.setdefault(font['/BaseFont'], set()).add(descriptor.raw_get('/FontFile2').idnum)
+    assert font_files and all(len(files) == 1 for files in font_files.values())
+    if profile == 'fast':
+        assert len(font_files) == 6
+    else:
+        assert len(font_files) == 2
@@ -0,0 +1,39 @@
+"""ResultCache: entries expire by creation time and are evicted by last access."""
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def put(cache, tmp_path, key, size=10):
+    source = tmp_path / f"{key}.source"
+    source.write_bytes(b'x' * size)
+    return cache.put(key, str(source))
+
+
+def test_hits_do_not_extend_the_age_limit(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=1000, max_age_seconds=60)
+    path = put(cache, tmp_path, 'a')
+    created = time.time() - 50
+    os.utime(path, (created, created))
+
+    assert cache.get('a') == path
+    assert os.path.getmtime(path) == created
+    # Created 70 seconds ago, read 20 seconds ago
+    os.utime(path, (time.time() - 20, time.time() - 70))
+    assert cache.get('a') is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_read_entries_are_evicted_first(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=25, max_age_seconds=3600)
+    now = time.time()
+    older, newer = put(cache, tmp_path, 'older'), put(cache, tmp_path, 'newer')
+    os.utime(older, (now - 100, now - 100))
+    os.utime(newer, (now - 50, now - 50))
+    # Reading the older entry makes the newer one the least recently used
+    assert cache.get('older') == older
+
+    put(cache, tmp_path, 'third')
+    assert cache.get('newer') is None
+    assert cache.get('older') == older and cache.get('third') is not None
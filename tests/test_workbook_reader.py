@@ -0,0 +1,114 @@
+"""CSV dialect detection and its cache, and reading client rows from workbooks."""
+import io
+import logging
+
+import pytest
+
+import workbook_reader
+from workbook_reader import DATA_START_INDEX, read_client_rows, sniff_csv_dialect
+
+HEADER = ['Colonne 1', 'Nom et prénom', 'Adresse', 'Carte éleveur', 'Quantité']
+
+
+def csv_bytes(rows, encoding='utf-8', separator=','):
+    lines = [separator.join(HEADER), separator.join([''] * len(HEADER)), separator.join(['Réf.'] + [''] * (len(HEADER) - 1))]
+    lines += [separator.join(str(value) for value in row) for row in rows]
+    return ('\r\n'.join(lines) + '\r\n').encode(encoding)
+
+
+CLIENTS = [(1, 'Hélène Dupré', 'Sétif', 'CE-1', 12), (2, 'Zoé Chérif', 'Béjaïa', 'CE-2', 3.5)]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(workbook_reader, '_dialect_cache', type(workbook_reader._dialect_cache)())
+
+
+@pytest.mark.parametrize('encoding, separator, detected', [
+    ('utf-8', ',', 'utf-8'),
+    ('utf-8-sig', ';', 'utf-8-sig'),
+    ('windows-1252', ';', 'windows-1252'),
+    ('utf-16', '\t', 'utf-16'),
+])
+def test_dialect_is_detected(encoding, separator, detected):
+    dialect = sniff_csv_dialect(io.BytesIO(csv_bytes(CLIENTS, encoding, separator)))
+    assert dialect.separator == separator
+    assert dialect.header == tuple(HEADER)
+    assert dialect.column_count == len(HEADER)
+    assert dialect.encoding == detected
+
+
+def test_separator_is_cached_by_header_line(caplog):
+    data = csv_bytes(CLIENTS, separator=';')
+    with caplog.at_level(logging.INFO, logger='workbook_reader'):
+        sniff_csv_dialect(io.BytesIO(data))
+        dialect = sniff_csv_dialect(io.BytesIO(data))
+    assert dialect.separator == ';'
+    assert len(workbook_reader._dialect_cache) == 1
+    assert 'separator from cache' in caplog.records[-1].getMessage()
+
+
+def test_encoding_is_detected_for_every_file_of_a_cached_header():
+    # An ASCII header line is the same bytes, and cache entry, in both encodings
+    header = 'Colonne 1;Nom;Adresse;Carte;Quantite\r\n'
+    latin = (header + 'x;Hélène;Sétif;CE-1;1\r\n').encode('windows-1252')
+    utf8 = (header + 'x;Hélène;Sétif;CE-1;1\r\n').encode('utf-8')
+    assert sniff_csv_dialect(io.BytesIO(latin)).encoding == 'windows-1252'
+    assert sniff_csv_dialect(io.BytesIO(utf8)).encoding == 'utf-8'
+    assert len(workbook_reader._dialect_cache) == 1
+
+
+def test_sniffing_rewinds_a_file_object():
+    stream = io.BytesIO(csv_bytes(CLIENTS))
+    stream.seek(0)
+    sniff_csv_dialect(stream)
+    assert stream.tell() == 0
+
+
+def test_empty_file_is_rejected():
+    with pytest.raises(ValueError, match='vide'):
+        sniff_csv_dialect(io.BytesIO(b'  \r\n'))
+
+
+@pytest.mark.parametrize('encoding, separator', [('utf-8', ','), ('windows-1252', ';'), ('utf-16', '\t')])
+def test_client_rows_are_read_in_field_order(tmp_path, monkeypatch, encoding, separator):
+    from column_mapping import MappingStore
+    import column_mapping
+
+    monkeypatch.setattr(column_mapping, '_store', MappingStore(str(tmp_path / 'mappings')))
+    path = tmp_path / 'clients.csv'
+    path.write_bytes(csv_bytes(CLIENTS, encoding, separator))
+
+    rows = list(read_client_rows(str(path)))
+    assert [index for index, _ in rows] == [DATA_START_INDEX, DATA_START_INDEX + 1]
+    assert [values[:3] for _, values in rows] == [('Hélène Dupré', 'Sétif', 'CE-1'), ('Zoé Chérif', 'Béjaïa', 'CE-2')]
+
+
+def test_workbook_is_closed_when_its_columns_cannot_be_resolved(tmp_path, monkeypatch):
+    import openpyxl
+
+    path = tmp_path / 'clients.xlsx'
+    workbook = openpyxl.Workbook()
+    for row in [HEADER, [], ['Réf.']] + [list(client) for client in CLIENTS]:
+        workbook.active.append(row)
+    workbook.save(path)
+
+    opened = []
+
+    def load_workbook(*args, **kwargs):
+        workbook = real_load_workbook(*args, **kwargs)
+        real_close = workbook.close
+        workbook.close = lambda: (closed.append(workbook), real_close())
+        opened.append(workbook)
+        return workbook
+
+    def workbook_columns(header, column_count, fallback):
+        raise ValueError('Colonnes introuvables')
+
+    closed = []
+    real_load_workbook = openpyxl.load_workbook
+    monkeypatch.setattr(openpyxl, 'load_workbook', load_workbook)
+    monkeypatch.setattr(workbook_reader, 'workbook_columns', workbook_columns)
+    with pytest.raises(ValueError, match='Colonnes introuvables'):
+        next(read_client_rows(str(path)))
+    assert len(opened) == 1 and closed == opened
@@ -0,0 +1,89 @@
+"""Background warm-up of a freshly started worker.
+
+The web application imports its parsing and rendering stack (pandas,
+ReportLab, the invoice fonts) on first use, so that a worker is importable,
+and bound to its port, in a fraction of the time. A Warmup then runs the
+expensive first-use steps in a daemon thread, timing each one, so the first
+generation does not pay for them either; /health reports its progress.
+
+This module does not import the Flask application.
+"""
+import time
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def import_step(name):
+    """Warm-up step importing a module by name."""
+    return lambda: importlib.import_module(name)
+
+
+def register_fonts():
+    from fonts import invoice_fonts
+
+    invoice_fonts()
+
+
+# Heaviest dependencies first, so each step's time is mostly its own
+DEFAULT_STEPS = (
+    ('pandas', import_step('pandas')),
+    ('reportlab', import_step('reportlab.pdfgen.canvas')),
+    ('generation', import_step('generation')),
+    ('fonts', register_fonts),
+)
+
+
+class Warmup:
+    """Run (name, function) steps once, in order, in a background thread, recording their durations."""
+
+    def __init__(self, steps=DEFAULT_STEPS):
+        self.steps = tuple(steps)
+        self.state = 'pending'
+        self.timings = {}
+        self.error = None
+        self.failed_step = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        """Start the warm-up thread, once."""
+        with self._lock:
+            if self.state != 'pending':
+                return
+            self.state = 'running'
+        threading.Thread(target=self.run, name='warmup', daemon=True).start()
+
+    def run(self):
+        started = time.perf_counter()
+        name = None
+        try:
+            for name, step in self.steps:
+                step_started = time.perf_counter()
+                step()
+                self.timings[name] = time.perf_counter() - step_started
+            self.state = 'done'
+            logger.info(f"Préchauffage terminé en {time.perf_counter() - started:.2f}s ({', '.join(f'{name} {seconds:.2f}s' for name, seconds in self.timings.items())})")
+        except Exception as e:
+            # The later steps are skipped; /health stays not ready and reports the error
+            self.state = 'failed'
+            self.failed_step = name
+            self.error = str(e)
+            logger.exception(f"Échec du préchauffage à l'étape {name}: {e}")
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Block until the warm-up has finished; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        """Return the warm-up state as a JSON-serialisable dict."""
+        return {
+            'state': self.state,
+            'timings': {name: round(seconds, 6) for name, seconds in self.timings.items()},
+            'failed_step': self.failed_step,
+            'error': self.error,
+        }
@@ -0,0 +1,390 @@
+"""Column-projected, streaming readers for the client workbooks.
+
+Only the name, address, breeder card and quantity columns are ever used, so
+each reader reads the header row, resolves those four columns from it (see
+column_mapping.py, H, J, M and BF by default) and then parses just those
+cells per row, yielding rows lazily instead of loading the whole sheet into a
+DataFrame.
+"""
+import os
+import csv
+import codecs
+import hashlib
+import logging
+import threading
+from operator import itemgetter
+from collections import OrderedDict, namedtuple
+
+from column_mapping import FIELDS, workbook_columns
+
+logger = logging.getLogger(__name__)
+
+# Default column indices (Excel columns start from A=0, B=1, etc.), used for
+# fields whose header is not recognised
+NAME_COL_INDEX = 7  # Column H
+ADDRESS_COL_INDEX = 9  # Column J
+BREEDER_CARD_COL_INDEX = 12  # Column M
+QUANTITY_COL_INDEX = 57  # Column BF - BF = B(1)*26 + F(5) = 57 in 0-based
+PROJECTED_COLUMNS = (NAME_COL_INDEX, ADDRESS_COL_INDEX, BREEDER_CARD_COL_INDEX, QUANTITY_COL_INDEX)
+
+# Workbook formats the readers can open
+SUPPORTED_EXTENSIONS = ('xlsx', 'xlsm', 'xls', 'csv', 'ods', 'xlsb')
+
+# Row 1 is the header row; client data starts at index 2 of the rows below it
+DATA_START_INDEX = 2
+
+# Rows parsed per chunk by the CSV reader
+CSV_CHUNK_ROWS = 5000
+
+# Bytes read at a time when counting the lines of a CSV file
+CSV_COUNT_BLOCK_BYTES = 1024 * 1024
+
+# Bytes and lines of a CSV file inspected to detect its dialect
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_SNIFF_LINES = 20
+
+# Byte order marks, then encodings tried in order on the sniffed prefix
+CSV_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+CSV_ENCODINGS = ('utf-8', 'windows-1252')
+CSV_FALLBACK_ENCODING = 'latin-1'
+CSV_SEPARATORS = (',', ';', '\t')
+
+# Detected separators kept per header signature
+CSV_DIALECT_CACHE_SIZE = 256
+
+CsvDialect = namedtuple('CsvDialect', ['encoding', 'separator', 'column_count', 'header'])
+
+_dialect_cache = OrderedDict()
+_dialect_cache_lock = threading.Lock()
+
+
+def read_client_rows(source, file_ext=None, stats=None):
+    """
+    Lazily yield (row_index, (name, address, breeder_card, quantity)) for every data row.
+
+    source is a file path, or a seekable binary file object together with its
+    file_ext. row_index counts data rows below the header, starting at
+    DATA_START_INDEX. The columns are resolved from the header row; the
+    mapping used is recorded as stats.columns, and the number of data rows
+    the file declares as stats.rows_expected, when stats is given. Raises
+    ValueError when the file has too few rows or a field has no column.
+    """
+    header, column_count, row_count, project, close = open_workbook(source, file_ext)
+    try:
+        mapping = workbook_columns(header, column_count, PROJECTED_COLUMNS)
+    except Exception:
+        # The rows will never be read, release the workbook now
+        close()
+        raise
+    if stats is not None:
+        stats.columns = mapping
+        stats.rows_expected = max(row_count - DATA_START_INDEX, 0) if row_count is not None else None
+    rows = project(tuple(mapping['columns'][field] for field in FIELDS))
+
+    row_count = 0
+    for row_index, values in enumerate(rows):
+        row_count += 1
+        if row_index >= DATA_START_INDEX:
+            yield row_index, values
+
+    if row_count == 0:
+        raise ValueError("Le fichier est vide ou ne contient pas de données valides.")
+    if row_count <= DATA_START_INDEX:
+        raise ValueError(f"Le fichier n'a que {row_count} lignes. Au moins 3 lignes sont requises.")
+
+
+def open_workbook(source, file_ext=None):
+    """
+    Open a workbook and return (header, column_count, row_count, project, close).
+
+    header holds the cells of the first row; row_count is the number of rows
+    below it the file declares, None when it does not tell, and an upper bound
+    of the rows yielded; project(columns) yields, for each row below the
+    header, the values of those column indices in that order, and releases
+    the workbook once exhausted or closed. close releases it when the rows are
+    not going to be read.
+    """
+    if file_ext is None:
+        file_ext = os.fspath(source).lower().split('.')[-1]
+    file_ext = file_ext.lower().lstrip('.')
+    if file_ext in ('xlsx', 'xlsm'):
+        return _open_openpyxl(source)
+    if file_ext == 'csv':
+        return _open_csv(source)
+    if file_ext == 'xls':
+        return _open_xlrd(source)
+    if file_ext == 'ods':
+        return _open_odf(source)
+    if file_ext == 'xlsb':
+        return _open_pyxlsb(source)
+    raise ValueError(f"Format de fichier non pris en charge: .{file_ext}")
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _nothing_to_close():
+    pass
+
+
+def _project(row, columns):
+    """Pick the values of columns out of a full row, padding short rows with None."""
+    width = len(row)
+    return tuple(row[index] if index < width else None for index in columns)
+
+
+def _open_openpyxl(source):
+    """Stream an .xlsx/.xlsm sheet with openpyxl's read-only mode."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+        # Without a dimension record in the file, fall back to the header row width
+        column_count = sheet.max_column or len(header)
+        row_count = sheet.max_row - 1 if sheet.max_row else None
+    except Exception:
+        workbook.close()
+        raise
+
+    def rows(columns):
+        try:
+            for row in sheet.iter_rows(min_row=2, max_col=max(columns) + 1, values_only=True):
+                yield _project(row, columns)
+        finally:
+            workbook.close()
+
+    return header, column_count, row_count, rows, workbook.close
+
+
+def sniff_csv_dialect(source):
+    """
+    Detect the encoding and separator of a CSV file or binary file object from a bounded prefix.
+
+    Returns a CsvDialect, with the cells of the header line. The encoding is
+    always detected from the file's own bytes, since the same header may head
+    files saved in different encodings; the separator is cached by the hash
+    of the raw header line since suppliers send the same format every month.
+    """
+    if _is_path(source):
+        with open(source, 'rb') as f:
+            prefix = f.read(CSV_SNIFF_BYTES)
+    else:
+        position = source.tell()
+        prefix = source.read(CSV_SNIFF_BYTES)
+        source.seek(position)
+    if not prefix.strip():
+        raise ValueError("Impossible de lire le fichier CSV: le fichier est vide.")
+
+    encoding = _detect_encoding(prefix)
+    # The last line of the prefix may be cut, keep complete lines only
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(prefix, final=False)
+    lines = text.splitlines()
+    if len(lines) > 1 and len(prefix) == CSV_SNIFF_BYTES:
+        lines = lines[:-1]
+
+    header_end = prefix.find(b'\n')
+    signature = hashlib.sha1(prefix if header_end < 0 else prefix[:header_end]).hexdigest()
+    with _dialect_cache_lock:
+        separator = _dialect_cache.get(signature)
+        if separator is not None:
+            _dialect_cache.move_to_end(signature)
+    if separator is None:
+        separator, _ = _detect_separator(lines[:CSV_SNIFF_LINES])
+        with _dialect_cache_lock:
+            _dialect_cache[signature] = separator
+            if len(_dialect_cache) > CSV_DIALECT_CACHE_SIZE:
+                _dialect_cache.popitem(last=False)
+        logger.info(f"Detected CSV dialect: encoding {encoding}, separator '{separator}'")
+    else:
+        logger.info(f"CSV separator from cache: '{separator}', encoding {encoding}")
+    header = next(csv.reader(lines[:1], delimiter=separator), [])
+    return CsvDialect(encoding, separator, len(header), tuple(header))
+
+
+def _detect_encoding(prefix):
+    """Guess the encoding of a CSV prefix, honouring byte order marks."""
+    for bom, encoding in CSV_BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    for encoding in CSV_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CSV_FALLBACK_ENCODING
+
+
+def _detect_separator(lines):
+    """Pick the separator giving the widest, most consistent rows; returns (separator, column_count)."""
+    best = (CSV_SEPARATORS[0], 0, 0)
+    for separator in CSV_SEPARATORS:
+        widths = [len(fields) for fields in csv.reader(lines, delimiter=separator)]
+        if not widths:
+            continue
+        header_width = widths[0]
+        consistent = sum(1 for width in widths if width == header_width)
+        if (header_width, consistent) > best[1:]:
+            best = (separator, header_width, consistent)
+    return best[0], best[1]
+
+
+def _count_csv_lines(source):
+    """Number of lines of a CSV file or binary file object, counting the line breaks; a file object is rewound."""
+    f = open(source, 'rb') if _is_path(source) else source
+    position = None if _is_path(source) else f.tell()
+    lines = 0
+    last = b'\n'
+    try:
+        for block in iter(lambda: f.read(CSV_COUNT_BLOCK_BYTES), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    finally:
+        if position is None:
+            f.close()
+        else:
+            f.seek(position)
+    # A last line without a line break
+    return lines + (last != b'\n')
+
+
+def _open_csv(source):
+    """Stream a CSV file in chunks, parsing only the projected columns with the sniffed dialect."""
+    import pandas as pd
+
+    dialect = sniff_csv_dialect(source)
+    start = None if _is_path(source) else source.tell()
+    # Quoted line breaks and blank lines make this an upper bound of the rows
+    row_count = max(_count_csv_lines(source) - 1, 0)
+
+    def read_chunks(encoding, columns):
+        if start is not None:
+            source.seek(start)
+        # usecols keeps file order, rows are put back in field order when it differs
+        file_order = sorted(set(columns))
+        reorder = None
+        if list(columns) != file_order:
+            reorder = itemgetter(*(file_order.index(index) for index in columns))
+        chunks = pd.read_csv(
+            source,
+            encoding=encoding,
+            sep=dialect.separator,
+            usecols=file_order,
+            dtype=object,
+            chunksize=CSV_CHUNK_ROWS
+        )
+        with chunks:
+            for chunk in chunks:
+                if reorder is None:
+                    yield from chunk.itertuples(index=False, name=None)
+                else:
+                    yield from map(reorder, chunk.itertuples(index=False, name=None))
+
+    def rows(columns):
+        yielded = 0
+        try:
+            for row in read_chunks(dialect.encoding, columns):
+                yielded += 1
+                yield row
+        except UnicodeDecodeError as e:
+            # The sniffed prefix was valid but a later line is not: resume with a single-byte encoding
+            logger.warning(f"CSV is not valid {dialect.encoding} past the sniffed prefix ({e}), retrying as {CSV_FALLBACK_ENCODING}")
+            for row_index, row in enumerate(read_chunks(CSV_FALLBACK_ENCODING, columns)):
+                if row_index >= yielded:
+                    yield row
+
+    return dialect.header, dialect.column_count, row_count, rows, _nothing_to_close
+
+
+def _open_xlrd(source):
+    """Read an .xls sheet cell by cell with xlrd, touching only the projected columns."""
+    import xlrd
+
+    if _is_path(source):
+        book = xlrd.open_workbook(source, on_demand=True)
+    else:
+        book = xlrd.open_workbook(file_contents=source.read(), on_demand=True)
+
+    def cell_value(row_index, col_index):
+        if col_index >= sheet.row_len(row_index):
+            return None
+        cell = sheet.cell(row_index, col_index)
+        return None if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK) else cell.value
+
+    try:
+        sheet = book.sheet_by_index(0)
+        header = [cell_value(0, col_index) for col_index in range(sheet.row_len(0))] if sheet.nrows else []
+    except Exception:
+        book.release_resources()
+        raise
+
+    def rows(columns):
+        try:
+            for row_index in range(1, sheet.nrows):
+                yield tuple(cell_value(row_index, col_index) for col_index in columns)
+        finally:
+            book.release_resources()
+
+    return header, sheet.ncols, max(sheet.nrows - 1, 0), rows, book.release_resources
+
+
+def _open_odf(source):
+    """Read an .ods sheet, then keep only the projected columns."""
+    import pandas as pd
+
+    # The odf engine parses every cell anyway, the columns are chosen once the
+    # header is known; with header=None the column labels are the positional indices
+    df = pd.read_excel(source, engine='odf', header=None)
+    header = df.iloc[0].tolist() if len(df) else []
+
+    def rows(columns):
+        # Missing columns come out as NaN, like the short rows of the other readers
+        yield from df.reindex(columns=list(columns)).iloc[1:].itertuples(index=False, name=None)
+
+    return header, df.shape[1], max(len(df) - 1, 0), rows, _nothing_to_close
+
+
+def _open_pyxlsb(source):
+    """Stream an .xlsb sheet with pyxlsb."""
+    try:
+        from pyxlsb import open_workbook as open_xlsb
+    except ImportError:
+        raise ValueError("La lecture des fichiers .xlsb nécessite le paquet pyxlsb.")
+
+    # open_workbook goes through ZipFile, which accepts paths and file objects
+    workbook = open_xlsb(source)
+    sheet = None
+
+    def close():
+        if sheet is not None:
+            sheet.close()
+        workbook.close()
+
+    try:
+        sheet = workbook.get_sheet(1)
+        rows_iter = sheet.rows()
+        header = next(rows_iter, [])
+        dimension = sheet.dimension
+        column_count = dimension.c + dimension.w if dimension else len(header)
+        row_count = dimension.r + dimension.h - 1 if dimension else None
+    except Exception:
+        close()
+        raise
+
+    def rows(columns):
+        try:
+            for row in rows_iter:
+                yield _project([cell.v for cell in row], columns)
+        finally:
+            close()
+
+    return [cell.v for cell in header], column_count, row_count, rows, close